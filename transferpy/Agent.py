@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+
+from transferpy.RemoteScript import RemoteScript
+
+# Moves a stream between two hosts, in place of nc. The stream is framed:
+# every chunk of data goes after a header with its length, and the sender
+# ends it with the total number of bytes sent and their CRC-32, or with an
+# error message if it could not read all its input; the receiver checks
+# both and acknowledges the end once everything is written. So a copy cut
+# short or corrupted, on either side, fails on both.
+# Files are sent with sendfile, straight from the page cache to the socket,
+# and written with splice, from the socket to the file through a pipe,
+# without copying them through user space when the platform supports it;
+# their CRC is computed reading them back from the page cache.
+AGENT_SCRIPT = r'''
+import base64
+import fcntl
+import json
+import os
+import select
+import socket
+import stat
+import struct
+import sys
+import zlib
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+HEADER = struct.Struct('!BQ')
+CRC = struct.Struct('!I')
+DATA, END, ERROR = 0, 1, 2
+ACK = b'\0'
+F_SETPIPE_SZ = 1031
+
+
+class StreamError(Exception):
+    pass
+
+
+def wait(sock, write=False):
+    ready = select.select([] if write else [sock], [sock] if write else [], [],
+                          arguments['timeout'])
+    if not any(ready):
+        raise StreamError('no data moved for {} seconds'.format(arguments['timeout']))
+
+
+def receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        wait(sock)
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise StreamError('connection closed before the end of the stream')
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, kind, length, payload=b''):
+    wait(sock, write=True)
+    sock.sendall(HEADER.pack(kind, length) + payload)
+
+
+def file_crc(fd, offset, length, crc):
+    while length:
+        data = os.pread(fd, min(length, arguments['buffer_size']), offset)
+        if not data:
+            raise StreamError('the file ended before the range to send')
+        crc = zlib.crc32(data, crc)
+        offset += len(data)
+        length -= len(data)
+    return crc
+
+
+def send_file(sock, fd, offset, length):
+    sent = 0
+    crc = 0
+    while sent < length:
+        size = min(arguments['frame_size'], length - sent)
+        send_frame(sock, DATA, size)
+        done = 0
+        while done < size:
+            wait(sock, write=True)
+            count = os.sendfile(sock.fileno(), fd, offset + sent + done, size - done)
+            if count == 0:
+                raise StreamError('the file ended before the range to send')
+            done += count
+        crc = file_crc(fd, offset + sent, size, crc)
+        sent += size
+    return sent, crc
+
+
+def send_stream(sock, stream):
+    buffer = bytearray(arguments['buffer_size'])
+    view = memoryview(buffer)
+    sent = 0
+    crc = 0
+    while True:
+        count = stream.readinto(buffer)
+        if not count:
+            return sent, crc
+        send_frame(sock, DATA, count)
+        wait(sock, write=True)
+        sock.sendall(view[:count])
+        crc = zlib.crc32(view[:count], crc)
+        sent += count
+
+
+def send():
+    sock = socket.create_connection((arguments['host'], arguments['port']),
+                                    timeout=arguments['timeout'])
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, arguments['socket_buffer'])
+    sock.settimeout(None)
+    try:
+        if arguments['file'] is not None:
+            fd = os.open(arguments['file'], os.O_RDONLY)
+            length = arguments['length']
+            if length is None:
+                length = os.fstat(fd).st_size - arguments['offset']
+            sent, crc = send_file(sock, fd, arguments['offset'], length)
+        else:
+            sent, crc = send_stream(sock, sys.stdin.buffer)
+    except (OSError, StreamError) as error:
+        message = str(error).encode('utf-8', 'replace')
+        try:
+            send_frame(sock, ERROR, len(message), message)
+        except (OSError, StreamError):
+            pass
+        raise
+    send_frame(sock, END, sent, CRC.pack(crc))
+    if receive_exactly(sock, len(ACK)) != ACK:
+        raise StreamError('the receiver did not acknowledge the stream')
+
+
+def splice_to(sock, pipe, out_fd, size, crc):
+    read_end, write_end = pipe
+    position = os.lseek(out_fd, 0, os.SEEK_CUR)
+    remaining = size
+    while remaining:
+        wait(sock)
+        count = os.splice(sock.fileno(), write_end, min(remaining, arguments['buffer_size']))
+        if count == 0:
+            raise StreamError('connection closed before the end of the stream')
+        remaining -= count
+        while count:
+            count -= os.splice(read_end, out_fd, count)
+    return file_crc(out_fd, position, size, crc)
+
+
+def receive_to(sock, out_fd, size, buffer, pipe, crc):
+    if pipe is not None:
+        return splice_to(sock, pipe, out_fd, size, crc)
+    view = memoryview(buffer)
+    while size:
+        wait(sock)
+        count = sock.recv_into(view[:min(size, len(buffer))])
+        if count == 0:
+            raise StreamError('connection closed before the end of the stream')
+        written = 0
+        while written < count:
+            written += os.write(out_fd, view[written:count])
+        crc = zlib.crc32(view[:count], crc)
+        size -= count
+    return crc
+
+
+def receive():
+    listener = socket.socket(socket.AF_INET6 if ':' in arguments['bind'] else socket.AF_INET)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, arguments['socket_buffer'])
+    listener.bind((arguments['bind'], arguments['port']))
+    listener.listen(1)
+    listener.settimeout(arguments['timeout'])
+    try:
+        sock, _ = listener.accept()
+    except socket.timeout:
+        raise StreamError('no connection for {} seconds'.format(arguments['timeout']))
+    listener.close()
+    sock.settimeout(None)
+
+    if arguments['file'] is not None:
+        # read back too, for the CRC
+        flags = os.O_RDWR | os.O_CREAT
+        if arguments['offset'] is None:
+            flags |= os.O_TRUNC
+        out_fd = os.open(arguments['file'], flags, 0o666)
+        os.lseek(out_fd, arguments['offset'] or 0, os.SEEK_SET)
+    else:
+        out_fd = sys.stdout.fileno()
+    # only regular files are spliced, so what was written can be read back
+    # for the CRC
+    pipe = None
+    if hasattr(os, 'splice') and stat.S_ISREG(os.fstat(out_fd).st_mode):
+        pipe = os.pipe()
+        try:
+            fcntl.fcntl(pipe[1], F_SETPIPE_SZ, arguments['buffer_size'])
+        except OSError:
+            pass
+    buffer = bytearray(arguments['buffer_size'])
+
+    received = 0
+    crc = 0
+    while True:
+        kind, length = HEADER.unpack(receive_exactly(sock, HEADER.size))
+        if kind == DATA:
+            crc = receive_to(sock, out_fd, length, buffer, pipe, crc)
+            received += length
+        elif kind == END:
+            sent_crc, = CRC.unpack(receive_exactly(sock, CRC.size))
+            if length != received:
+                raise StreamError('received {} bytes of {}'.format(received, length))
+            if sent_crc != crc:
+                raise StreamError('the CRC of the stream does not match, it was corrupted')
+            if arguments['file'] is not None:
+                os.fsync(out_fd)
+            sock.sendall(ACK)
+            return
+        elif kind == ERROR:
+            raise StreamError('the sender failed: {}'.format(
+                receive_exactly(sock, length).decode('utf-8', 'replace')))
+        else:
+            raise StreamError('invalid frame')
+
+
+try:
+    if arguments['mode'] == 'send':
+        send()
+    else:
+        receive()
+except (OSError, StreamError) as error:
+    sys.stderr.write('transferpy agent: {}\n'.format(error))
+    sys.exit(1)
+'''
+
+
+class Agent(object):
+    """
+    Class to move the copies between hosts with a small Python agent, run
+    on both ends of every connection in place of nc. It frames the stream so
+    copies cut short, or corrupted on their way, are detected on both ends,
+    uses large socket buffers, and moves plain files with sendfile and
+    splice. The stream is checked with a CRC-32, which detects corruption
+    but is not a cryptographic digest. Compression and
+    encryption stay on their own processes on the pipeline, which use
+    several cores.
+    """
+    def __init__(self, timeout=300):
+        """
+        Initialize the instance variables.
+
+        :param timeout: seconds without moving data (or without a connection,
+                        when receiving) before a copy is failed
+        """
+        self.timeout = timeout
+        # bytes of the socket buffers, and of the data read or written at once
+        self.socket_buffer = 4 * 1024 * 1024
+        self.buffer_size = 1024 * 1024
+        # bytes of file sent per frame with sendfile
+        self.frame_size = 64 * 1024 * 1024
+        self.script = RemoteScript(AGENT_SCRIPT)
+
+    def arguments(self, mode, port, host=None, file=None, offset=None, length=None,
+                  bind='0.0.0.0'):
+        return {'mode': mode, 'host': host, 'port': port, 'file': file, 'offset': offset,
+                'length': length, 'bind': bind, 'timeout': self.timeout,
+                'socket_buffer': self.socket_buffer, 'buffer_size': self.buffer_size,
+                'frame_size': self.frame_size}
+
+    def send_command(self, target_host, port, file=None, offset=0, length=None):
+        """
+        Returns the shell command sending its standard input, or the given
+        file, to the receiver on target_host:port.
+
+        :param file: path of a file to send instead of the standard input
+        :param offset: byte of the file to start sending from
+        :param length: bytes of the file to send, up to its end if not given
+        """
+        return self.script.filter_command(self.arguments('send', port, host=target_host,
+                                                         file=file, offset=offset,
+                                                         length=length))
+
+    def receive_command(self, port, file=None, offset=None):
+        """
+        Returns the shell command receiving a stream on port, and writing it
+        to its standard output or to the given file.
+
+        :param file: path of a file to write the stream to
+        :param offset: byte of the file to write the stream from, without
+                       truncating it; if not given, the file is truncated
+        """
+        return self.script.filter_command(self.arguments('receive', port, file=file,
+                                                         offset=offset))
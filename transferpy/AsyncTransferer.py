@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from transferpy.Transferer import Transferer
+
+
+class AsyncTransferer(Transferer):
+    """
+    Transferer run as a coroutine on an asyncio event loop, so many transfers
+    can share a single loop, e.g. with
+    asyncio.gather(*[transferer.run_async() for transferer in transferers]).
+    The copies to every target are coroutines awaiting the *_async methods of
+    the remote executor, and each target has its firewall closed and its copy
+    verified as soon as its own copy ends, while the other targets are still
+    being copied.
+    A copy does not hold any thread of the loop's default executor while it
+    runs with the Cumin and Paramiko executors, whose commands run on their
+    own threads and are awaited until they signal their end; the SSH, Salt
+    and local executors hold one of them while waiting for the receiver.
+    The steps that already batch all the hosts on a single remote execution
+    call (preflight checks, firewall setup, verification) are short, and run
+    on the default executor, which has min(32, cpus + 4) threads.
+    The chained, multistream and sharded copies block a thread for as long
+    as they run, so each transfer runs them on its own executor, with a
+    thread per concurrent copy.
+    """
+    # executor of the blocking copies of a transfer, created by run_async
+    copy_executor = None
+
+    async def in_executor(self, function, *args, executor=None):
+        """
+        Runs a blocking method on the given executor, by default the one of
+        the running loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+    async def is_listening_async(self, host, port):
+        """
+        Coroutine version of is_listening.
+        """
+        result = await self.remote_executor.run_async(host, self.listening_command(port))
+        return result.returncode == 0
+
+    async def wait_for_listener_async(self, host, port, job):
+        """
+        Coroutine version of wait_for_listener, sleeping on the loop between
+        checks.
+        """
+        deadline = time.monotonic() + self.options['listen_timeout']
+        interval = self.listen_check_interval
+        while True:
+            if await self.is_listening_async(host, port):
+                return True
+            if self.remote_executor.monitor_job(host, job).returncode is not None:
+                self.logger.error('Receiver on {}:{} finished before listening'.format(host, port))
+                return False
+            if time.monotonic() >= deadline:
+                self.logger.error('Receiver on {}:{} was not listening after {} seconds'
+                                  .format(host, port, self.options['listen_timeout']))
+                return False
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.listen_check_max_interval)
+
+    async def send_async(self, src_command, port, targets):
+        """
+        Coroutine version of send, sleeping on the loop between the progress
+        reports and bandwidth limit checks.
+        """
+        if not self.options['progress'] and self.options['bwlimit_file'] is None:
+            return await self.remote_executor.run_async(self.source_host, src_command)
+        if self.options['progress']:
+            self.progress.start(port)
+        limit_version = self.bandwidth_limiter.version
+        job = await self.remote_executor.start_job_async(self.source_host, src_command)
+        next_report = time.monotonic() + self.options['progress_interval']
+        while True:
+            result = self.remote_executor.monitor_job(self.source_host, job)
+            if result.returncode is not None:
+                return result
+            if self.options['progress'] and time.monotonic() >= next_report:
+                await self.in_executor(self.report_progress, port, targets)
+                next_report = time.monotonic() + self.options['progress_interval']
+            self.reload_bandwidth_limits()
+            if self.bandwidth_limiter.version != limit_version:
+                limit_version = self.bandwidth_limiter.version
+                await self.in_executor(self.adjust_bandwidth, targets[0][0], port)
+            await asyncio.sleep(self.job_check_interval)
+
+    async def copy_to_async(self, target_host, target_path, port=None):
+        """
+        Coroutine version of copy_to.
+        """
+        if port is None:
+            port = self.options['port']
+        resume_point = self.resume_points.get((target_host, target_path))
+        src_command = self.sender_command(target_host, port, resume_point)
+        dst_command = self.receiver_command(target_path, port, resume_point=resume_point)
+
+        job = await self.remote_executor.start_job_async(target_host, dst_command)
+        if not await self.wait_for_listener_async(target_host, port, job):
+            self.remote_executor.kill_job(target_host, job)
+            await self.in_executor(self.end_progress, port, [(target_host, port)], False)
+            return 1
+        result = await self.send_async(src_command, port, [(target_host, port)])
+        if result.returncode != 0:
+            self.remote_executor.kill_job(target_host, job)
+        else:
+            await self.remote_executor.wait_job_async(target_host, job)
+        await self.in_executor(self.end_progress, port, [(target_host, port)],
+                               result.returncode == 0)
+        return result.returncode
+
+    async def transfer_to_async(self, semaphore, copy, target, rule, port):
+        """
+        Copies the source to a target once the semaphore allows it, then
+        closes its firewall and verifies its copy.
+
+        :param semaphore: asyncio.Semaphore limiting the concurrent copies
+        :param copy: coroutine function copying to a target, like copy_to_async
+        :param target: (target_host, target_path) tuple
+        :param rule: (target_host, allowed_host) firewall rule of the target
+        :param port: port, or list of ports, opened for the target
+        :return: after_transfer_checks result of the target
+        """
+        try:
+            async with semaphore:
+                result = await copy(target[0], target[1], port)
+        finally:
+            await self.in_executor(self.close_firewalls, [rule], [port])
+        checks = await self.in_executor(self.verify_targets, [result], [target], [port])
+        return checks[0]
+
+    async def run_async(self):
+        """
+        Coroutine version of run, returning the same array of exit codes, one
+        per target host. Up to the parallel_targets option targets are copied
+        at once, like on run.
+        """
+        try:
+            # pre-execution sanity checks
+            try:
+                await self.in_executor(self.sanity_checks)
+            except ValueError as e:
+                self.logger.error("{}".format(str(e)))
+                return [-1]
+
+            # stop slave if requested
+            if self.options.get('stop_slave', False):
+                result = await self.in_executor(self.mariadb.stop_replication,
+                                                self.source_host, self.source_path)
+                if result != 0:
+                    self.logger.error("Stop slave failed")
+                    return [-2]
+
+            self.logger.info('About to transfer {} from {} to {}:{} ({} bytes)'
+                             .format(self.source_path, self.source_host,
+                                     self.target_hosts, self.target_paths,
+                                     self.original_size))
+
+            targets = list(zip(self.target_hosts, self.target_paths))
+            chain = self.options['chain'] and len(targets) > 1
+            rules = self.firewall_rules(chain)
+            # every copy closes its firewall when it ends, even if it raises,
+            # and the temporary lists are removed in any case
+            try:
+                # multistream and sharded copies have a port per stream, and
+                # block on their own threads
+                if self.is_sharded:
+                    await self.in_executor(self.split_in_shards)
+                if self.is_multistream:
+                    ports = await self.in_executor(self.open_firewalls, rules,
+                                                   self.options['streams'])
+                    copy = self.blocking_copy(self.multistream_copy_to)
+                elif self.is_sharded:
+                    ports = await self.in_executor(self.open_firewalls, rules, len(self.shards))
+                    copy = self.blocking_copy(self.sharded_copy_to)
+                else:
+                    ports = await self.in_executor(self.open_firewalls, rules)
+                    copy = self.copy_to_async
+
+                parallel_targets = self.options['parallel_targets']
+                if parallel_targets <= 0 or parallel_targets > len(targets):
+                    parallel_targets = len(targets)
+                self.concurrent_copies = 1 if chain else parallel_targets
+                self.copy_executor = ThreadPoolExecutor(max_workers=self.concurrent_copies)
+                if chain:
+                    self.logger.info('Transferring as a chain: {}'.format(
+                        ' -> '.join([self.source_host] + self.target_hosts)))
+                    try:
+                        results = await self.in_executor(
+                            self.chain_copy_to, [(target_host, target_path, port, relay_port)
+                                                 for (target_host, target_path), port, relay_port
+                                                 in zip(targets, ports, ports[1:] + [None])],
+                            executor=self.copy_executor)
+                    finally:
+                        await self.in_executor(self.close_firewalls, rules, ports)
+                    # on a chain, the source only sends the stream to the first target
+                    transfer_sucessful = await self.in_executor(self.verify_targets, results,
+                                                                targets, ports,
+                                                                [ports[0]] * len(ports))
+                else:
+                    if parallel_targets > 1:
+                        self.logger.info('Transferring to up to {} targets concurrently'
+                                         .format(parallel_targets))
+                    semaphore = asyncio.Semaphore(parallel_targets)
+                    # all the copies end, closing their firewalls, before an
+                    # error of any of them is raised
+                    transfer_sucessful = list(await asyncio.gather(
+                        *[self.transfer_to_async(semaphore, copy, target, rule, port)
+                          for target, rule, port in zip(targets, rules, ports)],
+                        return_exceptions=True))
+                    for result in transfer_sucessful:
+                        if isinstance(result, BaseException):
+                            raise result
+            finally:
+                if self.copy_executor is not None:
+                    self.copy_executor.shutdown(wait=False)
+                    self.copy_executor = None
+                await self.in_executor(self.remove_shards)
+                await self.in_executor(self.remove_sync_lists)
+            if self.is_resumable:
+                await self.in_executor(self.finish_resume, targets, transfer_sucessful)
+
+            if self.options.get('stop_slave', False):
+                result = await self.in_executor(self.mariadb.start_replication,
+                                                self.source_host, self.source_path)
+                if result != 0:
+                    self.logger.error("Start slave failed")
+                    return [-3]
+
+            if hasattr(self.remote_executor, 'stats_summary'):
+                self.logger.debug('Remote execution: {}'.format(self.remote_executor.stats_summary()))
+
+            return transfer_sucessful
+        finally:
+            await self.in_executor(self.remote_executor.close)
+
+    def blocking_copy(self, copy):
+        """
+        Returns a coroutine function running the given blocking copy method
+        on the executor of the copies of the transfer.
+        """
+        async def copy_async(target_host, target_path, port):
+            return await self.in_executor(copy, target_host, target_path, port,
+                                          executor=self.copy_executor)
+        return copy_async
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+import os
+import re
+import threading
+
+from transferpy.RemoteScript import session_id
+
+# pv and rsync units: powers of 1024
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_rate(rate):
+    """
+    Parses a bandwidth limit.
+
+    :param rate: bytes per second, optionally followed by K, M, G or T (powers
+                 of 1024), like 500K or 1.5G. 0 means no limit
+    :return: bytes per second, as an integer
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(rate), re.IGNORECASE)
+    if match is None:
+        raise ValueError('invalid bandwidth limit {}'.format(rate))
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2).upper()])
+
+
+class BandwidthLimiter(object):
+    """
+    Class to limit the bandwidth the source uses to send the copies, with a
+    pv rate limit on every sender pipeline, after compression and encryption.
+    The limits can be changed while the copies run by editing a control file,
+    which are then applied to the running pv processes with pv -R.
+    """
+    def __init__(self, remote_execution, limit=None, target_limits=None, control_file=None,
+                 session=None):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        :param limit: bytes per second the source sends in total, None for no limit
+        :param target_limits: dictionary of the bytes per second sent to each target host
+        :param control_file: path of a local file the limits are read from while
+                             the copies run: a line with the total limit and/or
+                             lines with a target host and its limit, all of them
+                             in parse_rate format
+        :param session: string identifying the transfer on the pid file names,
+                        a random one if not given
+        """
+        self.remote_executor = remote_execution
+        self.limit = limit or None
+        self.target_limits = {host: rate for host, rate in (target_limits or {}).items() if rate}
+        self.control_file = control_file
+        self.session = session_id(session)
+        # incremented every time the limits change
+        self.version = 0
+        self._control_file_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """
+        Property: whether the copies are sent through a rate limiter.
+        """
+        return bool(self.limit or self.target_limits or self.control_file)
+
+    def rate(self, target_hosts, concurrent_copies=1):
+        """
+        Returns the limit of a copy sent to the given targets.
+
+        :param target_hosts: hosts the copy goes through; a chain moves at the
+                             pace of its slowest link, so all its targets are given
+        :param concurrent_copies: copies sharing the total limit
+        :return: bytes per second, 0 for no limit
+        """
+        with self._lock:
+            rates = [self.target_limits[host] for host in target_hosts if host in self.target_limits]
+            if self.limit:
+                rates.append(self.limit // max(concurrent_copies, 1))
+        return max(min(rates), 1) if rates else 0
+
+    def pid_path(self, port):
+        """
+        Returns the path of the pid file of the rate limiter of the copy on port.
+        """
+        return '/tmp/transferpy.{}.{}.pv.pid'.format(self.session, port)
+
+    def limit_command(self, port, rate):
+        """
+        Returns the pipeline fragment limiting the copy on port to the given
+        rate, or an empty string if the copies are not limited.
+        """
+        if not self.enabled:
+            return ''
+        return '| /usr/bin/pv -q -L {} -P {}'.format(rate, self.pid_path(port))
+
+    def update_command(self, port, rate):
+        """
+        Returns the command that changes the rate of the running limiter of
+        the copy on port; 0 removes the limit.
+        """
+        return ['/bin/bash', '-c', r'"/usr/bin/pv -R $(/bin/cat {}) -L {}"'
+                .format(self.pid_path(port), rate)]
+
+    def reload(self):
+        """
+        Reads the control file again if it changed since the last time.
+
+        :return: whether the limits changed
+        """
+        if self.control_file is None:
+            return False
+        with self._lock:
+            try:
+                mtime = os.stat(self.control_file).st_mtime
+            except OSError:
+                return False
+            if mtime == self._control_file_mtime:
+                return False
+            self._control_file_mtime = mtime
+            limit = None
+            target_limits = {}
+            with open(self.control_file) as f:
+                for line in f:
+                    fields = line.split('#')[0].split()
+                    if len(fields) == 1:
+                        limit = parse_rate(fields[0]) or None
+                    elif len(fields) == 2 and parse_rate(fields[1]):
+                        target_limits[fields[0]] = parse_rate(fields[1])
+                    elif len(fields) > 2:
+                        raise ValueError('invalid bandwidth limit line: {}'.format(line.strip()))
+            if (limit, target_limits) == (self.limit, self.target_limits):
+                return False
+            self.limit = limit
+            self.target_limits = target_limits
+            self.version += 1
+            return True
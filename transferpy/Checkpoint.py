@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import json
+import os.path
+
+from transferpy.RemoteScript import RemoteScript
+
+# Writes its standard input into a file from the given offset, and records
+# on the checkpoint file how many bytes of it are on disk every interval
+# bytes, after they are synced. The file is truncated where the input ends.
+WRITER_SCRIPT = r'''
+import base64
+import json
+import os
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+state = arguments['state']
+chunk_size = 1024 * 1024
+
+
+def save(written):
+    state['written'] = written
+    temporary_path = arguments['checkpoint'] + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary_path, arguments['checkpoint'])
+
+
+written = arguments['offset']
+unsynced = 0
+with os.fdopen(os.open(arguments['path'], os.O_WRONLY | os.O_CREAT, 0o666), 'wb') as f:
+    f.seek(written)
+    save(written)
+    for chunk in iter(lambda: sys.stdin.buffer.read(chunk_size), b''):
+        f.write(chunk)
+        written += len(chunk)
+        unsynced += len(chunk)
+        if unsynced >= arguments['interval']:
+            f.flush()
+            os.fsync(f.fileno())
+            save(written)
+            unsynced = 0
+    f.truncate(written)
+    f.flush()
+    os.fsync(f.fileno())
+save(written)
+'''
+
+# Prints the md5 of the given byte ranges of a file, read one after another
+RANGES_HASH_SCRIPT = r'''
+import base64
+import hashlib
+import json
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+digest = hashlib.md5()
+with open(arguments['path'], 'rb') as f:
+    for offset, length in arguments['ranges']:
+        f.seek(offset)
+        data = f.read(length)
+        if len(data) != length:
+            sys.exit(1)
+        digest.update(data)
+print(json.dumps(digest.hexdigest()))
+'''
+
+
+class Checkpoint(object):
+    """
+    Class to make copies resumable. A checkpoint file next to the copy on
+    the target marks it as partial and records its source:
+
+    - a file is written by a writer that also records on the checkpoint how
+      many bytes of it were synced to disk, and a resumed copy sends only
+      the bytes after those, once a sample of them matches the source.
+    - tar restores the modification time of a file only once it is fully
+      written, so the files of a partial directory with the size and time
+      of the source ones are complete, and a resumed copy is a sync (see
+      Syncer) sending a tar of the rest.
+    """
+    def __init__(self, remote_execution):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        """
+        self.remote_executor = remote_execution
+        # bytes of a file written between checkpoints
+        self.interval = 64 * 1024 * 1024
+        # blocks of the written part of a file compared before resuming it
+        self.sample_blocks = 16
+        self.block_size = 1024 * 1024
+        self.writer_script = RemoteScript(WRITER_SCRIPT)
+        self.ranges_hash_script = RemoteScript(RANGES_HASH_SCRIPT)
+
+    @staticmethod
+    def path(target_path, source_path):
+        """
+        Returns the path of the checkpoint of the copy of source_path inside
+        the target_path directory.
+        """
+        return os.path.join(os.path.normpath(target_path),
+                            '.{}.transferpy-checkpoint'.format(
+                                os.path.basename(os.path.normpath(source_path))))
+
+    @staticmethod
+    def state(source_host, source_path, size):
+        """
+        Returns the state a checkpoint starts with.
+        """
+        return {'source_host': source_host, 'source_path': source_path, 'size': size,
+                'written': 0}
+
+    @staticmethod
+    def write_command(path, state):
+        """
+        Returns the command that writes a checkpoint.
+        """
+        return ['/bin/bash', '-c', r'"/bin/echo {} | /usr/bin/base64 -d > {}"'
+                .format(RemoteScript.encode(json.dumps(state)), path)]
+
+    @staticmethod
+    def read_command(path):
+        """
+        Returns the command that prints a checkpoint.
+        """
+        return ['/bin/cat', path]
+
+    @staticmethod
+    def parse(result):
+        """
+        Parses the result of a read_command.
+
+        :return: checkpoint state dictionary, or None if it could not be read
+        """
+        return RemoteScript(None).parse(result)
+
+    @staticmethod
+    def remove_command(path):
+        """
+        Returns the command that removes a checkpoint.
+        """
+        return ['/bin/rm', '-f', path, path + '.tmp']
+
+    def writer_command(self, final_file, checkpoint_path, offset, state):
+        """
+        Returns the pipeline fragment writing its standard input into
+        final_file from offset, recording its progress on the checkpoint.
+        """
+        return '| {}'.format(self.writer_script.filter_command(
+            {'path': final_file, 'checkpoint': checkpoint_path, 'offset': offset,
+             'state': state, 'interval': self.interval}))
+
+    def sample_ranges(self, size):
+        """
+        Returns the byte ranges of the first size bytes of a file compared
+        before resuming its copy: evenly spaced blocks, and the last block.
+        """
+        if size <= 0:
+            return []
+        block_size = min(self.block_size, size)
+        starts = {i * (size - block_size) // max(self.sample_blocks - 1, 1)
+                  for i in range(self.sample_blocks)}
+        return [(start, block_size) for start in sorted(starts)]
+
+    def ranges_hash_command(self, path, ranges):
+        """
+        Returns the command that prints the hash of the given byte ranges of a file.
+        """
+        return self.ranges_hash_script.command({'path': path, 'ranges': ranges})
+
+    def parse_ranges_hash(self, result):
+        return self.ranges_hash_script.parse(result)
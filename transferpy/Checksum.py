@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+import os.path
+
+from transferpy.Manifest import HASHER_OUTPUT_SCRIPT, Manifest
+from transferpy.RemoteExecution.RemoteExecution import CommandStream
+from transferpy.RemoteScript import RemoteScript
+
+# Supported hash algorithms and the executable computing each one, in order
+# of preference (fastest first) for the automatic selection
+ALGORITHMS = OrderedDict([
+    ('xxh128', '/usr/bin/xxh128sum'),
+    ('blake3', '/usr/bin/b3sum'),
+    ('md5', '/usr/bin/md5sum'),
+])
+
+
+class Checksum(object):
+    """Class to build the commands that checksum files and directory trees"""
+    def __init__(self, algorithm='md5'):
+        """
+        Initialize the instance variables.
+
+        :param algorithm: one of the ALGORITHMS keys
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError('unknown checksum algorithm {}'.format(algorithm))
+        self.algorithm = algorithm
+        # files bigger than this are hashed one per process, smaller ones are
+        # given in batches of batch_size files to each process
+        self.big_file_size = '64M'
+        self.batch_size = 256
+        self.manifest_script = RemoteScript(HASHER_OUTPUT_SCRIPT)
+
+    @property
+    def executable(self):
+        """
+        Property: executable computing the hash of the files given as arguments.
+
+        :return: executable path
+        """
+        return ALGORITHMS[self.algorithm]
+
+    @staticmethod
+    def choose(available_algorithms):
+        """
+        Chooses the preferred algorithm among the available ones.
+
+        :param available_algorithms: algorithms that can be used on all hosts
+        :return: algorithm name, or None if none is available
+        """
+        for algorithm in ALGORITHMS:
+            if algorithm in available_algorithms:
+                return algorithm
+        return None
+
+    def command(self, path, is_dir):
+        """
+        Returns the command that writes the manifest (see Manifest) of the
+        given path. For directories, all the files are hashed in parallel on
+        all the available cores, big files first; the manifest is sorted by
+        path on the remote host, so it does not depend on the order the files
+        were found or hashed in. Any failure on the pipeline fails the whole
+        command, and its standard error is discarded, so it never reaches the
+        manifest when a remote executor merges both outputs.
+
+        :param path: file or directory to checksum
+        :param is_dir: whether path is a directory
+        :return: command to be run by a RemoteExecution
+        """
+        parent_dir = os.path.normpath(os.path.join(path, '..'))
+        basename = os.path.basename(os.path.normpath(path))
+        manifest_command = self.manifest_script.filter_command()
+        if is_dir:
+            find_command = '/usr/bin/find {} -type f {} -size +{} -print0'
+            hash_command = '/usr/bin/xargs -0 -r -P $(/usr/bin/nproc) -n {} {}'
+            command = ['/bin/bash', '-c',
+                       r'"set -o pipefail; exec 2>/dev/null; '
+                       r'cd {} && {{ {} | {} && {} | {}; }} | {} | LC_ALL=C /usr/bin/sort"'
+                       .format(parent_dir,
+                               find_command.format(basename, '', self.big_file_size),
+                               hash_command.format(1, self.executable),
+                               find_command.format(basename, '!', self.big_file_size),
+                               hash_command.format(self.batch_size, self.executable),
+                               manifest_command)]
+        else:
+            command = ['/bin/bash', '-c', r'"set -o pipefail; exec 2>/dev/null; cd {} && {} {} | {}"'
+                       .format(parent_dir, self.executable, basename, manifest_command)]
+        return command
+
+    def parse(self, result):
+        """
+        Parses the result of running a checksum command.
+
+        :param result: CommandReturn of the checksum command; if it is a
+                       CommandStream, the manifest is read while it runs
+        :return: Manifest of the path, or None if the command failed or its
+                 output is not a manifest
+        """
+        if isinstance(result, CommandStream):
+            try:
+                manifest = Manifest(result.chunks())
+            except ValueError:
+                result.close()
+                return None
+            returncode = result.wait().returncode
+            result.close()
+            if returncode != 0:
+                manifest.close()
+                return None
+            return manifest
+        if result.returncode != 0:
+            return None
+        try:
+            return Manifest(result.stdout)
+        except ValueError:
+            return None
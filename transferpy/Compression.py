@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+import shlex
+
+from transferpy.RemoteScript import RemoteScript
+
+# Reads evenly spaced blocks of a file, or of the files of a directory tree,
+# and measures how much and how fast each of the given commands compresses them
+SAMPLE_SCRIPT = r'''
+import base64
+import bisect
+import json
+import os
+import subprocess
+import sys
+import time
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+block_size = arguments['block_size']
+files = []
+if os.path.isdir(arguments['path']):
+    for root, dirs, names in os.walk(arguments['path']):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((path, os.path.getsize(path)))
+        if len(files) >= arguments['max_files']:
+            break
+else:
+    files.append((arguments['path'], os.path.getsize(arguments['path'])))
+files = [(path, size) for path, size in files if size > 0]
+starts = []
+total = 0
+for path, size in files:
+    starts.append(total)
+    total += size
+
+blocks = []
+block_count = min(arguments['sample_size'] // block_size, (total + block_size - 1) // block_size)
+for i in range(block_count):
+    position = i * total // block_count
+    index = bisect.bisect_right(starts, position) - 1
+    path, size = files[index]
+    offset = max(0, min(position - starts[index], size - block_size))
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            blocks.append(f.read(block_size))
+    except OSError:
+        pass
+sample = b''.join(blocks)
+
+results = {}
+if sample:
+    for key, command in arguments['commands'].items():
+        start = time.monotonic()
+        try:
+            process = subprocess.run(command, input=sample, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+        except OSError:
+            continue
+        if process.returncode == 0:
+            results[key] = {'size': len(process.stdout), 'seconds': time.monotonic() - start}
+print(json.dumps({'sampled': len(sample), 'cores': os.cpu_count(), 'results': results}))
+'''
+
+
+class Compressor(object):
+    """
+    Base class of the compression codecs, building the commands that compress
+    and decompress the transfer stream.
+    """
+    name = None
+    executable = None
+    # first bytes of a compressed stream, as a hex string
+    magic = None
+    # valid compression levels, and the ones tried by CompressionSampler
+    min_level = 1
+    max_level = 9
+    sample_levels = (1, 6)
+    # whether compression runs on several cores
+    parallel = True
+
+    def __init__(self, level=None, threads=None):
+        """
+        Initialize the instance variables.
+
+        :param level: compression level, None for the codec default
+        :param threads: compression threads, None for the codec default
+        """
+        if level is not None and not self.min_level <= level <= self.max_level:
+            raise ValueError('{} compression level must be between {} and {}'
+                             .format(self.name, self.min_level, self.max_level))
+        if threads is not None and threads < 0:
+            raise ValueError('compression threads must be 0 or more')
+        self.level = level
+        self.threads = threads
+
+    @property
+    def level_option(self):
+        return '' if self.level is None else ' -{}'.format(self.level)
+
+    @property
+    def threads_option(self):
+        return ''
+
+    @property
+    def compress_command(self):
+        """
+        Property: command compressing its standard input to its standard output.
+        """
+        return '{} -c{}{}'.format(self.executable, self.level_option, self.threads_option)
+
+    @property
+    def decompress_command(self):
+        """
+        Property: command decompressing its standard input to its standard output.
+        """
+        return '{} -c -d'.format(self.executable)
+
+
+class PigzCompressor(Compressor):
+    """gzip format compression with pigz, parallel only when compressing"""
+    name = 'pigz'
+    executable = '/usr/bin/pigz'
+    magic = '1f8b'
+    max_level = 11
+
+    @property
+    def threads_option(self):
+        return '' if not self.threads else ' -p {}'.format(self.threads)
+
+
+class ZstdCompressor(Compressor):
+    """zstd compression, using all the cores unless threads is given"""
+    name = 'zstd'
+    executable = '/usr/bin/zstd'
+    magic = '28b52ffd'
+    max_level = 19
+    sample_levels = (1, 3, 9)
+
+    @property
+    def threads_option(self):
+        return ' -T{}'.format(self.threads or 0)
+
+    @property
+    def compress_command(self):
+        return '{} -q'.format(super().compress_command)
+
+    @property
+    def decompress_command(self):
+        return '{} -q'.format(super().decompress_command)
+
+
+class Lz4Compressor(Compressor):
+    """lz4 compression: single-threaded, but fast enough for most links"""
+    name = 'lz4'
+    executable = '/usr/bin/lz4'
+    magic = '04224d18'
+    max_level = 12
+    sample_levels = (1,)
+    parallel = False
+
+    @property
+    def compress_command(self):
+        return '{} -q'.format(super().compress_command)
+
+    @property
+    def decompress_command(self):
+        return '{} -q'.format(super().decompress_command)
+
+
+COMPRESSORS = OrderedDict((compressor.name, compressor)
+                          for compressor in [PigzCompressor, ZstdCompressor, Lz4Compressor])
+
+
+def get_compressor(name, level=None, threads=None):
+    """
+    Returns the compressor with the given name.
+
+    :param name: one of the COMPRESSORS keys
+    :param level: compression level, None for the codec default
+    :param threads: compression threads, None for the codec default
+    :return: Compressor instance
+    """
+    if name not in COMPRESSORS:
+        raise ValueError('unknown compressor {}'.format(name))
+    return COMPRESSORS[name](level, threads)
+
+
+def detect_compressor(header):
+    """
+    Returns the name of the compressor that wrote a stream starting with
+    the given bytes, or None if it is not known.
+
+    :param header: hex string of the first bytes of the stream
+    """
+    for name, compressor in COMPRESSORS.items():
+        if header is not None and header.startswith(compressor.magic):
+            return name
+    return None
+
+
+class CompressionSampler(object):
+    """
+    Class to measure, on a sample of the data to transfer, the compression
+    ratio and speed of every codec, with a single remote execution.
+    """
+    def __init__(self, remote_execution):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        """
+        self.remote_executor = remote_execution
+        self.script = RemoteScript(SAMPLE_SCRIPT)
+        self.sample_size = 64 * 1024 * 1024
+        self.block_size = 1024 * 1024
+        # files of a directory looked at for the sample
+        self.max_files = 10000
+
+    def command(self, path, compressors):
+        """
+        Returns the command that samples the given path.
+
+        :param path: file or directory to sample
+        :param compressors: names of the compressors to try, each one at all
+                            its sample_levels, on a single thread
+        :return: command to be run by a RemoteExecution
+        """
+        commands = {}
+        for name in compressors:
+            for level in COMPRESSORS[name].sample_levels:
+                compressor = get_compressor(name, level, threads=1)
+                commands['{}:{}'.format(name, level)] = shlex.split(compressor.compress_command)
+        return self.script.command({'path': path, 'commands': commands,
+                                    'sample_size': self.sample_size,
+                                    'block_size': self.block_size,
+                                    'max_files': self.max_files})
+
+    def run(self, host, path, compressors):
+        """
+        Samples the given path on the given host. See command() for the
+        parameters.
+
+        :return: dictionary with the 'sampled' bytes, the host 'cores' and the
+                 'results' of each 'name:level', with the compressed 'size'
+                 and the 'seconds' it took; or None if sampling failed
+        """
+        return self.script.parse(self.remote_executor.run(host, self.command(path, compressors)))
+
+
+def choose_compression(sample, link_speed, threads=None, incompressible_ratio=0.95):
+    """
+    Chooses the compression that moves the sampled data the fastest over a
+    link of the given speed: every codec and level is estimated to move the
+    source at the lowest of its compression speed (on all cores for the
+    parallel codecs) and the link speed divided by its ratio.
+
+    :param sample: CompressionSampler.run result
+    :param link_speed: bytes per second the network moves
+    :param threads: cores compressing, all the source ones if None
+    :param incompressible_ratio: compressed to original size ratio from which
+                                 data is not considered worth compressing
+    :return: (compressor name, level, reason) tuple; name and level are None
+             if the data should be sent uncompressed
+    """
+    if not sample['sampled'] or not sample['results']:
+        return None, None, 'no data could be sampled and compressed'
+    estimates = []
+    for key, result in sample['results'].items():
+        name, level = key.split(':')
+        ratio = result['size'] / sample['sampled']
+        speed = sample['sampled'] / max(result['seconds'], 1e-6)
+        cores = (threads or sample['cores'] or 1) if COMPRESSORS[name].parallel else 1
+        throughput = min(speed * cores, link_speed / max(ratio, 1e-6))
+        estimates.append((throughput, ratio, speed, cores, name, int(level)))
+    best_ratio = min(estimates, key=lambda estimate: estimate[1])
+    if best_ratio[1] >= incompressible_ratio:
+        return None, None, ('the data does not compress: the best ratio is {:.2f}, '
+                            'with {} level {}'.format(best_ratio[1], best_ratio[4], best_ratio[5]))
+    throughput, ratio, speed, cores, name, level = max(estimates)
+    mb = 1000 * 1000
+    if throughput <= link_speed:
+        return None, None, ('compressing would be slower than the link: the fastest is {} level {} '
+                            'at an estimated {:.0f} MB/s, the link moves {:.0f} MB/s'
+                            .format(name, level, throughput / mb, link_speed / mb))
+    return name, level, ('{} level {} compresses to a ratio of {:.2f} at {:.0f} MB/s per core '
+                         'on {} cores, moving an estimated {:.0f} MB/s instead of the {:.0f} MB/s '
+                         'of the link'.format(name, level, ratio, speed / mb, cores,
+                                              throughput / mb, link_speed / mb))
@@ -1,30 +1,144 @@
 #!/usr/bin/python3
 
+from transferpy.RemoteScript import RemoteScript, session_id
+
+# Ports an iptables multiport match accepts
+MAX_PORTS_PER_RULE = 15
+
+# Firewall backends: a set of allowed (source, port) pairs matched by a
+# single iptables rule, or an iptables rule per copy
+BACKENDS = ['ipset', 'iptables']
+# Name of the set of allowed (source, port) pairs, shared by all transfers to a host
+IPSET_NAME = 'transferpy'
+# Seconds an entry of the set, or a port lease, lasts, so the ones of
+# crashed transfers expire
+DEFAULT_TIMEOUT = 24 * 60 * 60
+# Ports searched for the receivers, end excluded
+DEFAULT_PORT_RANGE = (4400, 4500)
+# File of the ports leased on a host, and its lock
+LEASE_FILE = '/run/transferpy.ports'
+
+# Leases ports to a transfer, so concurrent ones never get the same port:
+# with the lease file locked, expired leases are dropped, the ones of the
+# transfer given are released, and the requested number of ports of the
+# range that are neither leased nor in use by a socket is leased to it
+LEASE_SCRIPT = r'''
+import base64
+import fcntl
+import json
+import os
+import sys
+import time
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+now = time.time()
+
+
+def used_ports():
+    ports = set()
+    for table in ['/proc/net/tcp', '/proc/net/tcp6']:
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    ports.add(int(line.split()[1].rsplit(':', 1)[1], 16))
+        except OSError:
+            pass
+    return ports
+
+
+fd = os.open(arguments['path'], os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+with os.fdopen(fd, 'r+') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        leases = json.loads(f.read() or '{}')
+    except ValueError:
+        leases = {}
+    leases = {port: lease for port, lease in leases.items()
+              if lease['expires'] is None or lease['expires'] > now}
+    for port in arguments['release']:
+        if leases.get(str(port), {}).get('session') == arguments['session']:
+            del leases[str(port)]
+    ports = []
+    if arguments['count'] > 0:
+        used = used_ports()
+        start, end = arguments['range']
+        ports = [port for port in range(start, end)
+                 if port not in used and str(port) not in leases][:arguments['count']]
+        if len(ports) < arguments['count']:
+            sys.exit(1)
+        expires = now + arguments['timeout'] if arguments['timeout'] else None
+        for port in ports:
+            leases[str(port)] = {'session': arguments['session'], 'expires': expires}
+    f.seek(0)
+    f.truncate()
+    json.dump(leases, f)
+print(json.dumps(ports))
+'''
+
 
 class Firewall(object):
     """Class for Transferer firewall related command execution"""
-    def __init__(self, target_host, remote_execution):
+    def __init__(self, target_host, remote_execution, backend='iptables',
+                 timeout=DEFAULT_TIMEOUT, port_range=DEFAULT_PORT_RANGE, session=None):
         """
         Initialize the instance variables.
 
         :param target_host: host address for port open/close
         :param remote_execution: remote execution helper
+        :param backend: 'iptables' to add a rule per copy, or 'ipset' to add
+                        entries to a set matched by a single iptables rule
+        :param timeout: seconds the entries of the set, and the port leases,
+                        last, 0 for ever
+        :param port_range: (start, end) tuple of the ports searched, end excluded
+        :param session: string identifying the transfer owning the port
+                        leases, a random one if not given
         """
+        if backend not in BACKENDS:
+            raise ValueError('unknown firewall backend {}'.format(backend))
         self.target_host = target_host
         self.remote_executor = remote_execution
-        self.search_start_port = 4400
-        self.search_end_port = 4500
+        self.backend = backend
+        self.timeout = timeout
+        self.search_start_port, self.search_end_port = port_range
+        self.session = session_id(session)
+        self.lease_file = LEASE_FILE
+        # ports leased by find_available_port, released by close
+        self.leased_ports = set()
+        self.lease_script = RemoteScript(LEASE_SCRIPT)
 
-    @property
-    def find_available_port_command(self):
+    def lease_command(self, count, release=()):
         """
-        Property: command to find to available port.
+        Returns the command leasing count free ports of the search range to
+        the session, after releasing the given ports it had leased.
 
-        :return: command to find available port
+        :param count: number of ports to lease, 0 to only release
+        :param release: ports leased to the session to release
+        :return: command printing the list of leased ports
         """
-        # TODO: Make this command in terms of search_start_port and search_end_port
-        command = ["netstat -altn | awk '{print $4}' | awk -F: '{print $NF}' | grep ^44[0-9][0-9]$ || echo 0"]
-        return command
+        return self.lease_script.command({'path': self.lease_file, 'session': self.session,
+                                          'count': count, 'release': list(release),
+                                          'range': [self.search_start_port,
+                                                    self.search_end_port],
+                                          'timeout': self.timeout})
+
+    def release_command(self, ports):
+        """
+        Returns the command releasing the given ports leased to the session.
+        """
+        return self.lease_command(0, ports)
+
+    def parse_lease(self, result):
+        """
+        Parses the result of a lease_command.
+
+        :return: list of leased ports
+        :raises ValueError: if not enough ports were free
+        """
+        ports = self.lease_script.parse(result)
+        if ports is None:
+            raise ValueError('failed to find an available port on {}'.format(self.target_host))
+        return ports
 
     def find_pid(self, target_port):
         """
@@ -67,64 +181,155 @@ class Firewall(object):
         """
         return self.remote_executor.run(self.target_host, command)
 
+    @staticmethod
+    def port_match(target_port):
+        """
+        Returns the iptables arguments matching the given port, or list of
+        up to MAX_PORTS_PER_RULE ports.
+        """
+        if isinstance(target_port, (list, tuple)):
+            if len(target_port) > MAX_PORTS_PER_RULE:
+                raise ValueError('a rule can open at most {} ports'.format(MAX_PORTS_PER_RULE))
+            if len(target_port) > 1:
+                return ['-m', 'multiport', '--dports', ','.join(str(port) for port in target_port)]
+            target_port = target_port[0]
+        return ['--dport', '{}'.format(target_port)]
+
+    @staticmethod
+    def set_rule(action):
+        """
+        Returns the iptables command appending (-A), checking (-C) or
+        deleting (-D) the rule accepting the connections on the set.
+        """
+        return ['/sbin/iptables', action, 'INPUT', '-p', 'tcp', '-m', 'set', '--match-set',
+                IPSET_NAME, 'src,dst', '-j', 'ACCEPT']
+
+    def set_entries(self, action, rules):
+        """
+        Returns the ipset restore lines adding or deleting the entries of the
+        given rules.
+
+        :param action: 'add' or 'del'
+        :param rules: list of (source_host, target_port) tuples, target_port
+                      being a port or a list of ports
+        """
+        lines = []
+        for source_host, target_ports in rules:
+            if not isinstance(target_ports, (list, tuple)):
+                target_ports = [target_ports]
+            for target_port in target_ports:
+                line = '{} {} {},tcp:{}'.format(action, IPSET_NAME, source_host, target_port)
+                if action == 'add':
+                    line += ' timeout {}'.format(self.timeout)
+                lines.append(line)
+        return ''.join(line + '\n' for line in lines)
+
+    def ipset_command(self, action, rules):
+        """
+        Returns the command adding or deleting the entries of the given rules
+        with a single ipset restore. Adding them first creates the set, and
+        the iptables rule matching it, if they do not exist yet.
+        """
+        restore = '/bin/echo {} | /usr/bin/base64 -d | /sbin/ipset restore -exist'.format(
+            RemoteScript.encode(self.set_entries(action, rules)))
+        if action == 'add':
+            restore = ('/sbin/ipset create {} hash:ip,port timeout {} -exist && '
+                       '({} 2> /dev/null || {}) && {}'
+                       .format(IPSET_NAME, self.timeout, ' '.join(self.set_rule('-C')),
+                               ' '.join(self.set_rule('-A')), restore))
+        return ['/bin/bash', '-c', r'"{}"'.format(restore)]
+
+    def open_commands(self, rules):
+        """
+        Returns the commands opening the given rules on the target host: a
+        single one with the ipset backend, one per rule with iptables.
+
+        :param rules: list of (source_host, target_port) tuples, target_port
+                      being a port or a list of ports opened by a single rule
+        """
+        if self.backend == 'ipset':
+            return [self.ipset_command('add', rules)]
+        return [self.open_command(source_host, target_port) for source_host, target_port in rules]
+
+    def close_commands(self, rules):
+        """
+        Returns the commands closing the given rules, opened by open_commands.
+        """
+        if self.backend == 'ipset':
+            return [self.ipset_command('del', rules)]
+        return [self.close_command(source_host, target_port) for source_host, target_port in rules]
+
+    def open_command(self, source_host, target_port):
+        """
+        Returns the command that opens target port on the firewall of target host.
+
+        :param source_host: sender host
+        :param target_port: port to be opened, or list of ports opened by a single rule
+        :return: command to open the port
+        """
+        if self.backend == 'ipset':
+            return self.ipset_command('add', [(source_host, target_port)])
+        return (['/sbin/iptables', '-A', 'INPUT', '-p', 'tcp', '-s',
+                 '{}'.format(source_host)] +
+                self.port_match(target_port) +
+                ['-j', 'ACCEPT'])
+
+    def close_command(self, source_host, target_port):
+        """
+        Returns the command that closes target port on the firewall of target host.
+
+        :param source_host: sender host
+        :param target_port: port to be closed, or list of ports opened by a single rule
+        :return: command to close the port
+        """
+        if self.backend == 'ipset':
+            return self.ipset_command('del', [(source_host, target_port)])
+        return (['/sbin/iptables', '-D', 'INPUT', '-p', 'tcp', '-s',
+                 '{}'.format(source_host)] +
+                self.port_match(target_port) +
+                ['-j', 'ACCEPT'])
+
     def open(self, source_host, target_port):
         """
-        Opens target port on iptables of target host.
+        Opens target port on the firewall of target host.
 
         :param source_host: sender host
         :param target_port: port to be opened
         :return: raises exception if not successful
         """
-        # If target port is 0, find a free port automatically
+        # If target port is 0, lease a free port automatically
         if target_port == 0:
             target_port = self.find_available_port()
 
-        command = ['/sbin/iptables', '-A', 'INPUT', '-p', 'tcp', '-s',
-                   '{}'.format(source_host),
-                   '--dport', '{}'.format(target_port),
-                   '-j', 'ACCEPT']
-        result = self.run_command(command)
+        result = self.run_command(self.open_command(source_host, target_port))
         if result.returncode != 0:
-            raise Exception('iptables execution failed')
+            raise Exception('{} execution failed'.format(self.backend))
         return target_port
 
     def close(self, source_host, target_port):
         """
-        Closes target port on iptables of target host.
+        Closes target port on the firewall of target host, and releases its
+        lease if it was leased by find_available_port.
 
         :param source_host: sender host
         :param target_port: port to be closed
         :return: remote run exit code, successful(0)
         """
-        command = ['/sbin/iptables', '-D', 'INPUT', '-p', 'tcp', '-s',
-                   '{}'.format(source_host),
-                   '--dport', '{}'.format(target_port),
-                   '-j', 'ACCEPT']
-        result = self.run_command(command)
+        result = self.run_command(self.close_command(source_host, target_port))
+        if target_port in self.leased_ports:
+            self.run_command(self.release_command([target_port]))
+            self.leased_ports.discard(target_port)
         return result.returncode
 
     def find_available_port(self):
         """
-        Checks port availability from a given range of ports on
-        the target host and select one among them.
+        Leases a free port of the search range on the target host, so no
+        concurrent transfer gets it until it is released by close().
 
         :return: available port if successful, else raises ValueError
         """
-        result = self.run_command(self.find_available_port_command)
-        num_of_searches = self.search_end_port - self.search_start_port
-        if result.returncode != 0 or len(result.stdout.split('\n')) == num_of_searches:
-            raise ValueError('failed to find an available port on {}'.format(self.target_host))
-
-        try:
-            used_ports = [int(i) for i in result.stdout.split('\n')]
-        except Exception as e:
-            raise ValueError("ERROR: Returned non integer value for used ports "
-                             "on {}\n{}".format(self.target_host, str(e)))
-
-        for p in range(self.search_start_port, self.search_end_port):
-            if p not in used_ports:
-                port = p
-                break
+        port = self.parse_lease(self.run_command(self.lease_command(1)))[0]
+        self.leased_ports.add(port)
         return port
 
     def __del__(self):
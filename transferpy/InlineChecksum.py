@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+from transferpy.Manifest import ESCAPE_FUNCTION, Manifest
+from transferpy.RemoteScript import RemoteScript, session_id
+
+# Reads a copy of the transfer stream from a fifo and writes its manifest (see
+# Manifest) to a file: one line per regular file for tar streams, a single
+# line, with the given name, otherwise. The whole stream is always consumed,
+# so the tee writing to the fifo never gets a broken pipe.
+HASHER_SCRIPT = ESCAPE_FUNCTION + r'''
+import base64
+import hashlib
+import json
+import os
+import sys
+import tarfile
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+chunk_size = 1024 * 1024
+
+
+def manifest_line(f, name):
+    digest = hashlib.new(arguments['algorithm'])
+    size = 0
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    return '{}\t{}\t{}\n'.format(escape_path(name), size, digest.hexdigest())
+
+
+with open(arguments['input'], 'rb') as stream:
+    if arguments['tar']:
+        lines = []
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for member in tar:
+                    if member.isreg():
+                        lines.append(manifest_line(tar.extractfile(member),
+                                                   os.fsencode(member.name)))
+        except tarfile.TarError:
+            # no manifest is written, so the copy is reported as not verified
+            lines = None
+        while stream.read(chunk_size):
+            pass
+        if lines is None:
+            sys.exit(1)
+        lines.sort()
+    else:
+        lines = [manifest_line(stream, arguments['name'].encode('utf-8', 'surrogateescape'))]
+temporary_output = arguments['output'] + '.tmp'
+with open(temporary_output, 'w') as f:
+    f.writelines(lines)
+os.rename(temporary_output, arguments['output'])
+'''
+
+
+class InlineChecksum(object):
+    """
+    Class to build the commands that hash the transfer stream while it is
+    sent and received, instead of reading the source and the copies again.
+    Each side tees its uncompressed stream into a fifo read by a hasher
+    running in the background, which leaves a Manifest on a file of the
+    host until they are read after the transfer.
+    """
+    def __init__(self, is_dir, algorithm='md5', session=None, name='-'):
+        """
+        Initialize the instance variables.
+
+        :param is_dir: whether the stream is a tar of a directory, hashed per file
+        :param algorithm: hashlib algorithm name
+        :param session: string identifying the transfer on the temporary file
+                        names, a random one if not given
+        :param name: path of the single file on the manifest when the stream
+                     is not a tar
+        """
+        self.is_dir = is_dir
+        self.algorithm = algorithm
+        self.name = name
+        self.session = session_id(session)
+        self.script = RemoteScript(HASHER_SCRIPT)
+
+    def paths(self, port, side):
+        """
+        Returns the fifo and manifest file paths of one side of a copy.
+
+        :param port: port of the copy
+        :param side: 'src' or 'dst'
+        :return: (fifo path, manifest path) tuple
+        """
+        prefix = '/tmp/transferpy.{}.{}.{}'.format(self.session, port, side)
+        return prefix + '.fifo', prefix + '.digest'
+
+    def start_command(self, port, side):
+        """
+        Returns the command fragment, to be put before the transfer pipeline,
+        that creates the fifo and starts the hasher in the background.
+        """
+        fifo, digest = self.paths(port, side)
+        return '/usr/bin/mkfifo {} && {{ {} & }} &&'.format(
+            fifo, self.script.shell_command({'input': fifo, 'output': digest,
+                                             'tar': self.is_dir, 'name': self.name,
+                                             'algorithm': self.algorithm}))
+
+    def tee_command(self, port, side):
+        """
+        Returns the pipeline fragment that copies the stream to the hasher.
+        """
+        fifo, _ = self.paths(port, side)
+        return '| /usr/bin/tee {}'.format(fifo)
+
+    def end_command(self):
+        """
+        Returns the command fragment, to be put after the transfer pipeline,
+        that waits for the hasher to write the manifest.
+        """
+        return '&& wait'
+
+    def read_command(self, port, side):
+        """
+        Returns the command that prints the manifest of one side of a copy and
+        removes its temporary files.
+        """
+        fifo, digest = self.paths(port, side)
+        return ['/bin/bash', '-c', r'"/bin/cat {1} && /bin/rm -f {0} {1} || {{ /bin/rm -f {0}; false; }}"'
+                .format(fifo, digest)]
+
+    def parse(self, result):
+        """
+        Parses the result of a read_command.
+
+        :param result: CommandReturn of the read command
+        :return: Manifest of the stream, or None if it could not be read
+        """
+        if result.returncode != 0 or result.stdout is None:
+            return None
+        try:
+            return Manifest(result.stdout)
+        except ValueError:
+            return None
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+from collections import namedtuple
+import tempfile
+
+# Shared by the remote scripts writing manifest lines. Paths are escaped to
+# printable ASCII without tabs or newlines, so every file takes exactly one
+# line and a plain byte sort of the lines (LC_ALL=C sort) sorts them by path
+ESCAPE_FUNCTION = r'''
+def escape_path(path):
+    return ''.join(chr(byte) if 0x20 <= byte < 0x7f and byte != 0x5c else '\\x{:02x}'.format(byte)
+                   for byte in path)
+'''
+
+# Turns the output of a md5sum-like hasher, run on the current directory, on
+# manifest lines
+HASHER_OUTPUT_SCRIPT = ESCAPE_FUNCTION + r'''
+import os
+import sys
+
+
+def unescape_name(name):
+    unescaped = bytearray()
+    i = 0
+    while i < len(name):
+        if name[i:i + 1] == b'\\' and i + 1 < len(name):
+            unescaped += {b'n': b'\n', b'r': b'\r', b'\\': b'\\'}.get(name[i + 1:i + 2],
+                                                                   name[i:i + 2])
+            i += 2
+        else:
+            unescaped += name[i:i + 1]
+            i += 1
+    return bytes(unescaped)
+
+
+for line in sys.stdin.buffer:
+    line = line.rstrip(b'\n')
+    escaped = line.startswith(b'\\')
+    if escaped:
+        line = line[1:]
+    digest, name = line.split(b' ', 1)
+    # the separator is two spaces, or a space and an asterisk on binary mode
+    name = name[1:]
+    if escaped:
+        name = unescape_name(name)
+    sys.stdout.write('{}\t{}\t{}\n'.format(escape_path(name), os.lstat(name).st_size,
+                                           digest.decode('ascii')))
+'''
+
+ManifestEntry = namedtuple('ManifestEntry', ['path', 'size', 'digest'])
+
+
+class Manifest(object):
+    """
+    Class holding the list of files of a copy, one line per file with its
+    escaped path, size and digest, separated by tabs and sorted by path.
+    Manifests are spooled to a temporary file once they grow over
+    spool_size bytes, and are compared with a streaming merge, so the memory
+    they use stays bounded for trees with millions of files.
+    """
+    def __init__(self, output='', spool_size=16 * 1024 * 1024):
+        """
+        Initialize the instance variables.
+
+        :param output: manifest lines, already sorted by the remote host, or
+                       an iterable of chunks of them (e.g. CommandStream.chunks())
+        :param spool_size: bytes kept in memory before spooling to disk
+        """
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size, mode='w+')
+        if isinstance(output, (str, bytes)):
+            output = [output]
+        for chunk in output:
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode('ascii')
+            self.file.write(chunk)
+        self.file.seek(0)
+
+    def __iter__(self):
+        """
+        Iterates the entries of the manifest, in path order.
+        """
+        self.file.seek(0)
+        for line in self.file:
+            try:
+                path, size, digest = line.rstrip('\n').split('\t')
+                yield ManifestEntry(path, int(size), digest)
+            except ValueError:
+                raise ValueError('invalid manifest line: {}'.format(line.rstrip('\n')))
+
+    def compare(self, other):
+        """
+        Compares this manifest, of the original files, with the one of a copy.
+
+        :param other: Manifest of the copy
+        :return: generator of (status, path) tuples, in path order, for every
+                 file that is 'changed' on the copy (size or digest), 'missing'
+                 from it or 'extra' on it
+        """
+        originals = iter(self)
+        copies = iter(other)
+        original = next(originals, None)
+        copy = next(copies, None)
+        while original is not None or copy is not None:
+            if copy is None or (original is not None and original.path < copy.path):
+                yield 'missing', original.path
+                original = next(originals, None)
+            elif original is None or copy.path < original.path:
+                yield 'extra', copy.path
+                copy = next(copies, None)
+            else:
+                if original.size != copy.size or original.digest != copy.digest:
+                    yield 'changed', original.path
+                original = next(originals, None)
+                copy = next(copies, None)
+
+    def close(self):
+        """
+        Releases the spooled manifest.
+        """
+        self.file.close()
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+# Ranges are multiples of this, so dd reads and writes whole blocks
+DEFAULT_ALIGNMENT = 1024 * 1024
+
+
+def split_ranges(size, streams, alignment=DEFAULT_ALIGNMENT):
+    """
+    Splits a file into byte ranges of about the same length, one per stream.
+
+    :param size: bytes of the file
+    :param streams: maximum number of ranges
+    :param alignment: the offset and length of all the ranges but the last
+                      one are multiples of it
+    :return: list of (offset, length) tuples, covering the whole file. Small
+             files get less ranges than streams, empty files none
+    """
+    if size <= 0:
+        return []
+    length = -(-size // streams)
+    length = -(-length // alignment) * alignment
+    return [(offset, min(length, size - offset)) for offset in range(0, size, length)]
+
+
+def read_range_command(path, offset, length, block_size=DEFAULT_ALIGNMENT):
+    """
+    Returns the command writing to its standard output the given byte range
+    of a file.
+    """
+    return ('/bin/dd if={} bs={} skip={} count={} iflag=skip_bytes,count_bytes status=none'
+            .format(path, block_size, offset, length))
+
+
+def write_range_command(path, offset, block_size=DEFAULT_ALIGNMENT):
+    """
+    Returns the pipeline fragment writing its standard input to a file from
+    the given offset, without truncating it.
+    """
+    return ('| /bin/dd of={} bs={} seek={} oflag=seek_bytes conv=notrunc status=none'
+            .format(path, block_size, offset))
+
+
+def preallocate_command(path, size):
+    """
+    Returns the command that creates a file of the given size, with its
+    blocks allocated if the filesystem supports it, for the ranges to be
+    written into.
+    """
+    return ['/bin/bash', '-c', r'"/usr/bin/fallocate -l {1} {0} || /usr/bin/truncate -s {1} {0}"'
+            .format(path, size)]
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+from transferpy.RemoteScript import RemoteScript
+
+PROBE_SCRIPT = r'''
+import base64
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+paths = {}
+for path in arguments['paths']:
+    facts = {'exists': False, 'is_dir': False, 'is_socket': False,
+             'is_empty': None, 'size': None, 'available': None, 'header': None}
+    paths[path] = facts
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        continue
+    facts['exists'] = True
+    facts['is_dir'] = stat.S_ISDIR(mode)
+    facts['is_socket'] = stat.S_ISSOCK(mode)
+    if facts['is_dir']:
+        try:
+            facts['is_empty'] = not os.listdir(path)
+        except OSError:
+            pass
+    if path in arguments['sizes']:
+        du = subprocess.run(['/usr/bin/du', '--bytes', '--summarize', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if du.returncode == 0:
+            facts['size'] = int(du.stdout.split()[0])
+    if path in arguments['space']:
+        fs = os.statvfs(path)
+        facts['available'] = fs.f_bavail * fs.f_frsize
+    if path in arguments['headers']:
+        try:
+            with open(path, 'rb') as f:
+                facts['header'] = f.read(8).hex()
+        except OSError:
+            pass
+binaries = {}
+for binary in arguments['binaries']:
+    if '/' in binary:
+        binaries[binary] = os.access(binary, os.X_OK)
+    else:
+        binaries[binary] = shutil.which(binary) is not None
+print(json.dumps({'paths': paths, 'binaries': binaries}))
+'''
+
+
+class Probe(object):
+    """
+    Class to gather, with a single remote execution per host, all the facts
+    the Transferer checks about paths and binaries of a host.
+    """
+    def __init__(self, remote_execution):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        """
+        self.remote_executor = remote_execution
+        self.script = RemoteScript(PROBE_SCRIPT)
+
+    def command(self, paths, sizes=(), space=(), binaries=(), headers=()):
+        """
+        Returns the command that probes the given paths and binaries.
+
+        :param paths: paths whose existence, type and emptiness is checked
+        :param sizes: paths among the given ones whose disk usage is calculated
+        :param space: paths among the given ones whose filesystem free space is calculated
+        :param binaries: executables whose presence is checked, either absolute
+                         paths or names looked up on the PATH
+        :param headers: paths among the given ones whose first bytes are read
+        :return: command to be run by a RemoteExecution
+        """
+        return self.script.command({'paths': list(paths), 'sizes': list(sizes),
+                                    'space': list(space), 'binaries': list(binaries),
+                                    'headers': list(headers)})
+
+    def parse(self, result):
+        """
+        Parses the result of running a probe command.
+
+        :param result: CommandReturn of the probe command
+        :return: dictionary with a 'paths' dictionary, with exists, is_dir,
+                 is_socket, is_empty, size, available and header (hex string
+                 of the first 8 bytes) facts per path, and a
+                 'binaries' dictionary telling if each binary is present; or
+                 None if the host could not be probed
+        """
+        return self.script.parse(result)
+
+    def run(self, host, paths, sizes=(), space=(), binaries=(), headers=()):
+        """
+        Probes the given paths and binaries on the given host. See command()
+        for the parameters and parse() for the return value.
+        """
+        result = self.remote_executor.run(host, self.command(paths, sizes, space, binaries,
+                                                             headers))
+        return self.parse(result)
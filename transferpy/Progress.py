@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+from transferpy.RemoteScript import RemoteScript, session_id
+
+# Prints the last byte count written by pv -n on each of the given files,
+# optionally removing them
+COUNTER_SCRIPT = r'''
+import base64
+import json
+import os
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+counters = {}
+for path in arguments['paths']:
+    counters[path] = None
+    try:
+        with open(path, 'rb') as f:
+            f.seek(max(0, os.fstat(f.fileno()).st_size - 64))
+            lines = f.read().split()
+        if lines:
+            counters[path] = int(lines[-1])
+    except (OSError, ValueError):
+        pass
+    if arguments['remove']:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+print(json.dumps(counters))
+'''
+
+
+def format_bytes(size):
+    """
+    Returns the given number of bytes as a human readable string.
+    """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1000 or unit == 'TB':
+            break
+        size /= 1000
+    return '{:.2f} {}'.format(size, unit)
+
+
+class Progress(object):
+    """
+    Class to report the progress of the copies. pv counters on the sender
+    pipeline count the bytes read from the source and sent on the wire, and
+    on the receiver pipelines the bytes written to each target. They are
+    polled with one remote execution call and reported as rates, percent of
+    the source size and ETA through the logger and, optionally, as JSON lines.
+    """
+    def __init__(self, remote_execution, json_file=None, session=None):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        :param json_file: path of a file the reports are appended to as JSON
+                          lines, '-' for the standard output, None to not write them
+        :param session: string identifying the transfer on the counter file
+                        names, a random one if not given
+        """
+        self.remote_executor = remote_execution
+        self.json_file = json_file
+        self.session = session_id(session)
+        # seconds between updates of the pv counters
+        self.counter_interval = 1
+        self.script = RemoteScript(COUNTER_SCRIPT)
+        self.logger = logging.getLogger(__name__)
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def counter_path(self, port, name):
+        """
+        Returns the path of the file of a counter of the copy on the given port.
+
+        :param name: 'read', 'sent' or 'written'
+        """
+        return '/tmp/transferpy.{}.{}.{}.progress'.format(self.session, port, name)
+
+    def counter_command(self, port, name):
+        """
+        Returns the pipeline fragment counting the bytes going through it.
+        """
+        return '| /usr/bin/pv -f -n -b -i {} 2> {}'.format(
+            self.counter_interval, self.counter_path(port, name))
+
+    def start(self, port):
+        """
+        Marks the start of the copy sent to the given port.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._snapshots[port] = {'start': now, 'time': now, 'read': 0, 'sent': 0,
+                                     'written': {}}
+
+    def read_counters(self, source_host, port, targets, remove=False):
+        """
+        Reads the counters of the copy sent to the given port.
+
+        :param targets: list of (target_host, target_port) tuples receiving it
+        :param remove: whether to remove the counter files
+        :return: (read, sent, written) bytes tuple, written being a list with
+                 one count per target; missing counters are 0
+        """
+        paths = [[self.counter_path(port, 'read'), self.counter_path(port, 'sent')]]
+        paths += [[self.counter_path(target_port, 'written')] for _, target_port in targets]
+        hosts = [source_host] + [target_host for target_host, _ in targets]
+        results = self.remote_executor.run_each(
+            [(host, self.script.command({'paths': host_paths, 'remove': remove}))
+             for host, host_paths in zip(hosts, paths)])
+        counts = []
+        for host_paths, result in zip(paths, results):
+            counters = self.script.parse(result) or {}
+            counts.extend(counters.get(path) or 0 for path in host_paths)
+        return counts[0], counts[1], counts[2:]
+
+    def report(self, source_host, port, targets, total_size, final=False):
+        """
+        Polls the counters of the copy sent to the given port and reports its
+        progress since the previous report (or, if final, since its start).
+
+        :param targets: list of (target_host, target_port) tuples receiving it
+        :param total_size: bytes of the source
+        :param final: whether the copy finished, its counters are then removed
+        :return: dictionary with the reported values
+        """
+        read, sent, written = self.read_counters(source_host, port, targets, remove=final)
+        now = time.monotonic()
+        with self._lock:
+            if port not in self._snapshots:
+                self._snapshots[port] = {'start': now, 'time': now, 'read': 0, 'sent': 0,
+                                         'written': {}}
+            previous = self._snapshots[port]
+            if final:
+                previous = dict(previous, time=previous['start'], read=0, sent=0, written={})
+                del self._snapshots[port]
+            else:
+                self._snapshots[port] = {'start': previous['start'], 'time': now, 'read': read,
+                                         'sent': sent,
+                                         'written': dict(zip([host for host, _ in targets],
+                                                             written))}
+        elapsed = max(now - previous['time'], 1e-6)
+        read_rate = (read - previous['read']) / elapsed
+        eta = None
+        if not final and read_rate > 0 and total_size:
+            eta = max(0, total_size - read) / read_rate
+        record = {'time': time.time(), 'final': final, 'source': source_host, 'port': port,
+                  'elapsed': now - previous['start'], 'size': total_size,
+                  'read': read, 'read_rate': read_rate,
+                  'percent': 100.0 * read / total_size if total_size else None,
+                  'sent': sent, 'sent_rate': (sent - previous['sent']) / elapsed,
+                  'eta': eta,
+                  'targets': [{'host': host, 'written': count,
+                               'written_rate': (count - previous['written'].get(host, 0)) / elapsed}
+                              for (host, _), count in zip(targets, written)]}
+        self.log(record)
+        self.write_json(record)
+        return record
+
+    def log(self, record):
+        """
+        Logs a report, as returned by report().
+        """
+        written = ', '.join('{} written at {}/s on {}'.format(
+            format_bytes(target['written']), format_bytes(target['written_rate']), target['host'])
+            for target in record['targets'])
+        percent = '' if record['percent'] is None else '{:.1f}% '.format(record['percent'])
+        if record['final']:
+            self.logger.info('Transfer from {} finished in {}: {}read at {}/s, {} sent at {}/s, {}'
+                             .format(record['source'],
+                                     datetime.timedelta(seconds=int(record['elapsed'])),
+                                     percent, format_bytes(record['read_rate']),
+                                     format_bytes(record['sent']),
+                                     format_bytes(record['sent_rate']), written))
+        else:
+            eta = ('unknown' if record['eta'] is None
+                   else datetime.timedelta(seconds=int(record['eta'])))
+            self.logger.info('Transfer from {}: {}({}) read at {}/s, {} sent at {}/s, {}, ETA {}'
+                             .format(record['source'], percent, format_bytes(record['read']),
+                                     format_bytes(record['read_rate']),
+                                     format_bytes(record['sent']),
+                                     format_bytes(record['sent_rate']), written, eta))
+
+    def write_json(self, record):
+        """
+        Writes a report, as returned by report(), as a JSON line, if enabled.
+        """
+        if self.json_file is None:
+            return
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            if self.json_file == '-':
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(self.json_file, 'a') as f:
+                    f.write(line)
@@ -1,17 +1,65 @@
-from multiprocessing import Pipe, Process
+from contextlib import contextmanager
 import os
+import threading
+import time
 
+from ClusterShell.Task import task_terminate
 import cumin
 from cumin import query, transport, transports
+from cumin.transports.clustershell import SyncEventHandler
 
-from transferpy.RemoteExecution.RemoteExecution import CommandReturn, RemoteExecution
+from transferpy.RemoteExecution.RemoteExecution import (DEFAULT_MEMORY_LIMIT, CommandReturn,
+                                                        CommandStream, RemoteExecution, ThreadJob)
 
 
-# TODO: Refactor with the one on ParamikoExecution or find a better approach
-def run_subprocess(host, command, input_pipe):
-    e = CuminExecution()
-    result = e.run(host, command)
-    input_pipe.send(result)
+_suppress_lock = threading.Lock()
+_suppress_count = 0
+_saved_output = None
+
+
+@contextmanager
+def suppressed_output():
+    """
+    Context manager redirecting ClusterShell stdout and stderr to /dev/null.
+    It can be entered by several threads at the same time: the original
+    streams are saved by the first one and restored by the last one.
+    """
+    global _suppress_count, _saved_output
+    with _suppress_lock:
+        if _suppress_count == 0:
+            discard_output = open(os.devnull, 'w')
+            _saved_output = (transports.clustershell.sys.stdout,
+                             transports.clustershell.sys.stderr,
+                             discard_output)
+            transports.clustershell.sys.stdout = discard_output
+            transports.clustershell.sys.stderr = discard_output
+        _suppress_count += 1
+    try:
+        yield
+    finally:
+        with _suppress_lock:
+            _suppress_count -= 1
+            if _suppress_count == 0:
+                stdout, stderr, discard_output = _saved_output
+                transports.clustershell.sys.stdout = stdout
+                transports.clustershell.sys.stderr = stderr
+                discard_output.close()
+                _saved_output = None
+
+
+class StreamingEventHandler(SyncEventHandler):
+    """
+    Cumin sync event handler writing every line of output of the host to a
+    CommandStream as soon as it is read, instead of keeping the output until
+    the command ends. Subclasses set the host and stream class attributes,
+    as Cumin instantiates the handler itself.
+    """
+    host = None
+    stream = None
+
+    def ev_read(self, worker, node, sname, msg):
+        if node == self.host:
+            self.stream.write(sname, bytes(msg) + b'\n')
 
 
 class CuminExecution(RemoteExecution):
@@ -22,6 +70,31 @@ class CuminExecution(RemoteExecution):
     def __init__(self, options={}):
         self._config = None
         self.options = options
+        # seconds a host query resolution is reused before querying it again
+        self.resolution_ttl = options.get('resolution_ttl', 300)
+        self._resolutions = {}
+        self._init_runtime_state()
+
+    def _init_runtime_state(self):
+        """
+        Initializes the state that cannot be pickled: the per-thread
+        transport cache (ClusterShell tasks are bound to the thread
+        that created them), the statistics and their lock.
+        """
+        self._workers = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {'commands': 0, 'resolutions': 0, 'resolution_cache_hits': 0,
+                      'transports': 0, 'setup_time': 0.0, 'execution_time': 0.0}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in ('_workers', '_stats_lock', 'stats'):
+            del state[attribute]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime_state()
 
     @property
     def config(self):
@@ -30,36 +103,96 @@ class CuminExecution(RemoteExecution):
 
         return self._config
 
+    def _add_stats(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def resolve(self, host):
+        """
+        Returns the NodeSet the given host query resolves to, reusing previous
+        resolutions for resolution_ttl seconds.
+        """
+        now = time.monotonic()
+        cached = self._resolutions.get(host)
+        if cached is not None and cached[0] > now:
+            self._add_stats(resolution_cache_hits=1)
+            return cached[1]
+        hosts = query.Query(self.config).execute(host)
+        self._add_stats(resolutions=1)
+        if hosts:
+            self._resolutions[host] = (now + self.resolution_ttl, hosts)
+        return hosts
+
+    def get_worker(self, host, hosts):
+        """
+        Returns a Cumin transport targeting the given hosts, reusing the one
+        created previously by this thread for the same host query.
+        """
+        workers = getattr(self._workers, 'cache', None)
+        if workers is None:
+            workers = self._workers.cache = {}
+        cached = workers.get(host)
+        if cached is not None and cached[0] == hosts:
+            return cached[1]
+        worker = transport.Transport.new(self.config, transports.Target(hosts))
+        self._add_stats(transports=1)
+        workers[host] = (hosts, worker)
+        return worker
+
+    def stats_summary(self):
+        """
+        Returns a human readable summary of the time spent setting up Cumin
+        (configuration, host queries, transports) and running commands.
+        """
+        with self._stats_lock:
+            return ('{commands} commands run in {execution_time:.2f}s, {setup_time:.2f}s spent on '
+                    'Cumin setup ({resolutions} host queries, {resolution_cache_hits} cached, '
+                    '{transports} transports)').format(**self.stats)
+
     def format_command(self, command):
         if isinstance(command, str):
             return command
         else:
             return ' '.join(command)
 
-    def run(self, host, command):
-        hosts = query.Query(self.config).execute(host)
-        if not hosts:
-            return CommandReturn(1, None, 'host is wrong or does not match rules')
-        target = transports.Target(hosts)
-        worker = transport.Transport.new(self.config, target)
+    def execute(self, worker, command, job=None, handler='sync'):
+        """
+        Runs the given command with the given Cumin transport and returns its
+        return code. If job is given, aborting the ClusterShell task of the
+        transport is attached to it, so the command can be killed.
+        """
         worker.commands = [self.format_command(command)]
-        worker.handler = 'sync'
+        worker.handler = handler
+        if job is not None:
+            job.attach(worker.task.abort)
 
         # If verbose is false, suppress stdout and stderr of Cumin.
         if self.options.get('verbose', False):
-            return_code = worker.execute()
-        else:
-            # Temporary workaround until Cumin has full support to suppress output (T212783).
-            stdout = transports.clustershell.sys.stdout
-            stderr = transports.clustershell.sys.stderr
-            try:
-                with open(os.devnull, 'w') as discard_output:
-                    transports.clustershell.sys.stdout = discard_output
-                    transports.clustershell.sys.stderr = discard_output
-                    return_code = worker.execute()
-            finally:
-                transports.clustershell.sys.stdout = stdout
-                transports.clustershell.sys.stderr = stderr
+            return worker.execute()
+        # Temporary workaround until Cumin has full support to suppress output (T212783).
+        with suppressed_output():
+            return worker.execute()
+
+    def run(self, host, command):
+        return self.run_command(host, command)
+
+    def run_command(self, host, command, job=None, handler='sync'):
+        """
+        Runs the command on the host, and returns its CommandReturn. See
+        execute() for the job and handler parameters.
+        """
+        setup_start = time.monotonic()
+        hosts = self.resolve(host)
+        if not hosts:
+            self._add_stats(setup_time=time.monotonic() - setup_start)
+            return CommandReturn(1, None, 'host is wrong or does not match rules')
+        worker = self.get_worker(host, hosts)
+
+        execution_start = time.monotonic()
+        return_code = self.execute(worker, command, job, handler)
+        self._add_stats(commands=1, setup_time=execution_start - setup_start,
+                        execution_time=time.monotonic() - execution_start)
 
         for nodes, output in worker.get_results():
             if host in nodes:
@@ -68,27 +201,86 @@ class CuminExecution(RemoteExecution):
 
         return CommandReturn(return_code, None, None)
 
+    def run_many(self, hosts, command):
+        """
+        Executes the command on all the given hosts with a single Cumin
+        execution, which runs them in parallel.
+        """
+        setup_start = time.monotonic()
+        results = {}
+        nodes = None
+        for host in dict.fromkeys(hosts):
+            resolved = self.resolve(host)
+            if not resolved:
+                results[host] = CommandReturn(1, None, 'host is wrong or does not match rules')
+            else:
+                nodes = resolved if nodes is None else nodes | resolved
+        if nodes is None:
+            self._add_stats(setup_time=time.monotonic() - setup_start)
+            return results
+        worker = self.get_worker(str(nodes), nodes)
+
+        execution_start = time.monotonic()
+        return_code = self.execute(worker, command)
+        self._add_stats(commands=1, setup_time=execution_start - setup_start,
+                        execution_time=time.monotonic() - execution_start)
+
+        outputs = {}
+        for output_nodes, output in worker.get_results():
+            for node in output_nodes:
+                outputs[node] = str(bytes(output), 'utf-8')
+        for host in dict.fromkeys(hosts):
+            if host in results:
+                continue
+            try:
+                host_return_code = worker.task.node_retcode(host)
+            except KeyError:
+                host_return_code = return_code
+            results[host] = CommandReturn(host_return_code, outputs.get(host), None)
+        return results
+
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        Runs the command on its own thread with a StreamingEventHandler, so
+        its output is written to the returned CommandStream line by line as
+        it is read, and never kept whole in memory.
+        """
+        stream = CommandStream(memory_limit)
+        handler = type('StreamingEventHandler', (StreamingEventHandler,),
+                       {'host': host, 'stream': stream})
+
+        def run():
+            try:
+                result = self.run_command(host, command, handler=handler)
+            except Exception:
+                result = CommandReturn(-1, None, None)
+            finally:
+                task_terminate()
+            if result.stderr:
+                stream.write('stderr', result.stderr.encode('utf-8'))
+            stream.finish(result.returncode)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stream
+
+    def run_job(self, host, command, job):
+        """
+        Runs a background job on its own thread, destroying the ClusterShell
+        task bound to the thread once it finishes.
+        """
+        try:
+            return self.run_command(host, command, job)
+        finally:
+            task_terminate()
+
     def start_job(self, host, command):
-        output_pipe, input_pipe = Pipe()
-        job = Process(target=run_subprocess, args=(host, command, input_pipe))
-        job.start()
-        input_pipe.close()
-        return {'process': job, 'pipe': output_pipe}
+        return ThreadJob(self.run_job, host, command)
 
     def monitor_job(self, host, job):
-        if job['process'].is_alive():
-            return CommandReturn(None, None, None)
-        else:
-            result = job['pipe'].recv()
-            job['pipe'].close()
-            return result
+        return job.monitor()
 
     def kill_job(self, host, job):
-        if job['process'].is_alive():
-            job['process'].terminate()
+        job.kill()
 
     def wait_job(self, host, job):
-        job['process'].join()
-        result = job['pipe'].recv()
-        job['pipe'].close()
-        return result
+        return job.wait()
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
-from transferpy.RemoteExecution.RemoteExecution import RemoteExecution, CommandReturn
+from transferpy.RemoteExecution.RemoteExecution import (DEFAULT_MEMORY_LIMIT, CommandReturn,
+                                                        CommandStream, RemoteExecution)
 
+import asyncio
 import subprocess
 
 
@@ -15,6 +17,30 @@ class LocalExecution(RemoteExecution):
                                 stderr=subprocess.PIPE)
         return CommandReturn(result.returncode, result.stdout, result.stderr)
 
+    async def run_async(self, host, command):
+        """
+        Runs the command as an asyncio subprocess, so waiting for it takes
+        no thread.
+        """
+        process = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE,
+                                                       stderr=subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        return CommandReturn(process.returncode, stdout, stderr)
+
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stream = CommandStream(memory_limit)
+
+        def wait():
+            process.stdout.close()
+            process.stderr.close()
+            return process.wait()
+
+        return stream.follow({'stdout': lambda: process.stdout.read1(stream.chunk_size),
+                              'stderr': lambda: process.stderr.read1(stream.chunk_size)},
+                             wait)
+
     def start_job(self, host, command):
         print(command)
         process = subprocess.Popen(command, stdout=subprocess.PIPE,
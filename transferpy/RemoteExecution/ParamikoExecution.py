@@ -1,30 +1,34 @@
 #!/usr/bin/python3
-from transferpy.RemoteExecution.RemoteExecution import RemoteExecution, CommandReturn
+from transferpy.RemoteExecution.RemoteExecution import (DEFAULT_MEMORY_LIMIT, CommandReturn,
+                                                        CommandStream, RemoteExecution, ThreadJob)
 
-from multiprocessing import Process, Pipe
 import paramiko
 import shlex
+import threading
 import time
 
 
-def run_subprocess(host, command, user, port, host_keys, input_pipe):
-    e = ParamikoExecution()
-    e.user = user
-    e.port = port
-    e.host_keys = host_keys
-    result = e.run(host, command)
-    input_pipe.send(result)
-
-
 class ParamikoExecution(RemoteExecution):
+    """
+    RemoteExecution implementation using Paramiko. It keeps a pool with an
+    SSH connection per host, and every command (including background jobs)
+    runs on its own channel of the host's connection.
+    """
 
     def __init__(self, user='root', port=22,
-                 host_keys='.ssh/known_hosts'):
+                 host_keys='.ssh/known_hosts', idle_timeout=300):
         self.user = user
         self.port = port
         self.host_keys = host_keys
+        # seconds an unused connection is kept open
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._connections_lock = threading.Lock()
 
-    def run(self, host, command):
+    def connect(self, host):
+        """
+        Opens a new SSH connection to the given host.
+        """
         client = paramiko.SSHClient()
         try:
             client.load_host_keys(self.host_keys)
@@ -32,48 +36,127 @@ class ParamikoExecution(RemoteExecution):
             pass
         client.set_missing_host_key_policy(paramiko.WarningPolicy())
         client.connect(host, username=self.user, port=self.port)
+        return client
+
+    def is_healthy(self, client):
+        """
+        Returns true if the given client connection is still usable.
+        """
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def evict_idle_connections(self):
+        """
+        Closes the pooled connections with no running command that have not
+        been used for idle_timeout seconds. Must be called holding the pool lock.
+        """
+        now = time.monotonic()
+        for host, connection in list(self._connections.items()):
+            if connection['channels'] == 0 and now - connection['last_used'] > self.idle_timeout:
+                connection['client'].close()
+                del self._connections[host]
+
+    def open_channel(self, host, command):
+        """
+        Runs the given command on a new channel of the pooled connection to
+        the given host, opening the connection if there is no healthy one.
+        """
+        with self._connections_lock:
+            self.evict_idle_connections()
+            connection = self._connections.get(host)
+            if connection is not None and not self.is_healthy(connection['client']):
+                connection['client'].close()
+                connection = None
+            if connection is None:
+                connection = {'client': self.connect(host), 'channels': 0}
+                self._connections[host] = connection
+            connection['channels'] += 1
+            connection['last_used'] = time.monotonic()
+        try:
+            channel = connection['client'].get_transport().open_session()
+            channel.exec_command(' '.join([shlex.quote(x) for x in command]))
+        except Exception:
+            self.release_channel(host, connection)
+            raise
+        return channel, connection
+
+    def release_channel(self, host, connection):
+        """
+        Marks a channel of the given pooled connection as finished.
+        """
+        with self._connections_lock:
+            connection['channels'] -= 1
+            connection['last_used'] = time.monotonic()
+
+    def run_channel(self, host, command, job=None):
+        """
+        Runs the command on a new channel and waits for it to finish. If job
+        is given, closing the channel is attached to it so the command can be
+        killed.
+        """
+        connection = None
         try:
-            stdinfile, stdoutfile, stderrfile = client.exec_command(
-                ' '.join([shlex.quote(x) for x in command])
-            )
-            with stdoutfile as f:
+            channel, connection = self.open_channel(host, command)
+            if job is not None:
+                job.attach(channel.close)
+            with channel.makefile('rb') as f:
                 stdout = f.read()
-            with stderrfile as f:
+            with channel.makefile_stderr('rb') as f:
                 stderr = f.read()
-            stdinfile.close()
-            returncode = stdoutfile.channel.recv_exit_status()
+            returncode = channel.recv_exit_status()
+            channel.close()
         except paramiko.SSHException:
             returncode = -1
             stdout = None
             stderr = None
-        client.close()
+        finally:
+            if connection is not None:
+                self.release_channel(host, connection)
         return CommandReturn(returncode, stdout, stderr)
 
+    def run(self, host, command):
+        return self.run_channel(host, command)
+
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        Runs the command on a new channel, reading its output from the
+        channel while it runs.
+        """
+        stream = CommandStream(memory_limit)
+        try:
+            channel, connection = self.open_channel(host, command)
+        except paramiko.SSHException:
+            stream.finish(-1)
+            return stream
+
+        def wait():
+            try:
+                return channel.recv_exit_status()
+            finally:
+                channel.close()
+                self.release_channel(host, connection)
+
+        return stream.follow({'stdout': lambda: channel.recv(stream.chunk_size),
+                              'stderr': lambda: channel.recv_stderr(stream.chunk_size)},
+                             wait)
+
     def start_job(self, host, command):
-        output_pipe, input_pipe = Pipe()
-        job = Process(target=run_subprocess,
-                      args=(host, command, self.user, self.port,
-                            self.host_keys, input_pipe)
-                      )
-        job.start()
-        input_pipe.close()
-        return {'process': job, 'pipe': output_pipe}
+        return ThreadJob(self.run_channel, host, command)
 
     def monitor_job(self, host, job):
-        if job['process'].is_alive():
-            return CommandReturn(None, None, None)
-        else:
-            result = job['pipe'].recv()
-            job['pipe'].close()
-            return result
+        return job.monitor()
 
     def kill_job(self, host, job):
-        if job['process'].is_alive():
-            job['process'].terminate()
+        job.kill()
 
     def wait_job(self, host, job):
-        while job['process'].is_alive():
-            time.sleep(1)
-        result = job['pipe'].recv()
-        job['pipe'].close()
-        return result
+        return job.wait()
+
+    def close(self):
+        """
+        Closes all the pooled connections.
+        """
+        with self._connections_lock:
+            for connection in self._connections.values():
+                connection['client'].close()
+            self._connections = {}
@@ -1,12 +1,43 @@
 #!/usr/bin/python3
 import abc
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+
+# bytes of the output of a command streamed in memory before spooling it to disk
+DEFAULT_MEMORY_LIMIT = 16 * 1024 * 1024
+
+
+async def wait_async(waitable):
+    """
+    Waits on the running event loop until a CommandStream or a ThreadJob
+    finishes, without taking a thread while it runs: the thread finishing it
+    wakes up the loop.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result():
+        if not future.done():
+            future.set_result(None)
+
+    def done():
+        try:
+            loop.call_soon_threadsafe(set_result)
+        except RuntimeError:
+            # the loop was closed while the command ran
+            pass
+
+    waitable.add_done_callback(done)
+    await future
 
 
 class CommandReturn:
     """
     Class that provides a standardized method to return command execution.
     It assumes the standard output and errors are "small" enough to be stored
-    on memory.
+    on memory; see CommandStream for the ones that are not.
     """
     def __init__(self, returncode, stdout, stderr):
         self.returncode = returncode
@@ -14,13 +45,262 @@ class CommandReturn:
         self.stderr = stderr
 
 
+class CommandStream(CommandReturn):
+    """
+    CommandReturn of a command whose standard output and error can be read
+    while it runs, in chunks or lines. Each one is spooled in memory up to
+    memory_limit bytes, and to a temporary file after that, so big outputs
+    are processed with bounded memory. returncode is None until the command
+    finishes; stdout and stderr wait for it, and return the whole output.
+    """
+    STREAMS = ('stdout', 'stderr')
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, chunk_size=64 * 1024):
+        """
+        Initialize the instance variables.
+
+        :param memory_limit: bytes of each output kept in memory before
+                             spooling it to disk
+        :param chunk_size: maximum bytes read or returned at once
+        """
+        self.returncode = None
+        self.chunk_size = chunk_size
+        self._files = {name: tempfile.SpooledTemporaryFile(max_size=memory_limit)
+                       for name in self.STREAMS}
+        self._sizes = dict.fromkeys(self.STREAMS, 0)
+        self._ended = dict.fromkeys(self.STREAMS, False)
+        self._condition = threading.Condition()
+        self._callbacks = []
+        self.done = threading.Event()
+
+    def follow(self, readers, wait):
+        """
+        Copies the output of a running command to the stream on threads,
+        and returns immediately.
+
+        :param readers: dictionary with a function per stream name, returning
+                        the next bytes of that output, or b'' at its end
+        :param wait: function called once all the output is read, returning
+                     the return code of the command
+        :return: the stream itself
+        """
+        threads = [threading.Thread(target=self._copy, args=(name, read), daemon=True)
+                   for name, read in readers.items()]
+        for thread in threads:
+            thread.start()
+
+        def finish():
+            for thread in threads:
+                thread.join()
+            try:
+                returncode = wait()
+            except Exception:
+                returncode = -1
+            self.finish(returncode)
+
+        threading.Thread(target=finish, daemon=True).start()
+        return self
+
+    def _copy(self, name, read):
+        try:
+            for data in iter(read, b''):
+                self.write(name, data)
+        finally:
+            self.end(name)
+
+    def write(self, name, data):
+        """
+        Appends bytes to the given output.
+        """
+        with self._condition:
+            self._files[name].seek(0, 2)
+            self._files[name].write(data)
+            self._sizes[name] += len(data)
+            self._condition.notify_all()
+
+    def end(self, name):
+        """
+        Marks the end of the given output.
+        """
+        with self._condition:
+            self._ended[name] = True
+            self._condition.notify_all()
+
+    def finish(self, returncode):
+        """
+        Marks the end of the command, and of all its output.
+        """
+        with self._condition:
+            self._ended = dict.fromkeys(self.STREAMS, True)
+            self.returncode = returncode
+            self.done.set()
+            self._condition.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback, without arguments, once the command finishes, from
+        the thread finishing it; right away if it already finished.
+        """
+        with self._condition:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def chunks(self, name='stdout'):
+        """
+        Iterates the given output in chunks of up to chunk_size bytes, from
+        its start, waiting for the command to write more until it ends.
+        Several iterators can read the same output at once.
+        """
+        position = 0
+        while True:
+            with self._condition:
+                while self._sizes[name] == position and not self._ended[name]:
+                    self._condition.wait()
+                if self._sizes[name] == position:
+                    return
+                self._files[name].seek(position)
+                data = self._files[name].read(min(self.chunk_size, self._sizes[name] - position))
+            position += len(data)
+            yield data
+
+    def lines(self, name='stdout', encoding='utf-8'):
+        """
+        Iterates the given output line by line, without the line breaks, like
+        chunks().
+        """
+        pending = b''
+        for chunk in self.chunks(name):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode(encoding, 'replace')
+        if pending:
+            yield pending.decode(encoding, 'replace')
+
+    def wait(self):
+        """
+        Waits until the command finishes, and returns the stream itself.
+        """
+        self.done.wait()
+        return self
+
+    def read(self, name):
+        """
+        Waits until the command finishes, and returns the whole given output
+        as bytes.
+        """
+        self.wait()
+        return b''.join(self.chunks(name))
+
+    @property
+    def stdout(self):
+        return self.read('stdout').decode('utf-8', 'replace')
+
+    @property
+    def stderr(self):
+        return self.read('stderr').decode('utf-8', 'replace')
+
+    def close(self):
+        """
+        Releases the spooled output.
+        """
+        for output_file in self._files.values():
+            output_file.close()
+
+
+class ThreadJob(object):
+    """
+    Background job running a command on its own daemon thread, for the
+    implementations whose commands do not need a local process of their own.
+    Its end is signalled with an event, so waiting for it returns as soon as
+    the command finishes.
+    """
+    def __init__(self, run, host, command):
+        """
+        Starts the job.
+
+        :param run: function running the command, called as run(host, command, job)
+                    and returning a CommandReturn; it can give the job a way
+                    to stop the command with attach()
+        """
+        self.result = None
+        self.killed = False
+        self.stop = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.thread = threading.Thread(target=self._run, args=(run, host, command), daemon=True)
+        self.thread.start()
+
+    def _run(self, run, host, command):
+        try:
+            self.result = run(host, command, self)
+        except Exception:
+            self.result = CommandReturn(-1, None, None)
+        finally:
+            with self._lock:
+                self.done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback, without arguments, once the command finishes, from
+        the job thread; right away if it already finished.
+        """
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def attach(self, stop):
+        """
+        Sets the function called by kill() to stop the running command. If
+        the job was already killed, it is called right away.
+        """
+        self.stop = stop
+        if self.killed:
+            stop()
+
+    def monitor(self):
+        """
+        Returns the CommandReturn of the command, with None as the returncode
+        if it is still running.
+        """
+        if not self.done.is_set():
+            return CommandReturn(None, None, None)
+        return self.result
+
+    def kill(self):
+        """
+        Stops the command, if it is still running.
+        """
+        self.killed = True
+        if not self.done.is_set() and self.stop is not None:
+            self.stop()
+
+    def wait(self):
+        """
+        Waits until the command finishes, then returns its CommandReturn.
+        """
+        self.done.wait()
+        return self.result
+
+
 class RemoteExecution(metaclass=abc.ABCMeta):
     """
     Fully-abstract class that defines the interface for implementable remote
     execution methods.
     """
 
-    def __init__(self, options):
+    def __init__(self, options={}):
         """
         Initialize RemoteExecution instance variables.
 
@@ -36,6 +316,31 @@ class RemoteExecution(metaclass=abc.ABCMeta):
         """
         pass
 
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        Executes a command on a host and returns immediately a CommandStream,
+        to read its output while it runs.
+        Implementations that can read the output of a command while it runs
+        should override it; by default the command is run with run() on a
+        thread, and its output is written to the stream once it finishes.
+        """
+        stream = CommandStream(memory_limit)
+
+        def run():
+            try:
+                result = self.run(host, command)
+            except Exception:
+                result = CommandReturn(-1, None, None)
+            for name in CommandStream.STREAMS:
+                output = getattr(result, name)
+                if output:
+                    stream.write(name, output if isinstance(output, bytes)
+                                 else output.encode('utf-8'))
+            stream.finish(result.returncode)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stream
+
     @abc.abstractmethod
     def start_job(self, host, command):
         """
@@ -66,3 +371,130 @@ class RemoteExecution(metaclass=abc.ABCMeta):
         Waits until job finishes, then returns a CommandReturn object.
         """
         pass
+
+    def close(self):
+        """
+        Releases the resources (connections, caches) kept by the
+        implementation between commands. It does nothing by default.
+        """
+        pass
+
+    def run_many(self, hosts, command):
+        """
+        Executes the same command on several hosts in parallel and gets blocked
+        until it finishes on all of them. Returns a dictionary with the
+        CommandReturn object of each host.
+        Implementations with native support for running on several hosts at
+        once should override it, by default it runs each host on its own thread.
+        """
+        hosts = list(dict.fromkeys(hosts))
+        if not hosts:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            results = executor.map(lambda host: self.run(host, command), hosts)
+            return dict(zip(hosts, results))
+
+    def start_many(self, hosts, command):
+        """
+        Starts the given command on several hosts in the background and returns
+        immediately. Returns a job to be given to wait_many.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        job = executor.submit(self.run_many, hosts, command)
+        executor.shutdown(wait=False)
+        return job
+
+    def wait_many(self, job):
+        """
+        Waits until a job started with start_many finishes on all its hosts,
+        then returns a dictionary with the CommandReturn object of each host.
+        """
+        return job.result()
+
+    def run_each(self, host_commands):
+        """
+        Executes a command per host, running with a single run_many call each
+        group of hosts sharing the same command.
+
+        :param host_commands: list of (host, command) tuples
+        :return: list of CommandReturn objects, in the same order
+        """
+        keys = [command if isinstance(command, str) else tuple(command)
+                for _, command in host_commands]
+        groups = {}
+        for (host, command), key in zip(host_commands, keys):
+            groups.setdefault(key, (command, []))[1].append(host)
+        results = {}
+        for key, (command, hosts) in groups.items():
+            for host, result in self.run_many(hosts, command).items():
+                results[(host, key)] = result
+        return [results[(host, key)] for (host, _), key in zip(host_commands, keys)]
+
+    async def run_async(self, host, command):
+        """
+        Coroutine version of run, to be awaited on an event loop.
+        By default the command is started with run_stream on the loop's
+        default executor, which only takes one of its threads while it
+        starts, and its end is awaited with wait_async, so long commands do
+        not hold any of them. Implementations that can run a command
+        natively on the loop, like asyncio subprocesses, should override it.
+        """
+        loop = asyncio.get_running_loop()
+        stream = await loop.run_in_executor(None, self.run_stream, host, command)
+        try:
+            await wait_async(stream)
+            return CommandReturn(stream.returncode, stream.stdout, stream.stderr)
+        finally:
+            stream.close()
+
+    async def start_job_async(self, host, command):
+        """
+        Coroutine version of start_job, returning a job to be given to
+        wait_job_async, monitor_job or kill_job. start_job returns as soon
+        as the job starts, so it only takes a thread of the loop's default
+        executor for that.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.start_job, host, command)
+
+    async def wait_job_async(self, host, job):
+        """
+        Coroutine version of wait_job. ThreadJob jobs are awaited with
+        wait_async, without taking a thread; other jobs are waited for with
+        wait_job on the loop's default executor, taking one of its threads
+        until they finish.
+        """
+        if isinstance(job, ThreadJob):
+            await wait_async(job)
+            return self.wait_job(host, job)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_job, host, job)
+
+    async def run_many_async(self, hosts, command):
+        """
+        Coroutine version of run_many, running the command on every host at
+        once with run_async.
+        """
+        hosts = list(dict.fromkeys(hosts))
+        results = await asyncio.gather(*[self.run_async(host, command) for host in hosts])
+        return dict(zip(hosts, results))
+
+    async def run_each_async(self, host_commands):
+        """
+        Coroutine version of run_each, running all the groups of hosts at once.
+
+        :param host_commands: list of (host, command) tuples
+        :return: list of CommandReturn objects, in the same order
+        """
+        keys = [command if isinstance(command, str) else tuple(command)
+                for _, command in host_commands]
+        groups = {}
+        for (host, command), key in zip(host_commands, keys):
+            groups.setdefault(key, (command, []))[1].append(host)
+        group_results = await asyncio.gather(*[self.run_many_async(hosts, command)
+                                               for command, hosts in groups.values()])
+        results = {}
+        for key, host_results in zip(groups, group_results):
+            for host, result in host_results.items():
+                results[(host, key)] = result
+        return [results[(host, key)] for (host, _), key in zip(host_commands, keys)]
@@ -1,28 +1,72 @@
 #!/usr/bin/python3
-from transferpy.RemoteExecution.RemoteExecution import RemoteExecution
+from transferpy.RemoteExecution.RemoteExecution import DEFAULT_MEMORY_LIMIT, RemoteExecution
 from transferpy.RemoteExecution.LocalExecution import LocalExecution
 
+import os
 import shlex
+import shutil
+import tempfile
 
 
 class SSHExecution(RemoteExecution):
 
-    def __init__(self, user='root', port=22):
+    def __init__(self, user='root', port=22, multiplex=False, control_dir=None,
+                 control_persist=600):
+        """
+        Initialize the instance variables.
+
+        :param user: remote user
+        :param port: remote ssh port
+        :param multiplex: keep a master connection per host that all the
+                          commands to the host go through, until close()
+        :param control_dir: directory for the master connection sockets, a
+                            temporary one is created (and removed on close())
+                            if not given
+        :param control_persist: seconds an idle master connection is kept
+        """
         self.user = user
         self.port = port
+        self.multiplex = multiplex
+        self.control_dir = control_dir
+        self.control_persist = control_persist
+        self._created_control_dir = False
+        self._multiplexed_hosts = set()
         self.localExecution = LocalExecution()
 
+    @property
+    def control_path(self):
+        if self.control_dir is None:
+            self.control_dir = tempfile.mkdtemp(prefix='transferpy-ssh-')
+            self._created_control_dir = True
+        return os.path.join(self.control_dir, '%C')
+
+    def get_multiplex_options(self, host):
+        if not self.multiplex:
+            return []
+        self._multiplexed_hosts.add(host)
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath={}'.format(self.control_path),
+                '-o', 'ControlPersist={}'.format(self.control_persist)]
+
     def get_ssh_command(self, host, command):
         # TODO: accept ipv6-style hosts
-        return ['/usr/bin/ssh', '-p', str(self.port),
-                '@'.join([self.user, host]), ' '.join([shlex.quote(x)
-                                                       for x in command])]
+        return (['/usr/bin/ssh', '-p', str(self.port)] + self.get_multiplex_options(host) +
+                ['@'.join([self.user, host]), ' '.join([shlex.quote(x)
+                                                        for x in command])])
 
     def run(self, host, command):
         # We use the command line client when paramiko is not available
         return self.localExecution.run('localhost',
                                        self.get_ssh_command(host, command))
 
+    async def run_async(self, host, command):
+        return await self.localExecution.run_async('localhost',
+                                                   self.get_ssh_command(host, command))
+
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        return self.localExecution.run_stream('localhost', self.get_ssh_command(host, command),
+                                              memory_limit)
+
     def start_job(self, host, command):
         return self.localExecution.start_job('localhost',
                                              self.get_ssh_command(host,
@@ -36,3 +80,19 @@ class SSHExecution(RemoteExecution):
 
     def wait_job(self, host, job):
         return self.localExecution.wait_job('localhost', job)
+
+    def close(self):
+        """
+        Stops the master connections and removes the temporary socket
+        directory, if any.
+        """
+        for host in sorted(self._multiplexed_hosts):
+            self.localExecution.run('localhost',
+                                    ['/usr/bin/ssh', '-p', str(self.port),
+                                     '-o', 'ControlPath={}'.format(self.control_path),
+                                     '-O', 'exit', '@'.join([self.user, host])])
+        self._multiplexed_hosts = set()
+        if self._created_control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+            self._created_control_dir = False
@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from transferpy.RemoteExecution.RemoteExecution import RemoteExecution
+from transferpy.RemoteExecution.RemoteExecution import DEFAULT_MEMORY_LIMIT, RemoteExecution
 from transferpy.RemoteExecution.LocalExecution import LocalExecution
 
 import shlex
@@ -25,6 +25,14 @@ class SaltExecution(RemoteExecution):
         return self.localExecution.run('localhost',
                                        self.get_salt_command(host, command))
 
+    async def run_async(self, host, command):
+        return await self.localExecution.run_async('localhost',
+                                                   self.get_salt_command(host, command))
+
+    def run_stream(self, host, command, memory_limit=DEFAULT_MEMORY_LIMIT):
+        return self.localExecution.run_stream('localhost', self.get_salt_command(host, command),
+                                              memory_limit)
+
     def start_job(self, host, command):
         # Salt is not yet Python3-compatible
         # job = local.cmd_async(host, 'cmd.run', command)
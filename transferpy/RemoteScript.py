@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import base64
+import json
+import os
+
+
+def session_id(session=None):
+    """
+    Returns the given session, or a new random one if it is None. A session
+    identifies the temporary files and port leases of a transfer on its
+    hosts, so they can be matched to it and cleaned up together.
+    """
+    if session is None:
+        session = os.urandom(6).hex()
+    return session
+
+
+class RemoteScript(object):
+    """
+    Class to run a Python 3 script on a remote host with a single remote
+    execution call. Both the script and its arguments travel base64-encoded,
+    so they do not need any shell quoting.
+    """
+    def __init__(self, source):
+        """
+        Initialize the instance variables.
+
+        :param source: Python 3 source code of the script. It gets its
+                       arguments as base64-encoded JSON on sys.argv[1]
+        """
+        self.source = source
+
+    @staticmethod
+    def encode(data):
+        """
+        Encodes the given bytes or string as a base64 string.
+
+        :param data: bytes or string to encode
+        :return: base64-encoded string
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return base64.b64encode(data).decode('utf-8')
+
+    def shell_command(self, arguments=None):
+        """
+        Returns the shell pipeline that runs the script, to be embedded on a
+        larger command. The script source is read from its standard input.
+
+        :param arguments: JSON-serializable arguments of the script
+        :return: shell command string
+        """
+        return '/bin/echo {} | /usr/bin/base64 -d | /usr/bin/python3 - {}'.format(
+            self.encode(self.source), self.encode(json.dumps(arguments)))
+
+    def filter_command(self, arguments=None):
+        """
+        Returns the shell command that runs the script leaving its standard
+        input free, so it can filter the output of other commands on a
+        pipeline. The script source travels as an extra argument, removed
+        before it runs.
+
+        :param arguments: JSON-serializable arguments of the script
+        :return: shell command string
+        """
+        return ("/usr/bin/python3 -c 'import base64, sys; exec(base64.b64decode(sys.argv.pop(1)))'"
+                ' {} {}').format(self.encode(self.source), self.encode(json.dumps(arguments)))
+
+    def command(self, arguments=None):
+        """
+        Returns the command to run the script on a remote host.
+
+        :param arguments: JSON-serializable arguments of the script
+        :return: command to be run by a RemoteExecution
+        """
+        return ['/bin/bash', '-c', r'"{}"'.format(self.shell_command(arguments))]
+
+    def parse(self, result):
+        """
+        Parses the JSON output of a script execution.
+
+        :param result: CommandReturn of the script execution
+        :return: the decoded output, or None if the script failed
+        """
+        if result.returncode != 0 or not result.stdout:
+            return None
+        try:
+            return json.loads(result.stdout)
+        except ValueError:
+            return None
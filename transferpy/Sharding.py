@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+from transferpy.RemoteScript import RemoteScript, session_id
+
+# Lists a directory tree and splits it in shards of about the same size:
+# files are given, largest first, to the shard with the least bytes so far
+# (longest processing time first), and listed largest first so every tar
+# starts with its biggest files. Directories, symbolic links and other
+# entries go first on the first shard. Each shard list is written, NUL
+# separated and relative to the parent of the directory, to its own file.
+# A directory that cannot be read fails the whole listing, so no file is
+# silently left out of the copy.
+SHARD_SCRIPT = r'''
+import base64
+import heapq
+import json
+import os
+import stat
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+path = os.fsencode(arguments['path'])
+parent = os.path.dirname(os.path.normpath(path))
+if not os.path.isdir(path):
+    sys.exit(1)
+
+
+def fail(error):
+    raise error
+
+
+others = []
+files = []
+for root, dirs, names in os.walk(path, onerror=fail):
+    others.append(root)
+    dirs.sort()
+    for name in sorted(dirs + names):
+        entry = os.path.join(root, name)
+        try:
+            status = os.lstat(entry)
+        except OSError:
+            continue
+        if stat.S_ISREG(status.st_mode):
+            files.append((status.st_size, entry))
+        elif not stat.S_ISDIR(status.st_mode):
+            others.append(entry)
+files.sort(reverse=True)
+
+shards = [{'entries': [], 'files': 0, 'size': 0} for _ in range(arguments['shards'])]
+shards[0]['entries'].extend(others)
+loads = [(0, i) for i in range(len(shards))]
+for size, entry in files:
+    load, i = heapq.heappop(loads)
+    shards[i]['entries'].append(entry)
+    shards[i]['files'] += 1
+    shards[i]['size'] += size
+    heapq.heappush(loads, (load + size, i))
+
+result = []
+for i, shard in enumerate(shards):
+    if not shard['entries']:
+        continue
+    list_path = arguments['lists'][i]
+    with open(list_path, 'wb') as f:
+        f.write(b''.join(os.path.relpath(entry, parent or b'.') + b'\0'
+                         for entry in shard['entries']))
+    result.append({'list': list_path, 'files': shard['files'], 'size': shard['size']})
+print(json.dumps(result))
+'''
+
+
+class Sharder(object):
+    """
+    Class to split a directory in size balanced shards, each one sent by its
+    own tar stream, with a single remote execution listing the whole tree.
+    """
+    def __init__(self, remote_execution, session=None):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        :param session: string identifying the transfer on the list file
+                        names, a random one if not given
+        """
+        self.remote_executor = remote_execution
+        self.session = session_id(session)
+        self.script = RemoteScript(SHARD_SCRIPT)
+
+    def list_path(self, shard):
+        """
+        Returns the path of the file listing the entries of a shard.
+        """
+        return '/tmp/transferpy.{}.{}.shard'.format(self.session, shard)
+
+    def command(self, path, shards):
+        """
+        Returns the command that splits the given directory in shards.
+
+        :param path: directory to split
+        :param shards: maximum number of shards
+        :return: command to be run by a RemoteExecution
+        """
+        return self.script.command({'path': path, 'shards': shards,
+                                    'lists': [self.list_path(i) for i in range(shards)]})
+
+    def run(self, host, path, shards):
+        """
+        Splits the given directory of the given host in shards. See command()
+        for the parameters.
+
+        :return: list of dictionaries, one per non empty shard, with the
+                 'list' file path, and its regular 'files' and their 'size';
+                 or None if the directory could not be listed
+        """
+        return self.script.parse(self.remote_executor.run(host, self.command(path, shards)))
+
+    def tar_command(self, list_path):
+        """
+        Returns the command, to be run on the parent of the directory, that
+        writes a tar of the entries of a shard, listed on list_path, to its
+        standard output.
+        """
+        return '/bin/tar cf - --no-recursion --null -T {}'.format(list_path)
+
+    def cleanup_command(self, shards):
+        """
+        Returns the command that removes the list files of the given shards,
+        as returned by run().
+        """
+        return ['/bin/rm', '-f'] + [shard['list'] for shard in shards]
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+
+import json
+import os.path
+
+from transferpy.RemoteScript import RemoteScript
+
+# Lists a directory tree, with paths relative to its parent: the size and
+# modification time (and the md5, if asked to) of its regular files, its
+# directories, and its other entries, like symbolic links
+LIST_SCRIPT = r'''
+import base64
+import hashlib
+import json
+import os
+import stat
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+path = os.fsencode(arguments['path'])
+parent = os.path.dirname(os.path.normpath(path)) or b'.'
+if not os.path.isdir(path):
+    sys.exit(1)
+
+
+def fail(error):
+    raise error
+
+
+def md5(entry):
+    digest = hashlib.md5()
+    with open(entry, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+files = {}
+dirs = []
+others = []
+for root, subdirs, names in os.walk(path, onerror=fail):
+    dirs.append(os.fsdecode(os.path.relpath(root, parent)))
+    subdirs.sort()
+    for name in sorted(names + subdirs):
+        entry = os.path.join(root, name)
+        status = os.lstat(entry)
+        relative_path = os.fsdecode(os.path.relpath(entry, parent))
+        if stat.S_ISREG(status.st_mode):
+            files[relative_path] = [status.st_size, int(status.st_mtime)]
+            if arguments['checksum']:
+                files[relative_path].append(md5(entry))
+        elif not stat.S_ISDIR(status.st_mode):
+            others.append(relative_path)
+print(json.dumps({'files': files, 'dirs': dirs, 'others': others}))
+'''
+
+# Writes the given paths, NUL separated, to a file for tar -T
+LIST_WRITER_SCRIPT = r'''
+import base64
+import json
+import os
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+with open(arguments['path'], 'ab' if arguments['append'] else 'wb') as f:
+    f.write(b''.join(os.fsencode(entry) + b'\0' for entry in arguments['entries']))
+'''
+
+# Removes the given paths, relative to a directory, and the trees below them
+REMOVE_SCRIPT = r'''
+import base64
+import json
+import os
+import shutil
+import sys
+
+arguments = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+for entry in arguments['entries']:
+    path = os.path.join(os.fsencode(arguments['path']), os.fsencode(entry))
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+'''
+
+
+class Syncer(object):
+    """
+    Class to send to an existing copy of a directory only what changed on the
+    source. Both trees are listed, and the files that are not on the copy
+    with the same size and modification time (or the same size and md5, if
+    checksummed) are sent with a tar of just them, so the copy still travels
+    through the usual compression, encryption and netcat pipeline.
+    tar restores the modification times, so an unchanged tree is not sent
+    again on the next sync.
+    """
+    def __init__(self, remote_execution):
+        """
+        Initialize the instance variables.
+
+        :param remote_execution: remote execution helper
+        """
+        self.remote_executor = remote_execution
+        # bytes of each remote command sending a list of paths, under the
+        # 128KiB (MAX_ARG_STRLEN) a single argument can take on Linux
+        self.chunk_size = 96 * 1024
+        self.list_script = RemoteScript(LIST_SCRIPT)
+        self.list_writer_script = RemoteScript(LIST_WRITER_SCRIPT)
+        self.remove_script = RemoteScript(REMOVE_SCRIPT)
+
+    def list_command(self, path, checksum=False):
+        """
+        Returns the command that lists a directory tree.
+
+        :param path: directory to list
+        :param checksum: whether the md5 of every file is listed too
+        """
+        return self.list_script.command({'path': path, 'checksum': checksum})
+
+    def parse_list(self, result):
+        """
+        :return: dictionary with the 'files' [size, mtime] (or [size, mtime,
+                 md5]) by path, and the 'dirs' and 'others' paths; or None if
+                 the tree could not be listed
+        """
+        return self.list_script.parse(result)
+
+    @staticmethod
+    def kinds(tree_list):
+        """
+        Returns the kind ('file', 'dir' or 'other') of every path of a tree list.
+        """
+        kinds = dict.fromkeys(tree_list['dirs'], 'dir')
+        kinds.update(dict.fromkeys(tree_list['others'], 'other'))
+        kinds.update(dict.fromkeys(tree_list['files'], 'file'))
+        return kinds
+
+    @staticmethod
+    def changed_entries(source_list, target_list, checksum=False):
+        """
+        Returns the paths of the source directory a sync has to send: its
+        directories and other non regular entries, which are cheap to send
+        again, and the files that are not on the target with the same size
+        and modification time, or the same size and md5 if checksum is true.
+        """
+        def key(facts):
+            if facts is None:
+                return None
+            return (facts[0], facts[2]) if checksum else (facts[0], facts[1])
+
+        return source_list['dirs'] + source_list['others'] + \
+            [path for path, facts in source_list['files'].items()
+             if key(target_list['files'].get(path)) != key(facts)]
+
+    @staticmethod
+    def extra_entries(source_list, target_list):
+        """
+        Returns the paths of the target directory that are not on the source,
+        or are there with a different kind (e.g. a file replaced by a
+        directory), leaving out the ones inside another returned directory.
+        """
+        source_kinds = Syncer.kinds(source_list)
+        target_kinds = Syncer.kinds(target_list)
+        extra = {path for path, kind in target_kinds.items() if source_kinds.get(path) != kind}
+
+        def inside_extra(path):
+            parent = os.path.dirname(path)
+            while parent:
+                if parent in extra:
+                    return True
+                parent = os.path.dirname(parent)
+            return False
+
+        return sorted(path for path in extra if not inside_extra(path))
+
+    def chunks(self, entries, command):
+        """
+        Splits a list of paths in chunks whose command stays under chunk_size
+        bytes. Paths travel JSON-escaped (non-ASCII characters take up to 12
+        bytes) and then base64-encoded, so what counts is their encoded length.
+
+        :param entries: list of paths
+        :param command: function returning the command for a chunk of paths
+        :return: list of chunks of paths
+        """
+        overhead = len(command([])[-1]) + 4
+        chunks = [[]]
+        length = overhead
+        for entry in entries:
+            # its JSON string and separator, base64-encoded
+            entry_length = (len(json.dumps(entry)) + 2) * 4 // 3 + 1
+            if length + entry_length > self.chunk_size and chunks[-1]:
+                chunks.append([])
+                length = overhead
+            chunks[-1].append(entry)
+            length += entry_length
+        return chunks
+
+    def write_list_commands(self, path, entries):
+        """
+        Returns the commands that write the given paths, NUL separated, to a
+        file, a chunk of them per command.
+        """
+        def command(chunk, append=True):
+            return self.list_writer_script.command({'path': path, 'entries': chunk,
+                                                    'append': append})
+
+        return [command(chunk, i > 0) for i, chunk in enumerate(self.chunks(entries, command))]
+
+    def remove_commands(self, path, entries):
+        """
+        Returns the commands that remove the given paths, relative to the
+        directory path, a chunk of them per command.
+        """
+        if not entries:
+            return []
+
+        def command(chunk):
+            return self.remove_script.command({'path': path, 'entries': chunk})
+
+        return [command(chunk) for chunk in self.chunks(entries, command)]
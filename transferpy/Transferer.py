@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import os
 import os.path
 import re
@@ -8,8 +9,23 @@ import time
 import logging
 
 from transferpy.RemoteExecution.CuminExecution import CuminExecution as RemoteExecution
-from transferpy.Firewall import Firewall
+from transferpy.Agent import Agent
+from transferpy.BandwidthLimit import BandwidthLimiter
+from transferpy.Checkpoint import Checkpoint
+from transferpy.Checksum import ALGORITHMS as CHECKSUM_ALGORITHMS, Checksum
+from transferpy.Compression import (COMPRESSORS, CompressionSampler, choose_compression,
+                                    detect_compressor, get_compressor)
+from transferpy.Firewall import (DEFAULT_PORT_RANGE, DEFAULT_TIMEOUT as FIREWALL_TIMEOUT,
+                                 MAX_PORTS_PER_RULE, Firewall)
+from transferpy.InlineChecksum import InlineChecksum
 from transferpy.MariaDB import MariaDB
+from transferpy.MultiStream import (preallocate_command, read_range_command, split_ranges,
+                                    write_range_command)
+from transferpy.Probe import Probe
+from transferpy.RemoteScript import session_id
+from transferpy.Progress import Progress
+from transferpy.Sharding import Sharder
+from transferpy.Sync import Syncer
 
 
 class Transferer(object):
@@ -23,21 +39,109 @@ class Transferer(object):
             self.options['type'] = 'file'
         if 'verbose' not in self.options:  # default to non-verbose output
             self.options['verbose'] = False
+        if 'parallel_targets' not in self.options:  # default to one target at a time
+            self.options['parallel_targets'] = 1
+        if 'chain' not in self.options:  # default to the source sending to every target
+            self.options['chain'] = False
+        if 'agent' not in self.options:  # default to nc moving the data between hosts
+            self.options['agent'] = False
+        if 'listen_timeout' not in self.options:  # seconds to wait for nc to be listening
+            self.options['listen_timeout'] = 60
+        if 'checksum_algorithm' not in self.options:  # default to md5 (md5sum) checksums
+            self.options['checksum_algorithm'] = 'md5'
+        if 'compressor' not in self.options:  # default to pigz (gzip) compression
+            self.options['compressor'] = 'pigz'
+        if 'compress_level' not in self.options:  # default to the compressor default level
+            self.options['compress_level'] = None
+        if 'compress_threads' not in self.options:  # default to the compressor default threads
+            self.options['compress_threads'] = None
+        if 'progress' not in self.options:  # default to no progress reports
+            self.options['progress'] = False
+        if 'progress_interval' not in self.options:  # seconds between progress reports
+            self.options['progress_interval'] = 10
+        if 'progress_json' not in self.options:  # default to no JSON lines progress reports
+            self.options['progress_json'] = None
+        if 'resume' not in self.options:  # default to copies that cannot be resumed
+            self.options['resume'] = False
+        if 'sync' not in self.options:  # default to refusing to overwrite existing copies
+            self.options['sync'] = False
+        if 'sync_delete' not in self.options:  # default to keep files missing on the source
+            self.options['sync_delete'] = False
+        if 'sync_checksum' not in self.options:  # default to compare files by size and time
+            self.options['sync_checksum'] = False
+        if 'streams' not in self.options:  # default to one connection per copy
+            self.options['streams'] = 1
+        if 'bwlimit' not in self.options:  # default to no limit of the bandwidth of the source
+            self.options['bwlimit'] = None
+        if 'target_bwlimits' not in self.options:  # default to no limit per target host
+            self.options['target_bwlimits'] = {}
+        if 'bwlimit_file' not in self.options:  # default to limits fixed at the start
+            self.options['bwlimit_file'] = None
+        if 'firewall' not in self.options:  # default to ipset on the targets that have it
+            self.options['firewall'] = 'auto'
+        if 'firewall_timeout' not in self.options:  # seconds the ipset entries and leases last
+            self.options['firewall_timeout'] = FIREWALL_TIMEOUT
+        if 'port_range' not in self.options:  # ports searched when no port is given
+            self.options['port_range'] = DEFAULT_PORT_RANGE
+        if 'inline_checksum' not in self.options:  # default to checksum before and after the copy
+            self.options['inline_checksum'] = False
+        if self.options['inline_checksum']:  # inline checksums replace the ones reading the files
+            self.options['checksum'] = False
 
         self.logger = logging.getLogger(__name__)
         remote_execution_options = {'verbose': self.options['verbose']}
         self.remote_executor = RemoteExecution(remote_execution_options)
+        # identifies the transfer on the temporary files and port leases of its hosts
+        self.session = session_id()
         self.mariadb = MariaDB(self.remote_executor)
+        self.probe = Probe(self.remote_executor)
+        self.compression_sampler = CompressionSampler(self.remote_executor)
+        self.progress = Progress(self.remote_executor, self.options['progress_json'],
+                                 self.session)
+        self.sharder = Sharder(self.remote_executor, self.session)
+        self.checkpoint = Checkpoint(self.remote_executor)
+        self.syncer = Syncer(self.remote_executor)
+        self.agent = Agent()
+        self.bandwidth_limiter = BandwidthLimiter(self.remote_executor, self.options['bwlimit'],
+                                                  self.options['target_bwlimits'],
+                                                  self.options['bwlimit_file'], self.session)
 
         self.source_is_dir = False
         self.source_is_socket = False
         self.original_size = 0
+        # shards of a sharded directory copy, as returned by Sharder.run
+        self.shards = None
+        # (target_host, target_path) of the partial copies found when resuming,
+        # and of the existing copies found when syncing, and where the copy to
+        # each target starts: {'offset': bytes of a file already copied} or
+        # {'list': file listing what is left, or changed, of a dir}
+        self.resumable_targets = set()
+        self.synced_targets = set()
+        self.resume_points = {}
+        # firewall backend of every target host, iptables if not found
+        self.firewall_backends = {}
+        # copies sharing the bandwidth limit of the source
+        self.concurrent_copies = 1
         self.checksum = None
+        self.checksum_algorithm = self.options['checksum_algorithm']
+        self._inline_hasher = None
+        self._compressor = None
+        # bytes per second the network is assumed to move, to choose the compression
+        self.link_speed = 10 * 1000 * 1000 * 1000 / 8
+        # files of a checksum mismatch logged per kind of difference
+        self.max_reported_differences = 100
 
         self._password = None
         self.cipher = 'chacha20'
         self.buffer_size = 8
 
+        # initial and maximum seconds between checks of a receiver listening
+        self.listen_check_interval = 0.1
+        self.listen_check_max_interval = 2
+        # seconds between checks of the sender finishing, when reporting progress
+        # or adjusting the bandwidth limit
+        self.job_check_interval = 0.5
+
         self.logger.debug('Finished Transferer initialization')
 
     def run_command(self, host, command):
@@ -81,23 +185,42 @@ class Transferer(object):
         result = self.run_command(host, command)
         return not result.returncode
 
+    def checksum_command(self, path):
+        return Checksum(self.checksum_algorithm).command(path, self.source_is_dir)
+
+    def parse_checksum(self, result):
+        checksum = Checksum(self.checksum_algorithm)
+        manifest = checksum.parse(result)
+        if manifest is None:
+            raise ValueError('{} execution failed'.format(os.path.basename(checksum.executable)))
+        return manifest
+
     def calculate_checksum(self, host, path):
         self.logger.info('Started checksum calculation for {}:{}'.format(host, path))
-        hash_executable = '/usr/bin/md5sum'
-        parent_dir = os.path.normpath(os.path.join(path, '..'))
-        basename = os.path.basename(os.path.normpath(path))
-        if self.source_is_dir:
-            command = ['/bin/bash', '-c',
-                       '"cd {} && /usr/bin/find {} -type f -exec {} {}"'
-                       .format(parent_dir, basename, hash_executable, r'\{\} \;')]
-        else:
-            command = ['/bin/bash', '-c', r'"cd {} && {} {}"'
-                       .format(parent_dir, hash_executable, basename)]
-        result = self.run_command(host, command)
-        if result.returncode != 0:
-            raise Exception('md5sum execution failed')
+        result = self.remote_executor.run_stream(host, self.checksum_command(path))
+        checksum = self.parse_checksum(result)
         self.logger.info('Finished checksum calculation for {}:{}'.format(host, path))
-        return result.stdout
+        return checksum
+
+    @property
+    def is_inline_checksum(self):
+        """
+        Property: whether the checksums are calculated on the transfer stream,
+        while it is sent and received, instead of reading the files again.
+        Only file and directory transfers are hashed inline.
+        """
+        return (self.options['inline_checksum'] and
+                not self.is_xtrabackup and not self.is_decompress)
+
+    @property
+    def inline_hasher(self):
+        """
+        Property: InlineChecksum building the inline checksum commands.
+        """
+        if self._inline_hasher is None:
+            self._inline_hasher = InlineChecksum(self.source_is_dir, session=self.session,
+                                                 name=os.path.basename(self.source_path))
+        return self._inline_hasher
 
     def has_available_disk_space(self, host, path, size):
         command = ['/bin/bash', '-c',
@@ -133,15 +256,61 @@ class Transferer(object):
         result = self.run_command(host, command)
         return result.returncode == 0
 
+    @property
+    def compressor(self):
+        """
+        Property: Compressor of the transfer stream. On decompress mode, it is
+        the one detected by sanity_checks for the source archive.
+        """
+        if self._compressor is None:
+            self._compressor = get_compressor(self.options['compressor'],
+                                              self.options['compress_level'],
+                                              self.options['compress_threads'])
+        return self._compressor
+
+    @property
+    def is_auto_compression(self):
+        """
+        Property: whether the compressor is chosen by sampling the source.
+        """
+        return (self.options['compress'] and self.options['compressor'] == 'auto' and
+                not self.is_decompress)
+
+    def choose_compressor(self, path, compressors):
+        """
+        Samples the given source path and chooses the compressor and level
+        that will move it the fastest, or disables compression if it does
+        not pay off, logging why.
+
+        :param path: source file or directory to sample
+        :param compressors: names of the compressors available on all hosts
+        """
+        sample = None
+        if compressors:
+            sample = self.compression_sampler.run(self.source_host, path, compressors)
+        if sample is None:
+            self.logger.warning('The source could not be sampled for compression, '
+                                'compression disabled')
+            self.options['compress'] = False
+            return
+        name, level, reason = choose_compression(sample, self.link_speed,
+                                                 self.options['compress_threads'])
+        if name is None:
+            self.logger.info('Compression disabled: {}'.format(reason))
+            self.options['compress'] = False
+        else:
+            self.logger.info('Compressing with {}'.format(reason))
+            self._compressor = get_compressor(name, level, self.options['compress_threads'])
+
     @property
     def compress_command(self):
         if self.options['compress']:
             if self.source_is_dir or self.is_xtrabackup:
-                compress_command = '| /usr/bin/pigz -c'
+                compress_command = '| {}'.format(self.compressor.compress_command)
             elif self.is_decompress:
                 compress_command = '/bin/cat'  # file is already compressed
             else:
-                compress_command = '/usr/bin/pigz -c'
+                compress_command = self.compressor.compress_command
         else:
             if self.source_is_dir or self.source_is_socket:
                 compress_command = ''
@@ -153,23 +322,42 @@ class Transferer(object):
     @property
     def decompress_command(self):
         if self.options['compress']:
-            decompress_command = '| /usr/bin/pigz -c -d'
+            decompress_command = '| {}'.format(self.compressor.decompress_command)
         else:
             decompress_command = ''
 
         return decompress_command
 
-    def netcat_send_command(self, target_host):
-        netcat_send_command = '| /bin/nc -q 0 -w 300 {} {}'.format(target_host, self.options['port'])
+    def netcat_send_command(self, target_host, port=None):
+        if port is None:
+            port = self.options['port']
+        if self.options['agent']:
+            return '| {}'.format(self.agent.send_command(target_host, port))
+        netcat_send_command = '| /bin/nc -q 0 -w 300 {} {}'.format(target_host, port)
 
         return netcat_send_command
 
-    @property
-    def netcat_listen_command(self):
-        netcat_listen_command = '/bin/nc -l -w 300 -p {}'.format(self.options['port'])
+    def get_netcat_listen_command(self, port):
+        if self.options['agent']:
+            return self.agent.receive_command(port)
+        netcat_listen_command = '/bin/nc -l -w 300 -p {}'.format(port)
 
         return netcat_listen_command
 
+    @property
+    def is_plain_agent_copy(self):
+        """
+        Property: whether the agent sends the source file itself, and writes
+        it on the targets, as it is neither compressed nor encrypted.
+        """
+        return (self.options['agent'] and not self.options['compress'] and
+                not self.options['encrypt'] and not self.is_xtrabackup and
+                not self.is_decompress)
+
+    @property
+    def netcat_listen_command(self):
+        return self.get_netcat_listen_command(self.options['port'])
+
     @property
     def tar_command(self):
         return '/bin/tar cf -'
@@ -237,130 +425,989 @@ class Transferer(object):
 
         return decrypt_command
 
-    def copy_to(self, target_host, target_path):
+    def listening_command(self, port):
         """
-        Copies the source file or dir on the source host to 'target_host'.
-        'target_path' is assumed to be a *directory* and the source file or
-        directory will be copied inside.
+        Returns the command that succeeds if there is a process listening on
+        the given tcp port.
+        """
+        return ['/bin/bash', '-c', r'"/bin/ss -ltn sport = :{} | /bin/grep -q LISTEN"'.format(port)]
+
+    def is_listening(self, host, port):
+        """
+        Returns true if there is a process listening on the given tcp port of
+        the given host.
+        """
+        result = self.run_command(host, self.listening_command(port))
+        return result.returncode == 0
+
+    def wait_for_listener(self, host, port, job):
+        """
+        Waits until the receiver started as 'job' listens on the given port of
+        the given host, checking it with an exponential backoff.
+
+        :param host: host where the receiver runs
+        :param port: port the receiver listens on
+        :param job: remote execution job of the receiver
+        :return: true if the receiver is listening, false if it finished or did
+                 not listen before the listen_timeout option seconds
+        """
+        deadline = time.monotonic() + self.options['listen_timeout']
+        interval = self.listen_check_interval
+        while True:
+            if self.is_listening(host, port):
+                return True
+            if self.remote_executor.monitor_job(host, job).returncode is not None:
+                self.logger.error('Receiver on {}:{} finished before listening'.format(host, port))
+                return False
+            if time.monotonic() >= deadline:
+                self.logger.error('Receiver on {}:{} was not listening after {} seconds'
+                                  .format(host, port, self.options['listen_timeout']))
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, self.listen_check_max_interval)
+
+    def relay_command(self, relay_host, relay_port):
+        """
+        Returns the command that forwards the stream received by a target,
+        still compressed and encrypted, to the next target of a chain.
+        """
+        if relay_host is None:
+            return ''
+        return '| /usr/bin/tee >({})'.format(
+            self.netcat_send_command(relay_host, relay_port)[2:])
+
+    def inline_checksum_commands(self, port, side):
+        """
+        Returns the (start, tee, end) command fragments of the inline checksum
+        of the given side ('src' or 'dst') of the copy on port, or empty
+        strings if inline checksums are not used.
+        """
+        if not self.is_inline_checksum:
+            return '', '', ''
+        return (self.inline_hasher.start_command(port, side),
+                self.inline_hasher.tee_command(port, side),
+                self.inline_hasher.end_command())
+
+    def progress_command(self, port, name):
+        """
+        Returns the pipeline fragment counting the bytes of the copy on port
+        for the progress reports ('read', 'sent' or 'written'), or an empty
+        string if progress is not reported.
+        """
+        if not self.options['progress']:
+            return ''
+        return self.progress.counter_command(port, name)
+
+    @property
+    def is_chain(self):
+        return self.options['chain'] and len(self.target_hosts) > 1
+
+    @property
+    def is_multistream(self):
+        """
+        Property: whether the source is a single file sent in byte ranges
+        over several connections. Chains send a single stream.
+        """
+        return (self.options['streams'] > 1 and self.options['type'] == 'file'
+                and not self.source_is_dir and not self.is_chain)
+
+    @property
+    def is_sharded(self):
+        """
+        Property: whether the source is a directory sent in shards, each one
+        by its own tar stream. Chains send a single stream.
+        """
+        return (self.options['streams'] > 1 and self.options['type'] == 'file'
+                and self.source_is_dir and not self.is_chain)
+
+    def bandwidth_rate(self, target_host):
+        """
+        Returns the bytes per second the copy to target_host is limited to,
+        0 for no limit. A chain is limited by all its targets.
+        """
+        if self.is_chain:
+            return self.bandwidth_limiter.rate(self.target_hosts)
+        return self.bandwidth_limiter.rate([target_host], self.concurrent_copies)
+
+    def bandwidth_limit_command(self, target_host, port):
+        """
+        Returns the pipeline fragment limiting the bandwidth of the copy to
+        target_host on port, or an empty string if it is not limited.
+        """
+        return self.bandwidth_limiter.limit_command(port, self.bandwidth_rate(target_host))
+
+    def adjust_bandwidth(self, target_host, port):
+        """
+        Applies the current bandwidth limit to the running copy to
+        target_host on port. Failing to do it is not an error of the transfer.
         """
+        rate = self.bandwidth_rate(target_host)
+        result = self.run_command(self.source_host,
+                                  self.bandwidth_limiter.update_command(port, rate))
+        if result.returncode != 0:
+            self.logger.warning('The bandwidth limit of the copy to {} could not be changed'
+                                .format(target_host))
+        else:
+            self.logger.info('Bandwidth of the copy to {} limited to {}'
+                             .format(target_host, '{} bytes/s'.format(rate) if rate else 'none'))
+
+    def reload_bandwidth_limits(self):
+        """
+        Reads the bandwidth limit control file again, if it changed. Failing
+        to do it is not an error of the transfer, the last limits are kept.
+        """
+        try:
+            self.bandwidth_limiter.reload()
+        except (OSError, ValueError) as e:
+            self.logger.warning('The bandwidth limit file could not be read: {}'.format(e))
 
+    def stream_rate(self, target_host):
+        """
+        Returns the bytes per second each of the streams of a copy to
+        target_host is limited to, which share the limit of the copy; 0 for
+        no limit.
+        """
+        rate = self.bandwidth_rate(target_host)
+        if rate:
+            rate = max(rate // self.options['streams'], 1)
+        return rate
+
+    def adjust_streams_bandwidth(self, target_host, ports):
+        """
+        Applies the current bandwidth limit, split among them, to the running
+        streams of the copy to target_host on ports. Failing to do it is not
+        an error of the transfer.
+        """
+        rate = self.stream_rate(target_host)
+        results = self.remote_executor.run_each(
+            [(self.source_host, self.bandwidth_limiter.update_command(port, rate))
+             for port in ports])
+        if any(result.returncode != 0 for result in results):
+            self.logger.warning('The bandwidth limit of the copy to {} could not be changed'
+                                .format(target_host))
+        else:
+            self.logger.info('Bandwidth of the {} streams of the copy to {} limited to {}'
+                             .format(len(ports), target_host,
+                                     '{} bytes/s each'.format(rate) if rate else 'none'))
+
+    @property
+    def is_resumable(self):
+        return self.options['resume'] and self.options['type'] == 'file'
+
+    @property
+    def is_sync(self):
+        return self.options['sync'] and self.options['type'] == 'file'
+
+    def sender_command(self, target_host, port, resume_point=None):
+        """
+        Returns the command run on the source host to send the source file or
+        dir to the given target host and port. When resuming, only what
+        resume_point says is left is sent.
+        """
+        netcat_send_command = self.netcat_send_command(target_host, port)
+        hash_start, hash_tee, hash_end = self.inline_checksum_commands(port, 'src')
+        read_counter = self.progress_command(port, 'read')
+        # the bandwidth is limited on the bytes sent, after compression and encryption
+        sent_counter = ' '.join(part for part in [self.bandwidth_limit_command(target_host, port),
+                                                  self.progress_command(port, 'sent')] if part)
         if self.is_xtrabackup:
-            src_command = ['/bin/bash', '-c', r'"{} {} {} {}"'
-                           .format(self.xtrabackup_command, self.compress_command,
-                                   self.encrypt_command, self.netcat_send_command(target_host))]
-            dst_command = ['/bin/bash', '-c', r'"cd {} && {} {} {} {}"'
-                           .format(target_path, self.netcat_listen_command, self.decrypt_command,
-                                   self.decompress_command, self.mbstream_command)]
-        elif self.is_decompress:
-            src_command = ['/bin/bash', '-c', r'"{} < {} {} {}"'
-                           .format(self.compress_command, self.source_path, self.encrypt_command,
-                                   self.netcat_send_command(target_host))]
-            dst_command = ['/bin/bash', '-c', r'"cd {} && {} {} {} {}"'
-                           .format(target_path, self.netcat_listen_command, self.decrypt_command,
-                                   self.decompress_command, self.untar_command)]
-        elif self.source_is_dir:
+            parts = [self.xtrabackup_command, read_counter, self.compress_command,
+                     self.encrypt_command, sent_counter, netcat_send_command]
+        elif self.source_is_dir and not self.is_decompress:
             source_parent_dir = os.path.normpath(os.path.join(self.source_path, '..'))
             source_basename = os.path.basename(os.path.normpath(self.source_path))
-            src_command = ['/bin/bash', '-c', r'"cd {} && {} {} {} {} {}"'
-                           .format(source_parent_dir, self.tar_command,
-                                   source_basename, self.compress_command, self.encrypt_command,
-                                   self.netcat_send_command(target_host))]
-
-            dst_command = ['/bin/bash', '-c', r'"cd {} && {} {} {} {}"'
-                           .format(target_path, self.netcat_listen_command, self.decrypt_command,
-                                   self.decompress_command, self.untar_command)]
+            if resume_point and 'list' in resume_point:
+                tar_command = self.sharder.tar_command(resume_point['list'])
+            else:
+                tar_command = '{} {}'.format(self.tar_command, source_basename)
+            parts = ['cd {} &&'.format(source_parent_dir), hash_start, tar_command,
+                     read_counter, hash_tee, self.compress_command, self.encrypt_command,
+                     sent_counter, netcat_send_command, hash_end]
+        elif resume_point and resume_point.get('offset'):
+            offset = resume_point['offset']
+            compress_command = ('| {}'.format(self.compressor.compress_command)
+                                if self.options['compress'] else '')
+            if self.is_plain_agent_copy and not read_counter and not sent_counter:
+                parts = [self.agent.send_command(target_host, port, self.source_path, offset)]
+            else:
+                parts = [read_range_command(self.source_path, offset,
+                                            self.original_size - offset),
+                         read_counter, compress_command, self.encrypt_command, sent_counter,
+                         netcat_send_command]
+        elif hash_start or read_counter:
+            # the file is read by cat, so the compressor (or cat) reads its output
+            parts = [hash_start, '/bin/cat', self.source_path, read_counter, hash_tee, '|',
+                     self.compress_command, self.encrypt_command, sent_counter,
+                     netcat_send_command, hash_end]
+        elif self.is_plain_agent_copy and not sent_counter:
+            # the agent sends the file straight from the page cache
+            parts = [self.agent.send_command(target_host, port, self.source_path)]
         else:
-            src_command = ['/bin/bash', '-c', r'"{} < {} {} {}"'
-                           .format(self.compress_command, self.source_path, self.encrypt_command,
-                                   self.netcat_send_command(target_host))]
+            parts = [self.compress_command, '<', self.source_path, self.encrypt_command,
+                     sent_counter, netcat_send_command]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
 
+    def receiver_command(self, target_path, port, relay_host=None, relay_port=None,
+                         resume_point=None):
+        """
+        Returns the command run on a target host to receive the source file or
+        dir on the given port and write it inside target_path. If relay_host
+        is given, the received stream is also forwarded to relay_host:relay_port.
+        Resumable copies of a file are written from the offset of
+        resume_point, recording their progress on a checkpoint.
+        """
+        netcat_listen_command = self.get_netcat_listen_command(port)
+        relay_command = self.relay_command(relay_host, relay_port)
+        hash_start, hash_tee, hash_end = self.inline_checksum_commands(port, 'dst')
+        written_counter = self.progress_command(port, 'written')
+        if self.is_xtrabackup:
+            parts = ['cd {} &&'.format(target_path), netcat_listen_command, relay_command,
+                     self.decrypt_command, self.decompress_command, written_counter,
+                     self.mbstream_command]
+        elif self.is_decompress or self.source_is_dir:
+            parts = ['cd {} &&'.format(target_path), hash_start, netcat_listen_command,
+                     relay_command, self.decrypt_command, self.decompress_command,
+                     written_counter, hash_tee, self.untar_command, hash_end]
+        else:
             final_file = os.path.join(os.path.normpath(target_path),
                                       os.path.basename(self.source_path))
-            dst_command = ['/bin/bash', '-c', r'"{} {} {} > {}"'
-                           .format(self.netcat_listen_command, self.decrypt_command,
-                                   self.decompress_command, final_file)]
+            if self.is_resumable:
+                writer_command = self.checkpoint.writer_command(
+                    final_file, Checkpoint.path(target_path, self.source_path),
+                    (resume_point or {}).get('offset', 0),
+                    Checkpoint.state(self.source_host, self.source_path, self.original_size))
+            else:
+                writer_command = '> {}'.format(final_file)
+            if (self.is_plain_agent_copy and not self.is_resumable and
+                    not any([hash_start, relay_command, written_counter])):
+                # the agent writes the file straight from the socket
+                parts = [self.agent.receive_command(port, final_file)]
+            else:
+                parts = [hash_start, netcat_listen_command, relay_command, self.decrypt_command,
+                         self.decompress_command, written_counter, hash_tee, writer_command,
+                         hash_end]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
+
+    def send(self, src_command, port, targets):
+        """
+        Runs the sender command on the source host and, while it runs,
+        reports the progress of the copy every progress_interval option seconds
+        and applies the changes of the bandwidth limit control file.
+
+        :param src_command: sender command, sending to port
+        :param port: port the sender sends to
+        :param targets: list of (target_host, target_port) tuples receiving the copy
+        :return: CommandReturn of the sender command
+        """
+        if not self.options['progress'] and self.options['bwlimit_file'] is None:
+            return self.run_command(self.source_host, src_command)
+        if self.options['progress']:
+            self.progress.start(port)
+        limit_version = self.bandwidth_limiter.version
+        job = self.remote_executor.start_job(self.source_host, src_command)
+        next_report = time.monotonic() + self.options['progress_interval']
+        while True:
+            result = self.remote_executor.monitor_job(self.source_host, job)
+            if result.returncode is not None:
+                return result
+            if self.options['progress'] and time.monotonic() >= next_report:
+                self.report_progress(port, targets)
+                next_report = time.monotonic() + self.options['progress_interval']
+            self.reload_bandwidth_limits()
+            if self.bandwidth_limiter.version != limit_version:
+                limit_version = self.bandwidth_limiter.version
+                self.adjust_bandwidth(targets[0][0], port)
+            time.sleep(self.job_check_interval)
+
+    def report_progress(self, port, targets, final=False):
+        """
+        Reports the progress of the copy sent to port. Failing to do it is
+        not an error of the transfer.
+        """
+        try:
+            self.progress.report(self.source_host, port, targets, self.original_size, final)
+        except Exception as e:
+            self.logger.warning('The progress of the transfer could not be read: {}'.format(e))
+
+    def end_progress(self, port, targets, successful):
+        """
+        Reports the final progress of a successful copy sent to port, and
+        removes its counters.
+        """
+        if not self.options['progress']:
+            return
+        if successful:
+            self.report_progress(port, targets, final=True)
+        else:
+            try:
+                self.progress.read_counters(self.source_host, port, targets, remove=True)
+            except Exception:
+                pass
+
+    def stream_sender_command(self, target_host, port, offset, length):
+        """
+        Returns the command run on the source host to send a byte range of the
+        source file to the given target host and port, with its own
+        compression and encryption.
+        """
+        compress_command = ('| {}'.format(self.compressor.compress_command)
+                            if self.options['compress'] else '')
+        # the total bandwidth limit of the copy is shared by its streams
+        limit_command = self.stream_limit_command(target_host, port)
+        if self.is_plain_agent_copy and not limit_command:
+            parts = [self.agent.send_command(target_host, port, self.source_path, offset, length)]
+        else:
+            parts = [read_range_command(self.source_path, offset, length), compress_command,
+                     self.encrypt_command, limit_command,
+                     self.netcat_send_command(target_host, port)]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
+
+    def stream_receiver_command(self, final_file, port, offset):
+        """
+        Returns the command run on a target host to receive a byte range of
+        the source file on the given port, and write it into final_file.
+        """
+        if self.is_plain_agent_copy:
+            parts = [self.agent.receive_command(port, final_file, offset)]
+        else:
+            parts = [self.get_netcat_listen_command(port), self.decrypt_command,
+                     self.decompress_command, write_range_command(final_file, offset)]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
+
+    def stream_limit_command(self, target_host, port):
+        """
+        Returns the pipeline fragment limiting the bandwidth of one of the
+        streams of a copy, which share the limit of the copy.
+        """
+        return self.bandwidth_limiter.limit_command(port, self.stream_rate(target_host))
+
+    def shard_sender_command(self, target_host, port, list_path):
+        """
+        Returns the command run on the source host to send the entries of a
+        shard, listed on list_path, to the given target host and port.
+        """
+        source_parent_dir = os.path.normpath(os.path.join(self.source_path, '..'))
+        parts = ['cd {} &&'.format(source_parent_dir), self.sharder.tar_command(list_path),
+                 self.compress_command, self.encrypt_command,
+                 self.stream_limit_command(target_host, port),
+                 self.netcat_send_command(target_host, port)]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
+
+    def shard_receiver_command(self, target_path, port):
+        """
+        Returns the command run on a target host to receive a shard on the
+        given port and extract it inside target_path.
+        """
+        parts = ['cd {} &&'.format(target_path), self.get_netcat_listen_command(port),
+                 self.decrypt_command, self.decompress_command, self.untar_command]
+        return ['/bin/bash', '-c', r'"{}"'.format(' '.join(part for part in parts if part))]
+
+    def run_streams(self, target_host, streams):
+        """
+        Runs the streams of a copy to target_host at the same time: all the
+        receivers are started, and once they are all listening, all the
+        senders. A failed stream stops the whole copy.
+
+        :param streams: list of (port, sender command, receiver command) tuples
+        :return: exit code, 0 if all the streams were copied
+        """
+        receivers = []
+        for port, _, dst_command in streams:
+            job = self.remote_executor.start_job(target_host, dst_command)
+            receivers.append(job)
+            if not self.wait_for_listener(target_host, port, job):
+                for started_job in receivers:
+                    self.remote_executor.kill_job(target_host, started_job)
+                return 1
+        senders = [self.remote_executor.start_job(self.source_host, src_command)
+                   for _, src_command, _ in streams]
+
+        # all senders are watched at once, so a failed stream stops the copy
+        # without waiting for the others to finish, and the changes of the
+        # bandwidth limit control file are applied to all of them
+        returncode = 0
+        running = list(senders)
+        limit_version = self.bandwidth_limiter.version
+        while running and returncode == 0:
+            time.sleep(self.job_check_interval)
+            for job in list(running):
+                result = self.remote_executor.monitor_job(self.source_host, job)
+                if result.returncode is not None:
+                    running.remove(job)
+                    returncode = returncode or result.returncode
+            if running and returncode == 0 and self.options['bwlimit_file'] is not None:
+                self.reload_bandwidth_limits()
+                if self.bandwidth_limiter.version != limit_version:
+                    limit_version = self.bandwidth_limiter.version
+                    self.adjust_streams_bandwidth(target_host, [port for port, _, _ in streams])
+        if returncode != 0:
+            for job in running:
+                self.remote_executor.kill_job(self.source_host, job)
+            for job in receivers:
+                self.remote_executor.kill_job(target_host, job)
+            return returncode
+        for job in receivers:
+            result = self.remote_executor.wait_job(target_host, job)
+            returncode = returncode or result.returncode
+        return returncode
+
+    def multistream_copy_to(self, target_host, target_path, ports):
+        """
+        Copies the source file to 'target_host', inside the 'target_path'
+        directory, splitting it in byte ranges sent at the same time, each
+        one on its own port of 'ports', and written at its offset of a file
+        preallocated with the size of the source.
+
+        :return: exit code, 0 if all the ranges were copied
+        """
+        ranges = split_ranges(self.original_size, len(ports))
+        if len(ranges) <= 1:
+            return self.copy_to(target_host, target_path, ports[0])
+        final_file = os.path.join(os.path.normpath(target_path),
+                                  os.path.basename(self.source_path))
+        result = self.run_command(target_host, preallocate_command(final_file,
+                                                                   self.original_size))
+        if result.returncode != 0:
+            self.logger.error('{} could not be created on {}'.format(final_file, target_host))
+            return result.returncode
+        self.logger.info('Sending {} to {} in {} streams'.format(self.source_path, target_host,
+                                                                 len(ranges)))
+        return self.run_streams(target_host,
+                                [(port, self.stream_sender_command(target_host, port, offset,
+                                                                   length),
+                                  self.stream_receiver_command(final_file, port, offset))
+                                 for (offset, length), port in zip(ranges, ports)])
+
+    def sharded_copy_to(self, target_host, target_path, ports):
+        """
+        Copies the source directory to 'target_host', inside the 'target_path'
+        directory, sending each of its shards at the same time, by its own
+        tar stream on its own port of 'ports'.
+
+        :return: exit code, 0 if all the shards were copied
+        """
+        self.logger.info('Sending {} to {} in {} shards'.format(self.source_path, target_host,
+                                                                len(self.shards)))
+        return self.run_streams(target_host,
+                                [(port, self.shard_sender_command(target_host, port,
+                                                                  shard['list']),
+                                  self.shard_receiver_command(target_path, port))
+                                 for shard, port in zip(self.shards, ports)])
+
+    def split_in_shards(self):
+        """
+        Splits the source directory in up to streams option shards, for a
+        sharded copy. If it cannot be split, it is sent as a single stream.
+        """
+        self.shards = self.sharder.run(self.source_host, self.source_path,
+                                       self.options['streams'])
+        if self.shards is None:
+            self.logger.warning('{} could not be split in shards, sending it as a single stream'
+                                .format(self.source_path))
+        if not self.shards or len(self.shards) == 1:
+            self.remove_shards()
+            self.options['streams'] = 1
+            return
+        for i, shard in enumerate(self.shards):
+            self.logger.debug('Shard {}: {} files, {} bytes'
+                              .format(i, shard['files'], shard['size']))
+
+    def remove_shards(self):
+        """
+        Removes the list files of the shards from the source host.
+        """
+        if self.shards:
+            self.run_command(self.source_host, self.sharder.cleanup_command(self.shards))
+        self.shards = None
+
+    def copy_to(self, target_host, target_path, port=None):
+        """
+        Copies the source file or dir on the source host to 'target_host'.
+        'target_path' is assumed to be a *directory* and the source file or
+        directory will be copied inside. 'port' is the port nc will listen on
+        the target host, by default the one given on the options.
+        """
+        if port is None:
+            port = self.options['port']
+        resume_point = self.resume_points.get((target_host, target_path))
+        src_command = self.sender_command(target_host, port, resume_point)
+        dst_command = self.receiver_command(target_path, port, resume_point=resume_point)
 
         job = self.remote_executor.start_job(target_host, dst_command)
-        time.sleep(3)  # FIXME: Work on a better way to wait for nc to be listening
-        result = self.run_command(self.source_host, src_command)
+        if not self.wait_for_listener(target_host, port, job):
+            self.remote_executor.kill_job(target_host, job)
+            self.end_progress(port, [(target_host, port)], False)
+            return 1
+        result = self.send(src_command, port, [(target_host, port)])
         if result.returncode != 0:
             self.remote_executor.kill_job(target_host, job)
         else:
             self.remote_executor.wait_job(target_host, job)
+        self.end_progress(port, [(target_host, port)], result.returncode == 0)
         return result.returncode
 
+    def chain_copy_to(self, targets):
+        """
+        Copies the source to all the given targets reading it only once: the
+        source sends it to the first target, which writes it and forwards the
+        still compressed and encrypted stream to the second one, and so on.
+
+        :param targets: list of (target_host, target_path, port, relay_port)
+                        tuples, in chain order. relay_port is the port of the
+                        next target of the chain, None for the last one
+        :return: list of exit codes, one per target
+        """
+        jobs = []
+        # receivers are started from the end of the chain, so each one is
+        # already listening when its predecessor connects to forward the stream
+        for i in reversed(range(len(targets))):
+            target_host, target_path, port, relay_port = targets[i]
+            relay_host = targets[i + 1][0] if i + 1 < len(targets) else None
+            dst_command = self.receiver_command(target_path, port, relay_host, relay_port)
+            job = self.remote_executor.start_job(target_host, dst_command)
+            jobs.insert(0, job)
+            if not self.wait_for_listener(target_host, port, job):
+                for (started_host, _, _, _), started_job in zip(targets[i:], jobs):
+                    self.remote_executor.kill_job(started_host, started_job)
+                self.end_progress(targets[0][2], [(target_host, port)
+                                                  for target_host, _, port, _ in targets], False)
+                return [1] * len(targets)
+
+        first_host, _, first_port, _ = targets[0]
+        progress_targets = [(target_host, port) for target_host, _, port, _ in targets]
+        result = self.send(self.sender_command(first_host, first_port), first_port,
+                           progress_targets)
+        if result.returncode != 0:
+            for (target_host, _, _, _), job in zip(targets, jobs):
+                self.remote_executor.kill_job(target_host, job)
+            self.end_progress(first_port, progress_targets, False)
+            return [result.returncode] * len(targets)
+
+        returncodes = []
+        for (target_host, _, _, _), job in zip(targets, jobs):
+            job_result = self.remote_executor.wait_job(target_host, job)
+            returncodes.append(job_result.returncode)
+        self.end_progress(first_port, progress_targets, True)
+        return returncodes
+
+    @property
+    def source_binaries(self):
+        """
+        Executables the transfer needs on the source host.
+        """
+        binaries = [] if self.options['agent'] else ['/bin/nc']
+        if self.is_xtrabackup:
+            binaries.append('xtrabackup')
+        elif not self.is_decompress:
+            binaries.append('/bin/tar')
+        if self.options['compress'] and not self.is_decompress and not self.is_auto_compression:
+            binaries.append(self.compressor.executable)
+        if self.options['encrypt']:
+            binaries.append('/usr/bin/openssl')
+        if self.options['checksum'] and self.options['checksum_algorithm'] != 'auto':
+            binaries.append(CHECKSUM_ALGORITHMS[self.options['checksum_algorithm']])
+        if self.is_inline_checksum:
+            binaries.extend(['/usr/bin/mkfifo', '/usr/bin/tee'])
+        if self.bandwidth_limiter.enabled:
+            binaries.append('/usr/bin/pv')
+        if (self.options['streams'] > 1 and self.options['type'] == 'file') or self.is_resumable:
+            binaries.append('/bin/dd')
+        return binaries
+
+    @property
+    def target_binaries(self):
+        """
+        Executables the transfer needs on the target hosts.
+        """
+        binaries = ['/bin/ss'] if self.options['agent'] else ['/bin/nc', '/bin/ss']
+        if self.is_xtrabackup:
+            binaries.append('mbstream')
+        else:
+            binaries.append('/bin/tar')
+        if self.options['compress'] and not self.is_auto_compression:
+            binaries.append(self.compressor.executable)
+        if self.options['encrypt']:
+            binaries.append('/usr/bin/openssl')
+        if self.options['checksum'] and self.options['checksum_algorithm'] != 'auto':
+            binaries.append(CHECKSUM_ALGORITHMS[self.options['checksum_algorithm']])
+        if self.is_inline_checksum:
+            binaries.append('/usr/bin/mkfifo')
+        if self.options['chain'] or self.is_inline_checksum:
+            binaries.append('/usr/bin/tee')
+        if self.options['streams'] > 1 and self.options['type'] == 'file':
+            binaries.extend(['/bin/dd', '/usr/bin/truncate'])
+        if self.options['firewall'] == 'ipset':
+            binaries.append('/sbin/ipset')
+        return binaries
+
+    @property
+    def optional_binaries(self):
+        """
+        Executables looked for on all hosts that the transfer can do without.
+        """
+        binaries = []
+        if self.options['checksum'] and self.options['checksum_algorithm'] == 'auto':
+            binaries.extend(CHECKSUM_ALGORITHMS.values())
+        if self.is_auto_compression:
+            binaries.extend(compressor.executable for compressor in COMPRESSORS.values())
+        if self.options['progress']:
+            binaries.append('/usr/bin/pv')
+        if self.options['firewall'] == 'auto':
+            binaries.append('/sbin/ipset')
+        return binaries
+
+    def check_binaries(self, host, facts, binaries):
+        """
+        Raises ValueError if a probe of the given host found some of the
+        given binaries missing.
+        """
+        missing = [binary for binary in binaries if not facts['binaries'][binary]]
+        if missing:
+            raise ValueError("The following required executables are missing on {}: {}"
+                             .format(host, ', '.join(missing)))
+
     def sanity_checks(self):
         """
         Set of preflight checks for the transfer- raise an exception if
-        they are not met.
+        they are not met. Every host is probed with a single remote execution.
         """
+        self.source_path = os.path.normpath(self.source_path)
+        # invalid bandwidth limit files raise ValueError here
+        self.bandwidth_limiter.reload()
+        # Resumed and synced copies are tracked per target, and the resumed
+        # file ones written in order
+        if self.options['resume'] and self.options['sync']:
+            raise ValueError('Transfers cannot be resumed and synced at the same time')
+        if self.options['resume'] or self.options['sync']:
+            mode = 'resume' if self.options['resume'] else 'sync'
+            if not (self.is_resumable or self.is_sync):
+                raise ValueError('Only file transfers can be {}'
+                                 .format('resumed' if self.options['resume'] else 'synced'))
+            disabled_options = [('chain', False), ('streams', 1)]
+            if self.options['resume']:
+                disabled_options.append(('inline_checksum', False))
+            for option, disabled in disabled_options:
+                if self.options[option] != disabled:
+                    self.logger.warning('--{} cannot be used to {} transfers, ignoring it'
+                                        .format(option.replace('_', '-'), mode))
+                    self.options[option] = disabled
+                    if option == 'inline_checksum':
+                        self.options['checksum'] = True
+        # invalid compressor options raise ValueError here
+        if self.options['compress'] and not self.is_decompress and not self.is_auto_compression:
+            self.logger.info('Compressing with {}'.format(self.compressor.compress_command))
+        if self.is_xtrabackup:
+            size_path = self.get_datadir_from_socket(self.source_path)
+        else:
+            size_path = self.source_path
+        source_facts = self.probe.run(self.source_host, [self.source_path, size_path],
+                                      sizes=[size_path],
+                                      binaries=self.source_binaries + self.optional_binaries,
+                                      headers=[self.source_path] if self.is_decompress else [])
         # Does source host exist?
-        result = self.host_exists(self.source_host)
-        if result.returncode != 0:
+        if source_facts is None:
             raise ValueError("The specified source host {} does not exist or is unavailable."
                              .format(self.source_host))
         # Does the source path (file or dir) exist?
-        self.source_path = os.path.normpath(self.source_path)
-        if not self.file_exists(self.source_host, self.source_path):
+        source_path_facts = source_facts['paths'][self.source_path]
+        if not source_path_facts['exists']:
             raise ValueError("The specified source path {} doesn't exist on {}"
                              .format(self.source_path, self.source_host))
-        self.original_size = self.disk_usage(self.source_host, self.source_path,
-                                             self.is_xtrabackup)
+        if source_facts['paths'][size_path]['size'] is None:
+            raise Exception('du execution failed')
+        self.original_size = source_facts['paths'][size_path]['size']
+        self.check_binaries(self.source_host, source_facts, self.source_binaries)
+        # On decompress mode, the archive is decompressed with the codec that wrote it
+        if self.is_decompress:
+            compressor = detect_compressor(source_path_facts['header'])
+            if compressor is None:
+                raise ValueError("The compression format of {} on {} is not known"
+                                 .format(self.source_path, self.source_host))
+            self.logger.info('Decompressing {} archive'.format(compressor))
+            self._compressor = get_compressor(compressor)
+        available_binaries = [binary for binary in self.optional_binaries
+                              if source_facts['binaries'][binary]]
 
+        # all targets are probed at once
+        probe_commands = []
         for target_host, target_path in zip(self.target_hosts, self.target_paths):
+            target_final_path = os.path.join(os.path.normpath(target_path),
+                                             os.path.basename(self.source_path))
+            paths = [target_path, target_final_path]
+            if self.is_resumable:
+                paths.append(Checkpoint.path(target_path, self.source_path))
+            existing_copies = self.is_resumable or self.is_sync
+            probe_commands.append((target_host,
+                                   self.probe.command(paths, space=[target_path],
+                                                      sizes=paths[1:2] if existing_copies else [],
+                                                      binaries=(self.target_binaries +
+                                                                self.optional_binaries))))
+        probe_results = self.remote_executor.run_each(probe_commands)
+
+        for target_host, target_path, probe_result in zip(self.target_hosts, self.target_paths,
+                                                          probe_results):
+            target_final_path = os.path.join(os.path.normpath(target_path),
+                                             os.path.basename(self.source_path))
+            target_facts = self.probe.parse(probe_result)
             # Does the target host exist?
-            result = self.host_exists(target_host)
-            if result.returncode != 0:
+            if target_facts is None:
                 raise ValueError("The specified target host {} does not exist or is unavailable."
                                  .format(target_host))
             # Does the target dir exist?
-            if not self.file_exists(target_host, target_path):
+            target_path_facts = target_facts['paths'][target_path]
+            if not target_path_facts['exists']:
                 raise ValueError("The specified target path {} doesn't exist on {}"
                                  .format(target_path, target_host))
             # If it is a backup, is the target path emtpy
             if self.is_xtrabackup or self.is_decompress:
-                if not self.dir_is_empty(target_path, target_host):
+                if not target_path_facts['is_empty']:
                     raise ValueError("The final target path {} is not empty on {}."
                                      .format(target_path, target_host))
             else:
                 # Will the final path (target path + final dir or file) overwrite
-                # an existing file or dir?
-                target_final_path = os.path.join(os.path.normpath(target_path),
-                                                 os.path.basename(self.source_path))
-                if self.file_exists(target_host, target_final_path):
-                    raise ValueError("The final target path {} already exists on {}."
-                                     .format(target_final_path, target_host))
+                # an existing file or dir? It can only be a partial copy to resume,
+                # or a copy to sync of the same kind as the source
+                final_path_facts = target_facts['paths'][target_final_path]
+                if final_path_facts['exists'] and self.is_sync:
+                    if final_path_facts['is_dir'] != source_path_facts['is_dir']:
+                        raise ValueError("The final target path {} on {} cannot be synced, it is "
+                                         "not a {} like the source."
+                                         .format(target_final_path, target_host,
+                                                 'directory' if source_path_facts['is_dir']
+                                                 else 'file'))
+                    self.synced_targets.add((target_host, target_path))
+                elif final_path_facts['exists']:
+                    checkpoint_path = Checkpoint.path(target_path, self.source_path)
+                    if not (self.is_resumable and target_facts['paths'][checkpoint_path]['exists']):
+                        raise ValueError("The final target path {} already exists on {}."
+                                         .format(target_final_path, target_host))
+                    self.resumable_targets.add((target_host, target_path))
             # To the best of our knowledge, is there enough free space on target?
-            if not self.has_available_disk_space(target_host, target_path,
-                                                 self.original_size):
+            if target_path_facts['available'] is None:
+                raise Exception('df execution failed')
+            needed_space = self.original_size
+            if (target_host, target_path) in self.resumable_targets | self.synced_targets:
+                needed_space -= final_path_facts['size'] or 0
+            if not target_path_facts['available'] > needed_space:
                 raise ValueError("{} doesn't have enough space on {}"
                                  .format(target_host, target_path))
+            self.check_binaries(target_host, target_facts, self.target_binaries)
+            available_binaries = [binary for binary in available_binaries
+                                  if target_facts['binaries'][binary]]
+            if self.options['firewall'] == 'auto':
+                has_ipset = target_facts['binaries']['/sbin/ipset']
+                self.firewall_backends[target_host] = 'ipset' if has_ipset else 'iptables'
+            else:
+                self.firewall_backends[target_host] = self.options['firewall']
+
+        # Progress is reported only if all hosts have pv
+        if self.options['progress'] and '/usr/bin/pv' not in available_binaries:
+            self.logger.warning('pv is not available on all hosts, progress will not be reported')
+            self.options['progress'] = False
+
+        # Choose the compression from a sample of the source, among the
+        # compressors available on all hosts
+        if self.is_auto_compression:
+            self.choose_compressor(size_path, [name for name, compressor in COMPRESSORS.items()
+                                               if compressor.executable in available_binaries])
 
         # For xtrabackup, is the source patch a socket?
         if self.is_xtrabackup:
-            self.source_is_socket = self.is_socket(self.source_host, self.source_path)
+            self.source_is_socket = source_path_facts['is_socket']
             if not self.source_is_socket:
                 raise ValueError("The specified source path {} is not a valid socket"
                                  .format(self.source_path))
         else:
             # If not xtrabackup, is the source a directory or a file?
-            self.source_is_dir = self.is_dir(self.source_host, self.source_path)
+            self.source_is_dir = source_path_facts['is_dir']
+
+        # Byte ranges and shards are sent in parallel, so they cannot be hashed
+        # in order while they are sent, nor counted as a single copy
+        if self.is_multistream or self.is_sharded:
+            if self.options['streams'] > MAX_PORTS_PER_RULE:
+                raise ValueError('At most {} streams can be used'.format(MAX_PORTS_PER_RULE))
+            if self.is_inline_checksum:
+                self.logger.warning('Inline checksums cannot be used with several streams, '
+                                    'the copies will be checksummed after the transfer')
+                self.options['inline_checksum'] = False
+                self.options['checksum'] = True
+            if self.options['progress']:
+                self.logger.info('Progress is not reported for copies sent in several streams')
+                self.options['progress'] = False
 
-        # Calculate the checksum
+        # Calculate the checksum, with the preferred algorithm available on all hosts
         if self.options['checksum']:
+            if self.options['checksum_algorithm'] == 'auto':
+                self.checksum_algorithm = Checksum.choose(
+                    [algorithm for algorithm, executable in CHECKSUM_ALGORITHMS.items()
+                     if executable in available_binaries])
+                if self.checksum_algorithm is None:
+                    raise ValueError("No checksum executable is available on all hosts")
+            else:
+                self.checksum_algorithm = self.options['checksum_algorithm']
+            self.logger.info('Using {} checksums'.format(self.checksum_algorithm))
             self.checksum = self.calculate_checksum(self.source_host, self.source_path)
 
-    def after_transfer_checks(self, result, target_host, target_path):
+        if self.is_resumable:
+            self.prepare_resume()
+        if self.is_sync:
+            self.prepare_sync()
+
+    def prepare_resume(self):
         """
-        Post-transfer checks: Was the transfer really successful. Yes- return 0; No-
-        return 1 or more.
+        Finds where the copy to every partial target resumes from, checking
+        cheaply that what is already there is a copy of the source, and
+        writes the checkpoints of the directory copies.
         """
-        # Return code was not 0?
-        if result != 0:
-            self.logger.error('Copy from {}:{} to {}:{} failed'
-                              .format(self.source_host, self.source_path, target_host, target_path))
-            return 1
+        targets = list(zip(self.target_hosts, self.target_paths))
+        resumed = [target for target in targets if target in self.resumable_targets]
+        state = Checkpoint.state(self.source_host, self.source_path, self.original_size)
+        checkpoints = self.remote_executor.run_each(
+            [(target_host, Checkpoint.read_command(Checkpoint.path(target_path, self.source_path)))
+             for target_host, target_path in resumed])
+        for (target_host, target_path), result in zip(resumed, checkpoints):
+            checkpoint = Checkpoint.parse(result)
+            if checkpoint is None or any(checkpoint.get(key) != state[key]
+                                         for key in ['source_host', 'source_path']):
+                raise ValueError("The final target path on {} is not a partial copy of {}:{}"
+                                 .format(target_host, self.source_host, self.source_path))
+            if self.source_is_dir:
+                continue
+            offset = checkpoint['written'] if checkpoint.get('size') == self.original_size else 0
+            self.resume_points[(target_host, target_path)] = {'offset': offset}
+
+        if self.source_is_dir:
+            self.prepare_directory_sync(resumed)
+            # the checkpoint is written before the copy starts
+            results = self.remote_executor.run_each(
+                [(target_host, Checkpoint.write_command(
+                    Checkpoint.path(target_path, self.source_path), state))
+                 for target_host, target_path in targets])
+            if any(result.returncode != 0 for result in results):
+                raise Exception('The checkpoints of the copies could not be written')
+        else:
+            self.verify_resumed_files(resumed)
+
+    def verify_resumed_files(self, resumed):
+        """
+        Compares a sample of the part of the file already copied to every
+        resumed target with the source, so the copy restarts from the
+        beginning if they differ.
+        """
+        compared = [target for target in resumed if self.resume_points[target]['offset'] > 0]
+        commands = []
+        for target_host, target_path in compared:
+            final_file = self.target_final_paths(target_path)[0]
+            ranges = self.checkpoint.sample_ranges(self.resume_points[(target_host,
+                                                                       target_path)]['offset'])
+            commands.append((self.source_host,
+                             self.checkpoint.ranges_hash_command(self.source_path, ranges)))
+            commands.append((target_host, self.checkpoint.ranges_hash_command(final_file, ranges)))
+        results = self.remote_executor.run_each(commands)
+        for i, (target_host, target_path) in enumerate(compared):
+            source_hash = self.checkpoint.parse_ranges_hash(results[2 * i])
+            target_hash = self.checkpoint.parse_ranges_hash(results[2 * i + 1])
+            resume_point = self.resume_points[(target_host, target_path)]
+            if source_hash is None or source_hash != target_hash:
+                self.logger.warning('The partial copy on {} does not match the source, '
+                                    'copying it again from the beginning'.format(target_host))
+                resume_point['offset'] = 0
+            else:
+                self.logger.info('Resuming the copy to {}: {} of {} bytes already copied'
+                                 .format(target_host, resume_point['offset'], self.original_size))
 
+    def prepare_sync(self):
+        """
+        Finds what changed on the source since it was copied to every target
+        that already has a copy, removing from them what is not on the source
+        if requested. Files are always sent whole.
+        """
+        targets = list(zip(self.target_hosts, self.target_paths))
+        synced = [target for target in targets if target in self.synced_targets]
+        if not self.source_is_dir:
+            for target_host, _ in synced:
+                self.logger.info('Sending the whole file again to {}'.format(target_host))
+            return
+        self.prepare_directory_sync(synced, self.options['sync_checksum'],
+                                    self.options['sync_delete'])
+
+    def prepare_directory_sync(self, targets, checksum=False, delete=False):
+        """
+        Lists the source directory and its existing copies, and writes on the
+        source the list of what has to be sent to every given target.
+        Entries of a copy that have a different kind on the source are
+        removed from it, so they can be replaced.
+
+        :param targets: list of (target_host, target_path) tuples with a copy
+        :param checksum: whether files are compared by their md5 instead of
+                         their modification time
+        :param delete: whether the entries not on the source are removed from the copies
+        """
+        if not targets:
+            return
+        results = self.remote_executor.run_each(
+            [(self.source_host, self.syncer.list_command(self.source_path, checksum))] +
+            [(target_host, self.syncer.list_command(self.target_final_paths(target_path)[0],
+                                                    checksum))
+             for target_host, target_path in targets])
+        source_list = self.syncer.parse_list(results[0])
+        if source_list is None:
+            raise Exception('The source directory could not be listed')
+        source_kinds = Syncer.kinds(source_list)
+        for i, ((target_host, target_path), result) in enumerate(zip(targets, results[1:])):
+            target_list = self.syncer.parse_list(result)
+            if target_list is None:
+                raise Exception('The copy on {} could not be listed'.format(target_host))
+            extra = Syncer.extra_entries(source_list, target_list)
+            removed = [path for path in extra if delete or path in source_kinds]
+            for command in self.syncer.remove_commands(target_path, removed):
+                if self.run_command(target_host, command).returncode != 0:
+                    raise Exception('The extra files of the copy on {} could not be removed'
+                                    .format(target_host))
+            entries = Syncer.changed_entries(source_list, target_list, checksum)
+            list_path = self.sharder.list_path('sync.{}'.format(i))
+            for command in self.syncer.write_list_commands(list_path, entries):
+                if self.run_command(self.source_host, command).returncode != 0:
+                    raise Exception('The list of files to send could not be written')
+            self.resume_points[(target_host, target_path)] = {'list': list_path}
+            sent = len(entries) - len(source_list['dirs']) - len(source_list['others'])
+            self.logger.info('Sending to {} {} of {} files, the rest are already copied'
+                             .format(target_host, sent, len(source_list['files'])))
+            kept = len(extra) - len(removed)
+            if removed or kept:
+                self.logger.info('{} entries not on the source were removed from {}, {} were kept'
+                                 .format(len(removed), target_host, kept))
+
+    def remove_sync_lists(self):
+        """
+        Removes from the source host the lists of what was sent to the
+        resumed and synced targets.
+        """
+        lists = [resume_point['list'] for resume_point in self.resume_points.values()
+                 if 'list' in resume_point]
+        if lists:
+            self.run_command(self.source_host, ['/bin/rm', '-f'] + lists)
+
+    def finish_resume(self, targets, results):
+        """
+        Removes the checkpoints of the successful copies.
+
+        :param targets: list of (target_host, target_path) tuples
+        :param results: verify_targets results, one per target
+        """
+        completed = [target for target, result in zip(targets, results) if result == 0]
+        commands = [(target_host, Checkpoint.remove_command(
+                        Checkpoint.path(target_path, self.source_path)))
+                    for target_host, target_path in completed]
+        self.remote_executor.run_each(commands)
+        if len(completed) < len(targets):
+            self.logger.info('Run the transfer again with --resume to continue the failed copies')
+
+    def target_final_paths(self, target_path):
+        """
+        Returns the path of the copy of the source inside target_path, and the
+        path whose existence proves the copy was written.
+        """
         # if creating or restoring a backup, does it include an xtrabackup_info file,
         # otherwise, does the copied file or dir exists?
         if self.is_xtrabackup or self.is_decompress:
@@ -370,25 +1417,89 @@ class Transferer(object):
             target_final_path = os.path.join(os.path.normpath(target_path),
                                              os.path.basename(self.source_path))
             check_path = target_final_path
+        return target_final_path, check_path
+
+    def compare_checksums(self, source_checksum, target_checksum, target_host):
+        """
+        Compares the checksum manifests of the source and of its copy on
+        target_host, logging which files are different, missing or extra on
+        the copy. Extra files are expected on copies synced without deleting.
 
-        if not self.file_exists(target_host, check_path):
+        :return: true if the manifests match
+        """
+        counts = {'changed': 0, 'missing': 0, 'extra': 0}
+        try:
+            for status, path in source_checksum.compare(target_checksum):
+                if status == 'extra' and self.is_sync and not self.options['sync_delete']:
+                    continue
+                counts[status] += 1
+                if counts[status] <= self.max_reported_differences:
+                    self.logger.error('{} file on the copy to {}: {}'
+                                      .format(status.capitalize(), target_host, path))
+        except ValueError as e:
+            self.logger.error('Checksums of the copy on {} could not be compared: {}'
+                              .format(target_host, e))
+            return False
+        if any(counts.values()):
+            self.logger.error('Checksum of the copy on {} does not match the original on {}: '
+                              '{changed} changed, {missing} missing and {extra} extra files'
+                              .format(target_host, self.source_host, **counts))
+            return False
+        return True
+
+    def after_transfer_checks(self, result, target_host, target_path,
+                              target_facts=None, target_checksum=None, source_checksum=None):
+        """
+        Post-transfer checks: Was the transfer really successful. Yes- return 0; No-
+        return 1 or more.
+        target_facts (the probe of the target final and check paths) and
+        target_checksum can be given if they were already gathered, otherwise
+        they are obtained from the target host.
+        With inline checksums, both the source_checksum and the target_checksum
+        of the copy must be given, as read by read_inline_checksums.
+        """
+        # Return code was not 0?
+        if result != 0:
+            self.logger.error('Copy from {}:{} to {}:{} failed'
+                              .format(self.source_host, self.source_path, target_host, target_path))
+            return 1
+
+        target_final_path, check_path = self.target_final_paths(target_path)
+        if target_facts is None:
+            target_facts = self.probe.run(target_host, [check_path, target_final_path],
+                                          sizes=[target_final_path])
+        if target_facts is None or not target_facts['paths'][check_path]['exists']:
             self.logger.error(('file was not found on the target path {} after transfer'
                                ' to {}').format(check_path, target_host))
             return 2
 
         # Is original and final size the same? Otherwise throw a warning
-        final_size = self.disk_usage(target_host, target_final_path)
+        final_size = target_facts['paths'][target_final_path]['size']
+        if final_size is None:
+            raise Exception('du execution failed')
         if self.original_size != final_size:
             self.logger.warning('Original size is {} but transferred size is {} '
                                 'for copy to {}'.format(self.original_size, final_size, target_host))
 
         # Was checksum requested, and does it match the original?
-        if self.options['checksum']:
-            target_checksum = self.calculate_checksum(target_host, target_final_path)
-            if self.checksum != target_checksum:
-                self.logger.error('Original checksum {} on {} is different than checksum '
-                                  '{} on {}'.format(self.checksum, self.source_host,
-                                                    target_checksum, target_host))
+        if self.is_inline_checksum:
+            if source_checksum is None or target_checksum is None:
+                self.logger.error('Inline checksums of the copy to {} could not be read'
+                                  .format(target_host))
+                return 3
+            if not self.compare_checksums(source_checksum, target_checksum, target_host):
+                return 3
+            else:
+                self.logger.info(('Checksum of the stream sent by {} and the one received'
+                                  ' by {} match.').format(self.source_host, target_host))
+        elif self.options['checksum']:
+            if target_checksum is None:
+                try:
+                    target_checksum = self.calculate_checksum(target_host, target_final_path)
+                except ValueError as e:
+                    self.logger.error('Checksum of the copy on {} failed: {}'.format(target_host, e))
+                    return 3
+            if not self.compare_checksums(self.checksum, target_checksum, target_host):
                 return 3
             else:
                 self.logger.info(('Checksum of all original files on {} and the transmitted ones'
@@ -399,52 +1510,312 @@ class Transferer(object):
                          .format(final_size, self.source_host, target_host))
         return 0
 
+    def firewall_rules(self, chain=False):
+        """
+        Returns the firewall rules of the copies: the source is allowed to
+        connect to every target or, on a chain, every target to the next one.
+
+        :return: list of (target_host, allowed_host) tuples, one per target
+        """
+        if chain:
+            # each target only accepts connections from its predecessor on the chain
+            allowed_hosts = [self.source_host] + self.target_hosts[:-1]
+        else:
+            allowed_hosts = [self.source_host] * len(self.target_hosts)
+        return list(zip(self.target_hosts, allowed_hosts))
+
+    def firewall(self, target_host):
+        """
+        Returns the Firewall handler of target_host, with its backend.
+        """
+        return Firewall(target_host, self.remote_executor,
+                        self.firewall_backends.get(target_host, 'iptables'),
+                        self.options['firewall_timeout'], self.options['port_range'],
+                        self.session)
+
+    def firewall_commands(self, rules, ports, action):
+        """
+        Returns the commands opening or closing the given rules, grouped by
+        target host, so ipset hosts get all their entries in one call.
+
+        :param rules: list of (target_host, allowed_host) tuples
+        :param ports: list of ports, or lists of ports, one per rule
+        :param action: 'open' or 'close'
+        :return: list of (target_host, command) tuples
+        """
+        host_rules = {}
+        for (target_host, allowed_host), port in zip(rules, ports):
+            host_rules.setdefault(target_host, []).append((allowed_host, port))
+        commands = []
+        for target_host, target_rules in host_rules.items():
+            handler = self.firewall(target_host)
+            if action == 'open':
+                host_commands = handler.open_commands(target_rules)
+            else:
+                host_commands = handler.close_commands(target_rules)
+            commands.extend((target_host, command) for command in host_commands)
+        return commands
+
+    def open_firewalls(self, rules, ports_per_rule=1):
+        """
+        Opens ports on the firewall of several target hosts at once. When no
+        port was given on the options, free ones are leased on each host with
+        a single call, so neither this transfer nor a concurrent one gets the
+        same port twice; otherwise the given port and the following ones are
+        used, each rule of a host getting the next ones after the previous
+        rule of that host, so no two copies to a host listen on the same port.
+
+        :param rules: list of (target_host, allowed_host) tuples
+        :param ports_per_rule: ports opened by each rule, with a single iptables rule
+        :return: list of opened ports, one per rule, or list of lists of
+                 ports if ports_per_rule is greater than 1
+        """
+        # ports leased so far, by host, released if the rules cannot be added
+        leased = {}
+        try:
+            if self.options['port'] == 0:
+                counts = {}
+                for target_host, _ in rules:
+                    counts[target_host] = counts.get(target_host, 0) + ports_per_rule
+                handlers = {target_host: self.firewall(target_host) for target_host in counts}
+                lease_results = self.remote_executor.run_each(
+                    [(target_host, handlers[target_host].lease_command(count))
+                     for target_host, count in counts.items()])
+                failed_hosts = []
+                for target_host, result in zip(counts, lease_results):
+                    try:
+                        leased[target_host] = handlers[target_host].parse_lease(result)
+                    except ValueError:
+                        failed_hosts.append(target_host)
+                if failed_hosts:
+                    raise ValueError('failed to find an available port on {}'
+                                     .format(', '.join(failed_hosts)))
+                available = {target_host: iter(port_list)
+                             for target_host, port_list in leased.items()}
+                ports = [[next(available[target_host]) for _ in range(ports_per_rule)]
+                         for target_host, _ in rules]
+            else:
+                next_ports = {}
+                ports = []
+                for target_host, _ in rules:
+                    first_port = next_ports.get(target_host, self.options['port'])
+                    ports.append(list(range(first_port, first_port + ports_per_rule)))
+                    next_ports[target_host] = first_port + ports_per_rule
+
+            results = self.remote_executor.run_each(self.firewall_commands(rules, ports, 'open'))
+            if any(result.returncode != 0 for result in results):
+                raise Exception('Firewall rules could not be added')
+        except Exception:
+            if leased:
+                self.release_ports([(target_host, None) for target_host in leased],
+                                   list(leased.values()))
+            raise
+        if ports_per_rule == 1:
+            return [port_set[0] for port_set in ports]
+        return ports
+
+    def close_firewalls(self, rules, ports):
+        """
+        Closes the given ports, opened with open_firewalls, on the firewall of
+        their target hosts at once.
+
+        :param rules: list of (target_host, allowed_host) tuples
+        :param ports: list of ports, or lists of ports, one per rule
+        """
+        commands = self.firewall_commands(rules, ports, 'close')
+        results = self.remote_executor.run_each(commands)
+        for (target_host, _), result in zip(commands, results):
+            if result.returncode != 0:
+                self.logger.warning('Firewall\'s temporary rule could not be deleted on {}'
+                                    .format(target_host))
+        self.release_ports(rules, ports)
+
+    def release_ports(self, rules, ports):
+        """
+        Releases the leases of the given ports, if they were leased by
+        open_firewalls, with a single call per target host. Leases that
+        cannot be released expire on their own.
+
+        :param rules: list of (target_host, allowed_host) tuples
+        :param ports: list of ports, or lists of ports, one per rule
+        """
+        if self.options['port'] != 0:
+            return
+        host_ports = {}
+        for (target_host, _), port_set in zip(rules, ports):
+            if not isinstance(port_set, (list, tuple)):
+                port_set = [port_set]
+            host_ports.setdefault(target_host, []).extend(port_set)
+        self.remote_executor.run_each(
+            [(target_host, self.firewall(target_host).release_command(port_list))
+             for target_host, port_list in host_ports.items()])
+
+    def read_inline_checksums(self, copies):
+        """
+        Reads the manifests left by the inline checksum hashers, and removes
+        their temporary files, with one remote execution call for all of them.
+
+        :param copies: list of (host, port, side) tuples, side being 'src' or 'dst'
+        :return: list of Manifests (None if they could not be read), one per copy
+        """
+        results = self.remote_executor.run_each(
+            [(host, self.inline_hasher.read_command(port, side)) for host, port, side in copies])
+        return [self.inline_hasher.parse(result) for result in results]
+
+    def verify_targets(self, results, targets, ports=None, source_ports=None):
+        """
+        Runs the post-transfer checks of all targets, gathering their facts
+        and checksums with one remote execution call for all of them.
+
+        :param results: copy exit codes, one per target
+        :param targets: list of (target_host, target_path) tuples
+        :param ports: ports the targets received on, needed for inline checksums
+        :param source_ports: ports the source sent to for each target, if
+                             different from ports (e.g. on a chain)
+        :return: list of after_transfer_checks results, one per target
+        """
+        copied = [i for i, result in enumerate(results) if result == 0]
+        final_paths = {i: self.target_final_paths(targets[i][1]) for i in copied}
+        probe_commands = [(targets[i][0], self.probe.command(final_paths[i][::-1],
+                                                             sizes=[final_paths[i][0]]))
+                          for i in copied]
+        facts = {}
+        for i, probe_result in zip(copied, self.remote_executor.run_each(probe_commands)):
+            facts[i] = self.probe.parse(probe_result)
+
+        checksums = {}
+        failed_checksums = set()
+        if self.options.get('checksum', False):
+            checksummed = [i for i in copied if facts[i] is not None
+                           and facts[i]['paths'][final_paths[i][1]]['exists']]
+            for i in checksummed:
+                self.logger.info('Started checksum calculation for {}:{}'.format(*targets[i]))
+            # the checksums run at once, and their manifests are streamed to disk
+            checksum_results = [self.remote_executor.run_stream(targets[i][0],
+                                                                self.checksum_command(
+                                                                    final_paths[i][0]))
+                                for i in checksummed]
+            for i, checksum_result in zip(checksummed, checksum_results):
+                try:
+                    checksums[i] = self.parse_checksum(checksum_result)
+                except ValueError as e:
+                    self.logger.error('Checksum of the copy on {} failed: {}'.format(targets[i][0], e))
+                    failed_checksums.add(i)
+                self.logger.info('Finished checksum calculation for {}:{}'.format(*targets[i]))
+
+        source_checksums = {}
+        if self.is_inline_checksum and ports is not None:
+            if source_ports is None:
+                source_ports = ports
+            # all manifest files are read, so the ones of failed copies are removed too
+            sent_ports = list(dict.fromkeys(source_ports))
+            manifests = self.read_inline_checksums(
+                [(self.source_host, port, 'src') for port in sent_ports] +
+                [(target_host, port, 'dst') for (target_host, _), port in zip(targets, ports)])
+            sent_manifests = dict(zip(sent_ports, manifests[:len(sent_ports)]))
+            for i, manifest in enumerate(manifests[len(sent_ports):]):
+                source_checksums[i] = sent_manifests[source_ports[i]]
+                checksums[i] = manifest
+
+        return [3 if i in failed_checksums else
+                self.after_transfer_checks(result, target_host, target_path,
+                                           facts.get(i), checksums.get(i), source_checksums.get(i))
+                for i, (result, (target_host, target_path)) in enumerate(zip(results, targets))]
+
     def run(self):
         """
         Transfers the file (or the directory and all its contents) given on
         source_path from the source_target machine to all target_hosts hosts, as
         fast as possible. Returns an array of exit codes, one per target host,
         indicating if the transfer was successful (0) or not (<> 0).
+        The resources kept by the remote executor, like connections, are
+        released when it finishes.
         """
-        # pre-execution sanity checks
         try:
-            self.sanity_checks()
-        except ValueError as e:
-            self.logger.error("{}".format(str(e)))
-            return [-1]
-
-        # stop slave if requested
-        if self.options.get('stop_slave', False):
-            result = self.mariadb.stop_replication(self.source_host, self.source_path)
-            if result != 0:
-                self.logger.error("Stop slave failed")
-                return [-2]
-
-        self.logger.info('About to transfer {} from {} to {}:{} ({} bytes)'
-                         .format(self.source_path, self.source_host,
-                                 self.target_hosts, self.target_paths,
-                                 self.original_size))
-
-        transfer_sucessful = []
-        # actual transfer process- this is done serially until we implement a
-        # multicast-like process
-        for target_host, target_path in zip(self.target_hosts, self.target_paths):
-            firewall_handler = Firewall(target_host, self.remote_executor)
-            self.options['port'] = firewall_handler.open(self.source_host, self.options['port'])
-            result = self.copy_to(target_host, target_path)
+            # pre-execution sanity checks
+            try:
+                self.sanity_checks()
+            except ValueError as e:
+                self.logger.error("{}".format(str(e)))
+                return [-1]
+
+            # stop slave if requested
+            if self.options.get('stop_slave', False):
+                result = self.mariadb.stop_replication(self.source_host, self.source_path)
+                if result != 0:
+                    self.logger.error("Stop slave failed")
+                    return [-2]
+
+            self.logger.info('About to transfer {} from {} to {}:{} ({} bytes)'
+                             .format(self.source_path, self.source_host,
+                                     self.target_hosts, self.target_paths,
+                                     self.original_size))
+
+            # actual transfer process- targets are copied one after another unless
+            # parallel_targets allows several concurrent copies, each one using its
+            # own port, firewall rule and nc listener, or they are chained so the
+            # source is read only once
+            targets = list(zip(self.target_hosts, self.target_paths))
+            chain = self.options['chain'] and len(targets) > 1
+            rules = self.firewall_rules(chain)
+            ports = None
+            # the firewalls are closed, and the temporary lists removed, even
+            # if a copy raises
+            try:
+                # multistream and sharded copies have a port per stream
+                if self.is_sharded:
+                    self.split_in_shards()
+                if self.is_multistream:
+                    ports = self.open_firewalls(rules, self.options['streams'])
+                    copy = self.multistream_copy_to
+                elif self.is_sharded:
+                    ports = self.open_firewalls(rules, len(self.shards))
+                    copy = self.sharded_copy_to
+                else:
+                    ports = self.open_firewalls(rules)
+                    copy = self.copy_to
 
-            if firewall_handler.close(self.source_host, self.options['port']) != 0:
-                self.logger.warning('Firewall\'s temporary rule could not be deleted')
-            del firewall_handler
+                parallel_targets = self.options['parallel_targets']
+                if parallel_targets <= 0 or parallel_targets > len(targets):
+                    parallel_targets = len(targets)
+                self.concurrent_copies = 1 if chain else parallel_targets
+                if chain:
+                    self.logger.info('Transferring as a chain: {}'.format(
+                        ' -> '.join([self.source_host] + self.target_hosts)))
+                    results = self.chain_copy_to([(target_host, target_path, port, relay_port)
+                                                  for (target_host, target_path), port, relay_port
+                                                  in zip(targets, ports, ports[1:] + [None])])
+                elif parallel_targets > 1:
+                    self.logger.info('Transferring to up to {} targets concurrently'
+                                     .format(parallel_targets))
+                    with ThreadPoolExecutor(max_workers=parallel_targets) as executor:
+                        results = list(executor.map(lambda target: copy(*target),
+                                                    [(target_host, target_path, port)
+                                                     for (target_host, target_path), port
+                                                     in zip(targets, ports)]))
+                else:
+                    results = [copy(target_host, target_path, port)
+                               for (target_host, target_path), port in zip(targets, ports)]
+            finally:
+                if ports is not None:
+                    self.close_firewalls(rules, ports)
+                self.remove_shards()
+                self.remove_sync_lists()
+            # on a chain, the source only sends the stream to the first target
+            source_ports = [ports[0]] * len(ports) if chain else ports
+            transfer_sucessful = self.verify_targets(results, targets, ports, source_ports)
+            if self.is_resumable:
+                self.finish_resume(targets, transfer_sucessful)
 
-            transfer_sucessful.append(self.after_transfer_checks(result,
-                                                                 target_host,
-                                                                 target_path))
+            if self.options.get('stop_slave', False):
+                result = self.mariadb.start_replication(self.source_host, self.source_path)
+                if result != 0:
+                    self.logger.error("Start slave failed")
+                    return [-3]
 
-        if self.options.get('stop_slave', False):
-            result = self.mariadb.start_replication(self.source_host, self.source_path)
-            if result != 0:
-                self.logger.error("Start slave failed")
-                return [-3]
+            if hasattr(self.remote_executor, 'stats_summary'):
+                self.logger.debug('Remote execution: {}'.format(self.remote_executor.stats_summary()))
 
-        return transfer_sucessful
+            return transfer_sucessful
+        finally:
+            self.remote_executor.close()
@@ -0,0 +1,160 @@
+"""Tests for Agent class."""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from transferpy.Agent import Agent
+
+
+class TestAgent(unittest.TestCase):
+    """Test cases for Agent, running both ends locally."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.agent = Agent(timeout=5)
+        self.agent.buffer_size = 4096
+        self.agent.frame_size = 10000
+        self.content = os.urandom(100000)
+        self.source = os.path.join(self.directory, 'source')
+        with open(self.source, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def is_listening(self, port):
+        with open('/proc/net/tcp') as f:
+            return any(line.split()[1].endswith(':{:04X}'.format(port)) and line.split()[3] == '0A'
+                       for line in list(f)[1:])
+
+    def start_receiver(self, port, file=None, offset=None):
+        """Start a receiver, and wait for it to listen."""
+        receiver = subprocess.Popen(['/bin/bash', '-c', self.agent.receive_command(port, file,
+                                                                                   offset)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for _ in range(100):
+            if self.is_listening(port):
+                break
+            time.sleep(0.05)
+        return receiver
+
+    def start_sender(self, port, command_prefix='', **kwargs):
+        return subprocess.Popen(['/bin/bash', '-c', command_prefix +
+                                 self.agent.send_command('localhost', port, **kwargs)],
+                                stderr=subprocess.PIPE)
+
+    def send(self, port, command_prefix='', **kwargs):
+        sender = self.start_sender(port, command_prefix, **kwargs)
+        sender.communicate()
+        return sender.returncode
+
+    def test_stream(self):
+        """Test a stream read from the standard input is written to the standard output"""
+        port = self.free_port()
+        receiver = self.start_receiver(port)
+
+        # the output is read while the stream is sent
+        sender = self.start_sender(port, '/bin/cat {} | '.format(self.source))
+        stdout, _ = receiver.communicate()
+        sender.communicate()
+        self.assertEqual(0, sender.returncode)
+        self.assertEqual(0, receiver.returncode)
+        self.assertEqual(self.content, stdout)
+
+    def test_file(self):
+        """Test a file is sent, and written, by the agents themselves"""
+        port = self.free_port()
+        target = os.path.join(self.directory, 'target')
+        with open(target, 'wb') as f:
+            f.write(b'x' * 200000)
+        receiver = self.start_receiver(port, file=target)
+
+        self.assertEqual(0, self.send(port, file=self.source))
+        self.assertEqual(0, receiver.wait())
+        with open(target, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+    def test_file_range(self):
+        """Test byte ranges of a file are written in place"""
+        target = os.path.join(self.directory, 'target')
+        with open(target, 'wb') as f:
+            f.write(b'\0' * len(self.content))
+        for offset, length in [(0, 60000), (60000, 40000)]:
+            port = self.free_port()
+            receiver = self.start_receiver(port, file=target, offset=offset)
+            self.assertEqual(0, self.send(port, file=self.source, offset=offset, length=length))
+            self.assertEqual(0, receiver.wait())
+        with open(target, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+    def start_corrupting_proxy(self, port, position):
+        """Forward a connection to port, flipping the byte of the stream at position."""
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+
+        def forward(source, destination, position=None):
+            received = 0
+            for data in iter(lambda: source.recv(65536), b''):
+                if position is not None and received <= position < received + len(data):
+                    data = bytearray(data)
+                    data[position - received] ^= 0xff
+                received += len(data)
+                destination.sendall(data)
+            destination.shutdown(socket.SHUT_WR)
+
+        def proxy():
+            sender, _ = listener.accept()
+            receiver = socket.create_connection(('127.0.0.1', port))
+            replies = threading.Thread(target=forward, args=(receiver, sender), daemon=True)
+            replies.start()
+            forward(sender, receiver, position)
+            replies.join()
+            sender.close()
+            receiver.close()
+            listener.close()
+
+        threading.Thread(target=proxy, daemon=True).start()
+        return listener.getsockname()[1]
+
+    def test_corrupted_stream(self):
+        """Test a stream corrupted on its way fails on both ends"""
+        port = self.free_port()
+        target = os.path.join(self.directory, 'target')
+        receiver = self.start_receiver(port, file=target)
+        # a byte inside the data of the fifth frame
+        proxy_port = self.start_corrupting_proxy(port, 50000)
+
+        self.assertNotEqual(0, self.send(proxy_port, file=self.source))
+        _, stderr = receiver.communicate()
+        self.assertNotEqual(0, receiver.returncode)
+        self.assertIn(b'CRC of the stream does not match', stderr)
+
+    def test_sender_failure(self):
+        """Test a sender that cannot read its input fails the receiver too"""
+        port = self.free_port()
+        receiver = self.start_receiver(port)
+
+        self.assertNotEqual(0, self.send(port, file=os.path.join(self.directory, 'missing')))
+        self.assertNotEqual(0, receiver.wait())
+
+    def test_truncated_stream(self):
+        """Test a stream cut before its end fails the receiver"""
+        port = self.free_port()
+        receiver = self.start_receiver(port)
+
+        with socket.create_connection(('localhost', port)) as sock:
+            sock.sendall(b'\0' + (1000).to_bytes(8, 'big') + b'partial')
+        _, stderr = receiver.communicate()
+        self.assertNotEqual(0, receiver.returncode)
+        self.assertIn(b'before the end of the stream', stderr)
@@ -0,0 +1,156 @@
+"""Tests for AsyncTransferer class."""
+import asyncio
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from transferpy.AsyncTransferer import AsyncTransferer
+from transferpy.RemoteExecution.RemoteExecution import CommandReturn
+
+
+class TestAsyncTransferer(unittest.TestCase):
+
+    @patch('transferpy.Transferer.RemoteExecution')
+    def setUp(self, executor_mock):
+        self.executor = MagicMock()
+        self.executor.run_async = AsyncMock(return_value=CommandReturn(0, '', ''))
+        self.executor.start_job_async = AsyncMock(return_value='job')
+        self.executor.wait_job_async = AsyncMock(return_value=CommandReturn(0, '', ''))
+        executor_mock.return_value = self.executor
+
+        self.options = {'verbose': False, 'compress': True, 'encrypt': True, 'port': 0}
+
+        self.transferer = AsyncTransferer('source', 'path', ['target'], ['path'],
+                                          self.options)
+
+    def test_copy_to_async(self):
+        """Test copy_to_async starts the receiver, then sends to it, without blocking calls"""
+        result = asyncio.run(self.transferer.copy_to_async('target', 'path', 4444))
+
+        self.assertEqual(0, result)
+        self.assertEqual('target', self.executor.start_job_async.call_args[0][0])
+        self.assertIn('-p 4444', self.executor.start_job_async.call_args[0][1][-1])
+        source_call = self.executor.run_async.call_args
+        self.assertEqual('source', source_call[0][0])
+        self.assertIn('target 4444', source_call[0][1][-1])
+        self.executor.wait_job_async.assert_awaited_once_with('target', 'job')
+        self.executor.run.assert_not_called()
+        self.executor.wait_job.assert_not_called()
+
+    def test_copy_to_async_not_listening(self):
+        """Test copy_to_async does not send if the receiver finishes without listening"""
+        self.executor.run_async.return_value = CommandReturn(1, '', '')
+        self.executor.monitor_job.return_value = CommandReturn(1, '', '')
+
+        result = asyncio.run(self.transferer.copy_to_async('target', 'path', 4444))
+
+        self.assertNotEqual(0, result)
+        self.assertEqual(1, self.executor.run_async.await_count)
+        self.executor.kill_job.assert_called_once_with('target', 'job')
+
+    def test_send_async_progress(self):
+        """Test send_async reports the progress of a copy while polling it on the loop"""
+        self.options.update({'progress': True, 'progress_interval': 0, 'bwlimit_file': None})
+        self.transferer.job_check_interval = 0
+        self.executor.monitor_job.side_effect = [CommandReturn(None, None, None),
+                                                 CommandReturn(0, '', '')]
+
+        with patch.object(AsyncTransferer, 'report_progress') as mocked_report_progress:
+            result = asyncio.run(self.transferer.send_async(['command'], 4444,
+                                                            [('target', 4444)]))
+
+        self.assertEqual(0, result.returncode)
+        self.executor.start_job_async.assert_awaited_once_with('source', ['command'])
+        mocked_report_progress.assert_called_once_with(4444, [('target', 4444)])
+        self.executor.run.assert_not_called()
+        self.executor.start_job.assert_not_called()
+
+    def test_run_async_blocking_copies(self):
+        """Test run_async runs the blocking copies on a thread per concurrent copy"""
+        self.transferer.target_hosts = ['target1', 'target2']
+        self.transferer.target_paths = ['path1', 'path2']
+        self.options.update({'parallel_targets': 0, 'streams': 2})
+        executors = []
+
+        def multistream_copy_to(host, path, ports):
+            executors.append(self.transferer.copy_executor)
+            return 0
+
+        with patch.object(AsyncTransferer, 'sanity_checks'), \
+                patch.object(AsyncTransferer, 'is_multistream', True), \
+                patch.object(AsyncTransferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(AsyncTransferer, 'close_firewalls'), \
+                patch.object(AsyncTransferer, 'multistream_copy_to',
+                             side_effect=multistream_copy_to), \
+                patch.object(AsyncTransferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [[4400, 4401], [4402, 4403]]
+            mocked_verify_targets.side_effect = lambda results, targets, *ports: results
+            result = asyncio.run(self.transferer.run_async())
+
+        self.assertEqual([0, 0], result)
+        self.assertEqual(2, executors[0]._max_workers)
+        self.assertIsNone(self.transferer.copy_executor)
+
+    def test_run_async(self):
+        """Test run_async copies to all targets at once, verifying each one when it ends"""
+        self.transferer.target_hosts = ['target1', 'target2', 'target3']
+        self.transferer.target_paths = ['path1', 'path2', 'path3']
+        self.options['parallel_targets'] = 0
+        started = []
+
+        async def copy_to_async(host, path, port):
+            started.append(host)
+            # every copy waits for all of them to be started
+            while len(started) < 3:
+                await asyncio.sleep(0)
+            return int(host[-1])
+
+        with patch.object(AsyncTransferer, 'sanity_checks'), \
+                patch.object(AsyncTransferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(AsyncTransferer, 'close_firewalls') as mocked_close_firewalls, \
+                patch.object(AsyncTransferer, 'copy_to_async', side_effect=copy_to_async), \
+                patch.object(AsyncTransferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [4400, 4401, 4402]
+            mocked_verify_targets.side_effect = lambda results, targets, *ports: results
+            result = asyncio.run(self.transferer.run_async())
+
+        self.assertEqual([1, 2, 3], result)
+        mocked_close_firewalls.assert_any_call([('target3', 'source')], [4402])
+        mocked_verify_targets.assert_any_call([2], [('target2', 'path2')], [4401])
+        self.executor.close.assert_called_once()
+
+    def test_run_async_copy_raising(self):
+        """Test run_async closes the firewall of every copy, even if one of them raises"""
+        self.transferer.target_hosts = ['target1', 'target2']
+        self.transferer.target_paths = ['path1', 'path2']
+        self.options['parallel_targets'] = 0
+
+        async def copy_to_async(host, path, port):
+            if host == 'target1':
+                raise Exception('Test copy_to_async')
+            await asyncio.sleep(0)
+            return 0
+
+        with patch.object(AsyncTransferer, 'sanity_checks'), \
+                patch.object(AsyncTransferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(AsyncTransferer, 'close_firewalls') as mocked_close_firewalls, \
+                patch.object(AsyncTransferer, 'remove_sync_lists') as mocked_remove_sync_lists, \
+                patch.object(AsyncTransferer, 'copy_to_async', side_effect=copy_to_async), \
+                patch.object(AsyncTransferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [4400, 4401]
+            mocked_verify_targets.side_effect = lambda results, targets, *ports: results
+            with self.assertRaises(Exception):
+                asyncio.run(self.transferer.run_async())
+
+        mocked_close_firewalls.assert_any_call([('target1', 'source')], [4400])
+        mocked_close_firewalls.assert_any_call([('target2', 'source')], [4401])
+        mocked_remove_sync_lists.assert_called_once()
+        self.executor.close.assert_called_once()
+
+    def test_run_async_sanity_checks_failing(self):
+        """Test run_async returns an error code if the preflight checks fail"""
+        with patch.object(AsyncTransferer, 'sanity_checks') as mocked_sanity_checks:
+            mocked_sanity_checks.side_effect = ValueError('Test sanity_checks')
+            result = asyncio.run(self.transferer.run_async())
+
+        self.assertEqual([-1], result)
+        self.executor.close.assert_called_once()
@@ -0,0 +1,82 @@
+"""Tests for BandwidthLimit module."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.BandwidthLimit import BandwidthLimiter, parse_rate
+
+
+class TestParseRate(unittest.TestCase):
+    """Test cases for parse_rate."""
+
+    def test_parse_rate(self):
+        self.assertEqual(1000, parse_rate('1000'))
+        self.assertEqual(500 * 1024, parse_rate('500K'))
+        self.assertEqual(100 * 1024 ** 2, parse_rate('100m'))
+        self.assertEqual(int(1.5 * 1024 ** 3), parse_rate('1.5GB'))
+        self.assertEqual(0, parse_rate(0))
+        for rate in ['', 'fast', '-1M', '10X']:
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+    """Test cases for BandwidthLimiter."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.control_file = os.path.join(self.directory, 'bwlimit')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_control_file(self, content, mtime):
+        with open(self.control_file, 'w') as f:
+            f.write(content)
+        os.utime(self.control_file, (mtime, mtime))
+
+    def test_rate(self):
+        limiter = BandwidthLimiter(MagicMock(), 3000, {'target1': 500, 'target2': 0})
+
+        self.assertEqual(1000, limiter.rate(['target2'], 3))
+        self.assertEqual(500, limiter.rate(['target1'], 3))
+        self.assertEqual(500, limiter.rate(['target1', 'target2']))
+        self.assertEqual(0, BandwidthLimiter(MagicMock()).rate(['target1']))
+
+    def test_limit_command(self):
+        limiter = BandwidthLimiter(MagicMock(), 1000, session='abc')
+
+        self.assertEqual('| /usr/bin/pv -q -L 1000 -P /tmp/transferpy.abc.4400.pv.pid',
+                         limiter.limit_command(4400, 1000))
+        self.assertIn('/usr/bin/pv -R $(/bin/cat /tmp/transferpy.abc.4400.pv.pid) -L 0',
+                      limiter.update_command(4400, 0)[-1])
+        self.assertFalse(BandwidthLimiter(MagicMock()).enabled)
+        self.assertEqual('', BandwidthLimiter(MagicMock()).limit_command(4400, 0))
+
+    def test_reload(self):
+        """Test the control file replaces the limits every time it changes"""
+        limiter = BandwidthLimiter(MagicMock(), 1000, control_file=self.control_file)
+        self.assertTrue(limiter.enabled)
+        self.assertFalse(limiter.reload())
+        self.assertEqual(1000, limiter.limit)
+
+        self.write_control_file('10M  # nights\ntarget1 1M\n', 100)
+        self.assertTrue(limiter.reload())
+        self.assertEqual(10 * 1024 ** 2, limiter.limit)
+        self.assertEqual({'target1': 1024 ** 2}, limiter.target_limits)
+        self.assertEqual(1, limiter.version)
+        self.assertFalse(limiter.reload())
+
+        # rewriting the same limits is not a change
+        self.write_control_file('10M\ntarget1 1M\n', 200)
+        self.assertFalse(limiter.reload())
+        self.write_control_file('target1 2M\n', 300)
+        self.assertTrue(limiter.reload())
+        self.assertIsNone(limiter.limit)
+        self.assertEqual(2, limiter.version)
+
+        self.write_control_file('target1 2M 3M\n', 400)
+        with self.assertRaises(ValueError):
+            limiter.reload()
@@ -0,0 +1,85 @@
+"""Tests for Checkpoint class."""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Checkpoint import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test cases for Checkpoint."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = Checkpoint(MagicMock())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_shell(self, command, stdin=None):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        if command[0] == '/bin/bash':
+            command = ['/bin/bash', '-c', command[-1][1:-1]]
+        process = subprocess.run(command, input=stdin, stdout=subprocess.PIPE)
+        return MagicMock(returncode=process.returncode, stdout=process.stdout.decode())
+
+    def test_path(self):
+        self.assertEqual('/srv/.data.transferpy-checkpoint', Checkpoint.path('/srv/', '/a/data/'))
+
+    def test_write_and_read(self):
+        path = os.path.join(self.directory, 'checkpoint')
+        state = Checkpoint.state('source', '/srv/data', 100)
+
+        self.assertEqual(0, self.run_shell(Checkpoint.write_command(path, state)).returncode)
+        self.assertEqual(state, Checkpoint.parse(self.run_shell(Checkpoint.read_command(path))))
+        self.run_shell(Checkpoint.remove_command(path))
+        self.assertIsNone(Checkpoint.parse(self.run_shell(Checkpoint.read_command(path))))
+
+    def test_writer(self):
+        """Test the writer records the bytes synced, and resumes from an offset"""
+        self.checkpoint.interval = 1000
+        final_file = os.path.join(self.directory, 'data')
+        checkpoint_path = os.path.join(self.directory, 'checkpoint')
+        state = Checkpoint.state('source', '/srv/data', 5000)
+        content = os.urandom(5000)
+        writer = self.checkpoint.writer_command(final_file, checkpoint_path, 0, state)[2:]
+
+        self.assertEqual(0, self.run_shell(['/bin/bash', '-c', '"{}"'.format(writer)],
+                                           content[:2500]).returncode)
+        with open(checkpoint_path) as f:
+            self.assertEqual(dict(state, written=2500), json.load(f))
+
+        writer = self.checkpoint.writer_command(final_file, checkpoint_path, 2000, state)[2:]
+        self.assertEqual(0, self.run_shell(['/bin/bash', '-c', '"{}"'.format(writer)],
+                                           content[2000:]).returncode)
+        with open(final_file, 'rb') as f:
+            self.assertEqual(content, f.read())
+        with open(checkpoint_path) as f:
+            self.assertEqual(5000, json.load(f)['written'])
+
+    def test_sample_ranges(self):
+        self.checkpoint.sample_blocks = 3
+        self.checkpoint.block_size = 10
+
+        self.assertEqual([(0, 10), (45, 10), (90, 10)], self.checkpoint.sample_ranges(100))
+        self.assertEqual([(0, 5)], self.checkpoint.sample_ranges(5))
+        self.assertEqual([], self.checkpoint.sample_ranges(0))
+
+    def test_ranges_hash(self):
+        path = os.path.join(self.directory, 'data')
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+
+        result = self.run_shell(self.checkpoint.ranges_hash_command(path, [(0, 2), (8, 2)]))
+        self.assertEqual(hashlib.md5(b'0189').hexdigest(),
+                         self.checkpoint.parse_ranges_hash(result))
+        other = self.run_shell(self.checkpoint.ranges_hash_command(path, [(0, 2), (7, 2)]))
+        self.assertNotEqual(self.checkpoint.parse_ranges_hash(result),
+                            self.checkpoint.parse_ranges_hash(other))
+        beyond = self.run_shell(self.checkpoint.ranges_hash_command(path, [(9, 2)]))
+        self.assertIsNone(self.checkpoint.parse_ranges_hash(beyond))
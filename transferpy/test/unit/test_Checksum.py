@@ -0,0 +1,109 @@
+"""Tests for Checksum class."""
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from transferpy.Checksum import Checksum
+from transferpy.Manifest import ManifestEntry
+from transferpy.RemoteExecution.RemoteExecution import CommandStream
+
+
+class TestChecksum(unittest.TestCase):
+    """Test cases for Checksum."""
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            Checksum('crc32')
+
+    def test_choose(self):
+        self.assertEqual('xxh128', Checksum.choose(['md5', 'xxh128']))
+        self.assertEqual('md5', Checksum.choose(['md5']))
+        self.assertIsNone(Checksum.choose([]))
+
+    def test_command_file(self):
+        command = Checksum('blake3').command('/srv/file', False)
+
+        self.assertIn('set -o pipefail; exec 2>/dev/null; cd /srv && /usr/bin/b3sum file | ',
+                      command[-1])
+
+    def test_command_dir(self):
+        command = Checksum('md5').command('/srv/dir/', True)
+
+        self.assertIn('cd /srv &&', command[-1])
+        self.assertIn('xargs -0 -r -P $(/usr/bin/nproc) -n 1 /usr/bin/md5sum', command[-1])
+        self.assertIn('-n 256 /usr/bin/md5sum', command[-1])
+        self.assertIn('sort', command[-1])
+
+    def test_parse_failure(self):
+        self.assertIsNone(Checksum('md5').parse(MagicMock(returncode=1, stdout='')))
+
+    def test_parse_invalid_output(self):
+        """Test output that is not a manifest, like a traceback merged into it, fails to parse"""
+        stream = CommandStream()
+        stream.write('stdout', 'Traceback: no such file «data/a»\n'.encode('utf-8'))
+        stream.finish(0)
+
+        self.assertIsNone(Checksum('md5').parse(stream))
+        self.assertIsNone(Checksum('md5').parse(MagicMock(returncode=0, stdout=b'\xff\n')))
+
+    def test_parse_stream(self):
+        stream = CommandStream(chunk_size=5)
+        stream.write('stdout', b'dir/a\t1\td1\ndir/b\t2\td2\n')
+        stream.finish(0)
+
+        self.assertEqual([ManifestEntry('dir/a', 1, 'd1'), ManifestEntry('dir/b', 2, 'd2')],
+                         list(Checksum('md5').parse(stream)))
+
+        failed = CommandStream()
+        failed.finish(1)
+        self.assertIsNone(Checksum('md5').parse(failed))
+
+    def test_command_manifest(self):
+        """Test the command writes a manifest sorted by escaped path"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.makedirs(os.path.join(directory, 'data', 'sub'))
+        contents = {'data/b': b'b' * 1000, 'data/sub/a': b'a',
+                    'data/with\ttab': b'tab', 'data/with\\backslash\nnewline': b'nl'}
+        for name, content in contents.items():
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(content)
+        command = Checksum('md5').command(os.path.join(directory, 'data'), True)
+
+        # run locally, without the quotes for the remote shell
+        result = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]], stdout=subprocess.PIPE)
+
+        self.assertEqual(0, result.returncode)
+        manifest = Checksum('md5').parse(MagicMock(returncode=0, stdout=result.stdout))
+        self.assertEqual([ManifestEntry('data/b', 1000, hashlib.md5(b'b' * 1000).hexdigest()),
+                          ManifestEntry('data/sub/a', 1, hashlib.md5(b'a').hexdigest()),
+                          ManifestEntry('data/with\\x09tab', 3, hashlib.md5(b'tab').hexdigest()),
+                          ManifestEntry('data/with\\x5cbackslash\\x0anewline', 2,
+                                        hashlib.md5(b'nl').hexdigest())],
+                         list(manifest))
+
+    def test_command_manifest_failing(self):
+        """Test the command fails, with nothing on its output, if a file cannot be hashed"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.makedirs(os.path.join(directory, 'data'))
+        with open(os.path.join(directory, 'data', 'a'), 'wb') as f:
+            f.write(b'a')
+        # a hasher dying halfway, after writing some of its lines
+        hasher = os.path.join(directory, 'hasher')
+        with open(hasher, 'w') as f:
+            f.write('#!/bin/bash\n/usr/bin/md5sum "$@"\necho "hasher: crashed" >&2\nexit 1\n')
+        os.chmod(hasher, 0o755)
+        checksum = Checksum('md5')
+        with patch.dict('transferpy.Checksum.ALGORITHMS', {'md5': hasher}):
+            command = checksum.command(os.path.join(directory, 'data'), True)
+
+        result = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        self.assertNotEqual(0, result.returncode)
+        self.assertNotIn(b'crashed', result.stdout)
@@ -0,0 +1,138 @@
+"""Tests for Compression module."""
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Compression import (CompressionSampler, SAMPLE_SCRIPT, choose_compression,
+                                    detect_compressor, get_compressor)
+from transferpy.RemoteScript import RemoteScript
+
+
+class TestCompression(unittest.TestCase):
+    """Test cases for the compression codecs."""
+
+    def test_pigz(self):
+        self.assertEqual('/usr/bin/pigz -c', get_compressor('pigz').compress_command)
+        self.assertEqual('/usr/bin/pigz -c -d', get_compressor('pigz').decompress_command)
+        self.assertEqual('/usr/bin/pigz -c -1 -p 4', get_compressor('pigz', 1, 4).compress_command)
+
+    def test_zstd(self):
+        self.assertEqual('/usr/bin/zstd -c -T0 -q', get_compressor('zstd').compress_command)
+        self.assertEqual('/usr/bin/zstd -c -3 -T8 -q', get_compressor('zstd', 3, 8).compress_command)
+        self.assertEqual('/usr/bin/zstd -c -d -q', get_compressor('zstd').decompress_command)
+
+    def test_lz4(self):
+        self.assertEqual('/usr/bin/lz4 -c -9 -q', get_compressor('lz4', 9, 4).compress_command)
+        self.assertEqual('/usr/bin/lz4 -c -d -q', get_compressor('lz4').decompress_command)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            get_compressor('bzip2')
+        with self.assertRaises(ValueError):
+            get_compressor('pigz', level=12)
+        with self.assertRaises(ValueError):
+            get_compressor('zstd', threads=-1)
+
+    def test_detect_compressor(self):
+        self.assertEqual('pigz', detect_compressor('1f8b0800000000000003'))
+        self.assertEqual('zstd', detect_compressor('28b52ffd04580000'))
+        self.assertEqual('lz4', detect_compressor('04224d1864400000'))
+        self.assertIsNone(detect_compressor('7573746172000000'))
+        self.assertIsNone(detect_compressor(None))
+
+
+class TestCompressionSampler(unittest.TestCase):
+    """Test cases for CompressionSampler and the compression choice."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_script(self, arguments):
+        """Run the sample script locally, the way the remote host would."""
+        result = subprocess.run([sys.executable, '-', RemoteScript.encode(json.dumps(arguments))],
+                                input=SAMPLE_SCRIPT.encode('utf-8'), stdout=subprocess.PIPE)
+        self.assertEqual(0, result.returncode)
+        return json.loads(result.stdout.decode('utf-8'))
+
+    def test_command(self):
+        sampler = CompressionSampler(MagicMock())
+
+        command = sampler.command('/srv', ['zstd', 'lz4'])
+
+        self.assertEqual('/bin/bash', command[0])
+        arguments = json.loads(base64.b64decode(command[-1][:-1].split()[-1]).decode('utf-8'))
+        self.assertEqual(['/usr/bin/zstd', '-c', '-3', '-T1', '-q'], arguments['commands']['zstd:3'])
+        self.assertEqual(['zstd:1', 'zstd:3', 'zstd:9', 'lz4:1'], list(arguments['commands']))
+
+    def test_script(self):
+        os.makedirs(os.path.join(self.directory, 'sub'))
+        with open(os.path.join(self.directory, 'zeros'), 'wb') as f:
+            f.write(b'\0' * 3000)
+        with open(os.path.join(self.directory, 'sub', 'random'), 'wb') as f:
+            f.write(os.urandom(1000))
+
+        sample = self.run_script({'path': self.directory, 'sample_size': 4096,
+                                  'block_size': 1024, 'max_files': 10,
+                                  'commands': {'gzip:1': ['gzip', '-c', '-1'],
+                                               'cat:1': ['cat'],
+                                               'missing:1': ['/no/such/compressor']}})
+
+        # 4 blocks spread over the 4000 bytes, the last one is the whole smaller file
+        self.assertEqual(3 * 1024 + 1000, sample['sampled'])
+        self.assertEqual(3 * 1024 + 1000, sample['results']['cat:1']['size'])
+        self.assertLess(sample['results']['gzip:1']['size'], 3 * 1024)
+        self.assertNotIn('missing:1', sample['results'])
+        self.assertGreater(sample['cores'], 0)
+
+    def test_script_empty(self):
+        sample = self.run_script({'path': self.directory, 'sample_size': 4096,
+                                  'block_size': 1024, 'max_files': 10,
+                                  'commands': {'cat:1': ['cat']}})
+
+        self.assertEqual(0, sample['sampled'])
+        self.assertEqual({}, sample['results'])
+
+    def sample(self, results):
+        return {'sampled': 1000 * 1000, 'cores': 8,
+                'results': {key: {'size': size, 'seconds': seconds}
+                            for key, (size, seconds) in results.items()}}
+
+    def test_choose_compression(self):
+        # zstd 3 compresses better and, on 8 cores, faster than the link needs
+        sample = self.sample({'zstd:1': (400 * 1000, 0.005), 'zstd:3': (300 * 1000, 0.004),
+                              'lz4:1': (500 * 1000, 0.002)})
+
+        name, level, reason = choose_compression(sample, 1000 * 1000 * 1000)
+
+        self.assertEqual(('zstd', 3), (name, level))
+        self.assertIn('ratio of 0.30', reason)
+
+    def test_choose_compression_incompressible(self):
+        sample = self.sample({'zstd:1': (990 * 1000, 0.005), 'pigz:1': (995 * 1000, 0.01)})
+
+        name, level, reason = choose_compression(sample, 1000 * 1000 * 1000)
+
+        self.assertIsNone(name)
+        self.assertIn('does not compress', reason)
+
+    def test_choose_compression_slower_than_link(self):
+        # a single core lz4 at 100 MB/s cannot feed a 1 GB/s link
+        sample = self.sample({'lz4:1': (500 * 1000, 0.01)})
+
+        name, level, reason = choose_compression(sample, 1000 * 1000 * 1000)
+
+        self.assertIsNone(name)
+        self.assertIn('slower than the link', reason)
+        self.assertEqual('lz4', choose_compression(sample, 10 * 1000 * 1000)[0])
+
+    def test_choose_compression_no_sample(self):
+        self.assertIsNone(choose_compression({'sampled': 0, 'cores': 1, 'results': {}}, 1)[0])
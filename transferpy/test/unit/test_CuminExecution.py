@@ -1,4 +1,5 @@
 """Tests for CuminExecution class."""
+import pickle
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -43,3 +44,90 @@ class TestCuminExecution(unittest.TestCase):
         self.assertEqual(command_return.returncode, 1)
         self.assertEqual(command_return.stdout, None)
         self.assertEqual(command_return.stderr, 'host is wrong or does not match rules')
+
+    @patch('transferpy.RemoteExecution.CuminExecution.query.Query')
+    def test_resolve_cached(self, query_mock):
+        query_mock.return_value.execute.return_value = 'host.eqiad.wmnet'
+        self.executor._config = MagicMock()
+
+        hosts1 = self.executor.resolve('host.eqiad.wmnet')
+        hosts2 = self.executor.resolve('host.eqiad.wmnet')
+
+        self.assertEqual(hosts1, hosts2)
+        self.assertEqual(1, query_mock.return_value.execute.call_count)
+        self.assertEqual(1, self.executor.stats['resolution_cache_hits'])
+
+    @patch('transferpy.RemoteExecution.CuminExecution.query.Query')
+    def test_resolve_expired(self, query_mock):
+        query_mock.return_value.execute.return_value = 'host.eqiad.wmnet'
+        self.executor._config = MagicMock()
+        self.executor.resolution_ttl = 0
+
+        self.executor.resolve('host.eqiad.wmnet')
+        self.executor.resolve('host.eqiad.wmnet')
+
+        self.assertEqual(2, query_mock.return_value.execute.call_count)
+
+    @patch('transferpy.RemoteExecution.CuminExecution.transports.Target')
+    @patch('transferpy.RemoteExecution.CuminExecution.transport.Transport.new')
+    def test_get_worker_reused(self, transport_mock, target_mock):
+        self.executor._config = MagicMock()
+
+        worker1 = self.executor.get_worker('host', 'nodes')
+        worker2 = self.executor.get_worker('host', 'nodes')
+        worker3 = self.executor.get_worker('host', 'other nodes')
+
+        self.assertIs(worker1, worker2)
+        self.assertEqual(2, transport_mock.call_count)
+        self.assertEqual(2, self.executor.stats['transports'])
+        self.assertIsNotNone(worker3)
+
+    @patch('transferpy.RemoteExecution.CuminExecution.task_terminate')
+    def test_job(self, terminate_mock):
+        worker = MagicMock()
+        worker.execute.return_value = 0
+        worker.get_results.return_value = [(['host'], b'output')]
+        executor = CuminExecution({'verbose': True})
+        executor._resolutions['host'] = (float('inf'), 'host')
+
+        with patch.object(executor, 'get_worker', return_value=worker):
+            job = executor.start_job('host', ['/bin/true'])
+            result = executor.wait_job('host', job)
+
+        self.assertEqual(0, result.returncode)
+        self.assertEqual('output', result.stdout)
+        self.assertEqual(result, executor.monitor_job('host', job))
+        terminate_mock.assert_called_once_with()
+        # the job is killed aborting the ClusterShell task
+        self.assertEqual(worker.task.abort, job.stop)
+
+    @patch('transferpy.RemoteExecution.CuminExecution.task_terminate')
+    def test_run_stream(self, terminate_mock):
+        """Test the output is written to the stream by the event handler, as it is read"""
+        worker = MagicMock()
+
+        def execute():
+            handler = worker.handler.__new__(worker.handler)
+            handler.ev_read(None, 'host', 'stdout', b'first')
+            handler.ev_read(None, 'other', 'stdout', b'other host')
+            handler.ev_read(None, 'host', 'stdout', b'second')
+            return 0
+        worker.execute.side_effect = execute
+        worker.get_results.return_value = []
+        executor = CuminExecution({'verbose': True})
+        executor._resolutions['host'] = (float('inf'), 'host')
+
+        with patch.object(executor, 'get_worker', return_value=worker):
+            stream = executor.run_stream('host', ['/bin/true'])
+            self.assertEqual(['first', 'second'], list(stream.lines()))
+
+        self.assertEqual(0, stream.wait().returncode)
+        terminate_mock.assert_called_once_with()
+
+    def test_pickle(self):
+        self.executor._resolutions['host'] = (0, 'host')
+
+        executor = pickle.loads(pickle.dumps(self.executor))
+
+        self.assertEqual(self.executor._resolutions, executor._resolutions)
+        self.assertEqual(0, executor.stats['commands'])
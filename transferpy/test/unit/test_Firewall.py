@@ -0,0 +1,107 @@
+"""Tests for Firewall class."""
+import base64
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Firewall import Firewall
+
+
+class TestFirewall(unittest.TestCase):
+    """Test cases for Firewall."""
+
+    def setUp(self):
+        self.executor = MagicMock()
+        self.iptables = Firewall('target', self.executor)
+        self.ipset = Firewall('target', self.executor, 'ipset', timeout=3600)
+
+    def run_locally(self, command):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        process = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]], stdout=subprocess.PIPE)
+        return MagicMock(returncode=process.returncode, stdout=process.stdout.decode())
+
+    def restored_lines(self, command):
+        """Decode the lines an ipset command restores."""
+        encoded = command[-1].split('/bin/echo ')[1].split(' ')[0]
+        return base64.b64decode(encoded).decode().splitlines()
+
+    def test_lease(self):
+        """Test concurrent transfers lease different ports, until they release them"""
+        with tempfile.TemporaryDirectory() as directory:
+            lease_file = os.path.join(directory, 'ports')
+            first = Firewall('target', self.executor, port_range=(64000, 64010), session='a')
+            second = Firewall('target', self.executor, port_range=(64000, 64010), session='b')
+            first.lease_file = second.lease_file = lease_file
+
+            ports = first.parse_lease(self.run_locally(first.lease_command(3)))
+            self.assertEqual(3, len(ports))
+            self.assertTrue(all(64000 <= port < 64010 for port in ports))
+            other_ports = second.parse_lease(self.run_locally(second.lease_command(3)))
+            self.assertFalse(set(ports) & set(other_ports))
+
+            # leases of other transfers are not released
+            self.run_locally(second.release_command(ports))
+            with self.assertRaises(ValueError):
+                second.parse_lease(self.run_locally(second.lease_command(5)))
+            self.run_locally(first.release_command(ports))
+            self.assertEqual(5, len(second.parse_lease(self.run_locally(second.lease_command(5)))))
+
+            # expired leases are dropped
+            expired = Firewall('target', self.executor, timeout=-1, port_range=(64000, 64010))
+            expired.lease_file = lease_file
+            self.run_locally(expired.lease_command(2))
+            self.assertEqual(2, len(first.parse_lease(self.run_locally(first.lease_command(2)))))
+
+    def test_open_leases_port(self):
+        """Test open leases a free port when given port 0, and close releases it"""
+        self.executor.run.side_effect = [MagicMock(returncode=0, stdout='[4402]'),
+                                         MagicMock(returncode=0), MagicMock(returncode=0),
+                                         MagicMock(returncode=0, stdout='[]')]
+
+        self.assertEqual(4402, self.iptables.open('source', 0))
+        self.assertIn('4402', self.executor.run.call_args[0][1])
+        self.assertEqual(0, self.iptables.close('source', 4402))
+
+        release_command = self.executor.run.call_args[0][1]
+        self.assertEqual(self.iptables.release_command([4402]), release_command)
+        self.assertEqual(set(), self.iptables.leased_ports)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Firewall('target', self.executor, 'nope')
+
+    def test_iptables_commands(self):
+        """Test iptables adds a rule per copy"""
+        self.assertEqual([['/sbin/iptables', '-A', 'INPUT', '-p', 'tcp', '-s', 'source',
+                           '--dport', '4400', '-j', 'ACCEPT'],
+                          ['/sbin/iptables', '-A', 'INPUT', '-p', 'tcp', '-s', 'source',
+                           '-m', 'multiport', '--dports', '4401,4402', '-j', 'ACCEPT']],
+                         self.iptables.open_commands([('source', 4400), ('source', [4401, 4402])]))
+        self.assertEqual('-D', self.iptables.close_commands([('source', 4400)])[0][1])
+
+    def test_ipset_open_commands(self):
+        """Test ipset adds all the ports of a host with a single command"""
+        commands = self.ipset.open_commands([('source', 4400), ('other', [4401, 4402])])
+
+        self.assertEqual(1, len(commands))
+        self.assertIn('/sbin/ipset create transferpy hash:ip,port timeout 3600 -exist',
+                      commands[0][-1])
+        self.assertIn('/sbin/iptables -C INPUT -p tcp -m set --match-set transferpy src,dst',
+                      commands[0][-1])
+        self.assertIn('/sbin/ipset restore -exist', commands[0][-1])
+        self.assertEqual(['add transferpy source,tcp:4400 timeout 3600',
+                          'add transferpy other,tcp:4401 timeout 3600',
+                          'add transferpy other,tcp:4402 timeout 3600'],
+                         self.restored_lines(commands[0]))
+
+    def test_ipset_close_commands(self):
+        """Test ipset removes the entries, leaving the set and its rule"""
+        commands = self.ipset.close_commands([('source', [4400, 4401])])
+
+        self.assertEqual(1, len(commands))
+        self.assertNotIn('iptables', commands[0][-1])
+        self.assertEqual(['del transferpy source,tcp:4400', 'del transferpy source,tcp:4401'],
+                         self.restored_lines(commands[0]))
+        self.assertEqual(commands[0], self.ipset.close_command('source', [4400, 4401]))
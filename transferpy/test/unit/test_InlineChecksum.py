@@ -0,0 +1,69 @@
+"""Tests for InlineChecksum class."""
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.InlineChecksum import InlineChecksum
+from transferpy.Manifest import ManifestEntry
+
+
+class TestInlineChecksum(unittest.TestCase):
+    """Test cases for InlineChecksum."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'data', 'sub'))
+        self.contents = {'data/a': b'a' * 100000, 'data/sub/b': b'b'}
+        for name, content in self.contents.items():
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_shell(self, command):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        return subprocess.run(['/bin/bash', '-c', command[1:-1]], stdout=subprocess.PIPE,
+                              cwd=self.directory)
+
+    def test_paths(self):
+        hasher = InlineChecksum(True, session='abc')
+
+        self.assertEqual(('/tmp/transferpy.abc.4400.src.fifo',
+                          '/tmp/transferpy.abc.4400.src.digest'), hasher.paths(4400, 'src'))
+        self.assertNotEqual(InlineChecksum(True).session, InlineChecksum(True).session)
+
+    def test_hash_tar_stream(self):
+        hasher = InlineChecksum(True)
+        command = '"{} /bin/tar cf - data {} > /dev/null {}"'.format(
+            hasher.start_command(4400, 'src'), hasher.tee_command(4400, 'src'),
+            hasher.end_command())
+
+        self.assertEqual(0, self.run_shell(command).returncode)
+        result = self.run_shell(hasher.read_command(4400, 'src')[-1])
+        expected = sorted(ManifestEntry(name, len(content), hashlib.md5(content).hexdigest())
+                          for name, content in self.contents.items())
+        self.assertEqual(expected, list(hasher.parse(result)))
+        self.assertFalse(os.path.exists(hasher.paths(4400, 'src')[0]))
+
+    def test_hash_file_stream(self):
+        hasher = InlineChecksum(False, name='a')
+        command = '"{} /bin/cat data/a {} > /dev/null {}"'.format(
+            hasher.start_command(4400, 'dst'), hasher.tee_command(4400, 'dst'),
+            hasher.end_command())
+
+        self.assertEqual(0, self.run_shell(command).returncode)
+        result = self.run_shell(hasher.read_command(4400, 'dst')[-1])
+        self.assertEqual([ManifestEntry('a', 100000, hashlib.md5(self.contents['data/a']).hexdigest())],
+                         list(hasher.parse(result)))
+
+    def test_parse_missing_digest(self):
+        hasher = InlineChecksum(True)
+
+        result = self.run_shell(hasher.read_command(4400, 'dst')[-1])
+        self.assertIsNone(hasher.parse(result))
+        self.assertIsNone(hasher.parse(MagicMock(returncode=0, stdout=None)))
@@ -0,0 +1,44 @@
+"""Tests for Manifest class."""
+import unittest
+
+from transferpy.Manifest import Manifest, ManifestEntry
+
+
+class TestManifest(unittest.TestCase):
+    """Test cases for Manifest."""
+
+    def test_iter(self):
+        manifest = Manifest(b'dir/a\t10\td1\ndir/b\t0\td2\n')
+
+        self.assertEqual([ManifestEntry('dir/a', 10, 'd1'), ManifestEntry('dir/b', 0, 'd2')],
+                         list(manifest))
+        # it can be iterated again
+        self.assertEqual(2, len(list(manifest)))
+
+    def test_iter_invalid_line(self):
+        with self.assertRaises(ValueError):
+            list(Manifest('dir/a d1\n'))
+
+    def test_compare_equal(self):
+        output = 'dir/a\t10\td1\ndir/b\t0\td2\n'
+
+        self.assertEqual([], list(Manifest(output).compare(Manifest(output))))
+        self.assertEqual([], list(Manifest('').compare(Manifest(''))))
+
+    def test_compare(self):
+        original = Manifest('dir/a\t1\td1\ndir/b\t1\td2\ndir/c\t1\td3\ndir/e\t1\td5\n')
+        copy = Manifest('dir/0\t1\td0\ndir/a\t1\td1\ndir/c\t1\tdx\ndir/d\t1\td4\ndir/e\t2\td5\n')
+
+        self.assertEqual([('extra', 'dir/0'), ('missing', 'dir/b'), ('changed', 'dir/c'),
+                          ('extra', 'dir/d'), ('changed', 'dir/e')],
+                         list(original.compare(copy)))
+        self.assertEqual([('missing', 'dir/a')], list(Manifest('dir/a\t1\td1\n').compare(Manifest(''))))
+
+    def test_spooling(self):
+        """Test big manifests are moved to disk"""
+        output = ''.join('dir/{:08d}\t1\td\n'.format(i) for i in range(1000))
+        manifest = Manifest(output, spool_size=1024)
+
+        self.assertTrue(manifest.file._rolled)
+        self.assertEqual([], list(manifest.compare(Manifest(output))))
+        manifest.close()
@@ -0,0 +1,43 @@
+"""Tests for MultiStream module."""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from transferpy.MultiStream import (preallocate_command, read_range_command, split_ranges,
+                                    write_range_command)
+
+
+class TestMultiStream(unittest.TestCase):
+    """Test cases for the byte ranges of MultiStream."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_split_ranges(self):
+        self.assertEqual([(0, 2048), (2048, 2048), (4096, 904)], split_ranges(5000, 3, 1024))
+        self.assertEqual([(0, 1024), (1024, 1)], split_ranges(1025, 4, 1024))
+        self.assertEqual([(0, 100)], split_ranges(100, 4, 1024))
+        self.assertEqual([], split_ranges(0, 4, 1024))
+
+    def test_copy_ranges(self):
+        """Test the ranges, written in any order, rebuild the file"""
+        source = os.path.join(self.directory, 'source')
+        copy = os.path.join(self.directory, 'copy')
+        content = os.urandom(10000)
+        with open(source, 'wb') as f:
+            f.write(content)
+
+        command = preallocate_command(copy, len(content))[-1][1:-1]
+        self.assertEqual(0, subprocess.run(['/bin/bash', '-c', command]).returncode)
+        for offset, length in reversed(split_ranges(len(content), 3, 1024)):
+            command = '{} {}'.format(read_range_command(source, offset, length, 1024),
+                                     write_range_command(copy, offset, 1024))
+            self.assertEqual(0, subprocess.run(['/bin/bash', '-c', command]).returncode)
+
+        with open(copy, 'rb') as f:
+            self.assertEqual(content, f.read())
@@ -0,0 +1,76 @@
+"""Tests for ParamikoExecution class."""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from transferpy.RemoteExecution.ParamikoExecution import ParamikoExecution
+
+
+class TestParamikoExecution(unittest.TestCase):
+    """Test cases for ParamikoExecution."""
+
+    def setUp(self):
+        self.executor = ParamikoExecution()
+
+    def mock_client(self, client_mock, returncode=0):
+        client = MagicMock()
+        channel = client.get_transport.return_value.open_session.return_value
+        channel.makefile.return_value.__enter__.return_value.read.return_value = b'out'
+        channel.makefile_stderr.return_value.__enter__.return_value.read.return_value = b''
+        channel.recv_exit_status.return_value = returncode
+        client_mock.return_value = client
+        return client
+
+    @patch('transferpy.RemoteExecution.ParamikoExecution.paramiko.SSHClient')
+    def test_run_reuses_connection(self, client_mock):
+        client = self.mock_client(client_mock)
+
+        result1 = self.executor.run('host', ['/bin/true'])
+        result2 = self.executor.run('host', ['/bin/true'])
+
+        self.assertEqual(0, result1.returncode)
+        self.assertEqual(b'out', result2.stdout)
+        self.assertEqual(1, client_mock.call_count)
+        self.assertEqual(1, client.connect.call_count)
+        self.assertEqual(2, client.get_transport.return_value.open_session.call_count)
+
+    @patch('transferpy.RemoteExecution.ParamikoExecution.paramiko.SSHClient')
+    def test_run_reconnects_unhealthy_connection(self, client_mock):
+        client = self.mock_client(client_mock)
+
+        self.executor.run('host', ['/bin/true'])
+        client.get_transport.return_value.is_active.return_value = False
+        self.executor.run('host', ['/bin/true'])
+
+        self.assertEqual(2, client.connect.call_count)
+        client.close.assert_called_once()
+
+    @patch('transferpy.RemoteExecution.ParamikoExecution.paramiko.SSHClient')
+    def test_idle_connection_evicted(self, client_mock):
+        client = self.mock_client(client_mock)
+        self.executor.idle_timeout = -1
+
+        self.executor.run('host1', ['/bin/true'])
+        self.executor.run('host2', ['/bin/true'])
+
+        client.close.assert_called_once()
+        self.assertEqual(['host2'], list(self.executor._connections.keys()))
+
+    @patch('transferpy.RemoteExecution.ParamikoExecution.paramiko.SSHClient')
+    def test_job(self, client_mock):
+        self.mock_client(client_mock, returncode=3)
+
+        job = self.executor.start_job('host', ['/bin/false'])
+        result = self.executor.wait_job('host', job)
+
+        self.assertEqual(3, result.returncode)
+        self.assertEqual(3, self.executor.monitor_job('host', job).returncode)
+
+    @patch('transferpy.RemoteExecution.ParamikoExecution.paramiko.SSHClient')
+    def test_close(self, client_mock):
+        client = self.mock_client(client_mock)
+
+        self.executor.run('host', ['/bin/true'])
+        self.executor.close()
+
+        client.close.assert_called_once()
+        self.assertEqual({}, self.executor._connections)
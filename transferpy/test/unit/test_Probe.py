@@ -0,0 +1,79 @@
+"""Tests for Probe class."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Probe import Probe, PROBE_SCRIPT
+from transferpy.RemoteScript import RemoteScript
+
+
+class TestProbe(unittest.TestCase):
+    """Test cases for Probe."""
+
+    def setUp(self):
+        self.executor = MagicMock()
+        self.probe = Probe(self.executor)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_script(self, arguments):
+        """Run the probe script locally, the way the remote host would."""
+        result = subprocess.run([sys.executable, '-', RemoteScript.encode(json.dumps(arguments))],
+                                input=PROBE_SCRIPT.encode('utf-8'), stdout=subprocess.PIPE)
+        self.assertEqual(0, result.returncode)
+        return json.loads(result.stdout.decode('utf-8'))
+
+    def test_command(self):
+        command = self.probe.command(['/srv'], sizes=['/srv'])
+
+        self.assertEqual('/bin/bash', command[0])
+        self.assertIn('/usr/bin/python3 -', command[-1])
+
+    def test_run(self):
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 0
+        self.executor.run.return_value.stdout = '{"paths": {}, "binaries": {"/bin/nc": true}}'
+
+        facts = self.probe.run('host', [], binaries=['/bin/nc'])
+
+        self.assertEqual('host', self.executor.run.call_args[0][0])
+        self.assertTrue(facts['binaries']['/bin/nc'])
+
+    def test_run_unavailable_host(self):
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 1
+        self.executor.run.return_value.stdout = None
+
+        self.assertIsNone(self.probe.run('host', ['/srv']))
+
+    def test_script(self):
+        empty_dir = os.path.join(self.directory, 'empty')
+        os.mkdir(empty_dir)
+        data_file = os.path.join(self.directory, 'file')
+        with open(data_file, 'wb') as f:
+            f.write(b'0' * 100)
+        missing = os.path.join(self.directory, 'missing')
+
+        facts = self.run_script({'paths': [self.directory, empty_dir, data_file, missing],
+                                 'sizes': [data_file], 'space': [self.directory],
+                                 'binaries': [sys.executable, 'no-such-binary'],
+                                 'headers': [data_file]})
+
+        self.assertTrue(facts['paths'][self.directory]['is_dir'])
+        self.assertFalse(facts['paths'][self.directory]['is_empty'])
+        self.assertGreater(facts['paths'][self.directory]['available'], 0)
+        self.assertTrue(facts['paths'][empty_dir]['is_empty'])
+        self.assertTrue(facts['paths'][data_file]['exists'])
+        self.assertFalse(facts['paths'][data_file]['is_dir'])
+        self.assertEqual(100, facts['paths'][data_file]['size'])
+        self.assertEqual('30' * 8, facts['paths'][data_file]['header'])
+        self.assertFalse(facts['paths'][missing]['exists'])
+        self.assertTrue(facts['binaries'][sys.executable])
+        self.assertFalse(facts['binaries']['no-such-binary'])
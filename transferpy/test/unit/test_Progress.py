@@ -0,0 +1,112 @@
+"""Tests for Progress class."""
+import io
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from transferpy.Progress import Progress, format_bytes
+
+
+class TestProgress(unittest.TestCase):
+    """Test cases for Progress."""
+
+    def setUp(self):
+        self.executor = MagicMock()
+        self.progress = Progress(self.executor, session='abc')
+
+    def run_locally(self, command):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        process = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]], stdout=subprocess.PIPE)
+        return MagicMock(returncode=process.returncode, stdout=process.stdout.decode())
+
+    def counters_result(self, counters):
+        return MagicMock(returncode=0, stdout=json.dumps(counters))
+
+    def test_format_bytes(self):
+        self.assertEqual('512.00 B', format_bytes(512))
+        self.assertEqual('1.50 MB', format_bytes(1500000))
+        self.assertEqual('2000.00 TB', format_bytes(2 * 10 ** 15))
+
+    def test_counter_command(self):
+        self.assertEqual('| /usr/bin/pv -f -n -b -i 1 2> /tmp/transferpy.abc.4400.sent.progress',
+                         self.progress.counter_command(4400, 'sent'))
+        self.assertNotEqual(Progress(self.executor).session, Progress(self.executor).session)
+
+    def test_read_counters(self):
+        """Test the counters are read from pv output, and removed if asked to"""
+        directory = tempfile.mkdtemp()
+        self.progress.counter_path = lambda port, name: os.path.join(directory, name)
+        for name, output in [('read', '0\n1024\n4096\n'), ('sent', '2048\n'), ('written', '')]:
+            with open(self.progress.counter_path(4400, name), 'w') as f:
+                f.write(output)
+        self.executor.run_each.side_effect = lambda commands: [self.run_locally(command)
+                                                               for _, command in commands]
+
+        # counters without output yet are 0
+        self.assertEqual((4096, 2048, [0]),
+                         self.progress.read_counters('source', 4400, [('target', 4400)]))
+        self.assertEqual(3, len(os.listdir(directory)))
+        self.assertEqual((4096, 2048, [0]),
+                         self.progress.read_counters('source', 4400, [('target', 4400)],
+                                                     remove=True))
+        self.assertEqual([], os.listdir(directory))
+        os.rmdir(directory)
+
+    def test_report(self):
+        """Test rates, percent and ETA are computed from the previous report"""
+        paths = [self.progress.counter_path(4400, name) for name in ['read', 'sent', 'written']]
+        self.executor.run_each.return_value = [
+            self.counters_result({paths[0]: 500, paths[1]: 200}),
+            self.counters_result({paths[2]: 400}),
+        ]
+        with patch('transferpy.Progress.time.monotonic') as mocked_monotonic:
+            mocked_monotonic.return_value = 100
+            self.progress.start(4400)
+            mocked_monotonic.return_value = 110
+            with self.assertLogs(self.progress.logger, 'INFO') as logs:
+                record = self.progress.report('source', 4400, [('target', 4400)], 1000)
+
+        self.assertEqual(50.0, record['percent'])
+        self.assertEqual(50, record['read_rate'])
+        self.assertEqual(20, record['sent_rate'])
+        self.assertEqual(10, record['eta'])
+        self.assertEqual([{'host': 'target', 'written': 400, 'written_rate': 40}],
+                         record['targets'])
+        self.assertIn('50.0%', logs.output[0])
+        self.assertIn('ETA 0:00:10', logs.output[0])
+
+        self.executor.run_each.return_value = [
+            self.counters_result({paths[0]: 1000, paths[1]: 400}),
+            self.counters_result({paths[2]: 1000}),
+        ]
+        self.progress.script = MagicMock(wraps=self.progress.script)
+        with patch('transferpy.Progress.time.monotonic') as mocked_monotonic:
+            mocked_monotonic.return_value = 120
+            with self.assertLogs(self.progress.logger, 'INFO') as logs:
+                record = self.progress.report('source', 4400, [('target', 4400)], 1000,
+                                              final=True)
+
+        # final reports are averages since the start, and remove the counters
+        self.assertEqual(50, record['read_rate'])
+        self.assertEqual(20, record['elapsed'])
+        self.assertIsNone(record['eta'])
+        self.assertTrue(all(c[0][0]['remove'] for c in self.progress.script.command.call_args_list))
+        self.assertIn('finished in 0:00:20', logs.output[0])
+
+    def test_write_json(self):
+        """Test reports are written as JSON lines to a file or the standard output"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'progress.json')
+            self.progress.json_file = path
+            self.progress.write_json({'read': 1})
+            self.progress.write_json({'read': 2})
+            with open(path) as f:
+                self.assertEqual([{'read': 1}, {'read': 2}], [json.loads(line) for line in f])
+
+        self.progress.json_file = '-'
+        with patch('transferpy.Progress.sys.stdout', new_callable=io.StringIO) as stdout:
+            self.progress.write_json({'read': 3})
+        self.assertEqual('{"read": 3}\n', stdout.getvalue())
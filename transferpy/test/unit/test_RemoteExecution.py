@@ -0,0 +1,242 @@
+"""Tests for RemoteExecution class."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.RemoteExecution.LocalExecution import LocalExecution
+from transferpy.RemoteExecution.RemoteExecution import (CommandReturn, CommandStream,
+                                                        RemoteExecution, ThreadJob)
+
+
+class EchoExecution(RemoteExecution):
+    """RemoteExecution returning the host and command it is given as stdout."""
+
+    def __init__(self):
+        self.calls = []
+
+    def run(self, host, command):
+        self.calls.append((host, command))
+        return CommandReturn(0, '{} {}'.format(host, command), None)
+
+    def start_job(self, host, command):
+        pass
+
+    def monitor_job(self, host, job):
+        pass
+
+    def kill_job(self, host, job):
+        pass
+
+    def wait_job(self, host, job):
+        pass
+
+
+class BarrierExecution(EchoExecution):
+    """EchoExecution whose commands wait for each other, running on ThreadJobs."""
+
+    def __init__(self, commands):
+        super().__init__()
+        self.barrier = threading.Barrier(commands, timeout=5)
+
+    def run(self, host, command):
+        self.barrier.wait()
+        return super().run(host, command)
+
+    def start_job(self, host, command):
+        return ThreadJob(lambda host, command, job: self.run(host, command), host, command)
+
+    def wait_job(self, host, job):
+        return job.wait()
+
+
+class TestRemoteExecution(unittest.TestCase):
+    """Test cases for RemoteExecution."""
+
+    def setUp(self):
+        self.executor = EchoExecution()
+
+    def test_run_many(self):
+        results = self.executor.run_many(['host1', 'host2', 'host1'], 'command')
+
+        self.assertEqual(['host1', 'host2'], list(results.keys()))
+        self.assertEqual('host2 command', results['host2'].stdout)
+        self.assertEqual(2, len(self.executor.calls))
+
+    def test_run_many_no_hosts(self):
+        self.assertEqual({}, self.executor.run_many([], 'command'))
+
+    def test_start_many(self):
+        job = self.executor.start_many(['host1', 'host2'], 'command')
+        results = self.executor.wait_many(job)
+
+        self.assertEqual('host1 command', results['host1'].stdout)
+        self.assertEqual('host2 command', results['host2'].stdout)
+
+    def test_run_each(self):
+        results = self.executor.run_each([('host1', ['a']), ('host2', ['b']),
+                                          ('host2', ['a']), ('host1', 'c')])
+
+        self.assertEqual(["host1 ['a']", "host2 ['b']", "host2 ['a']", 'host1 c'],
+                         [result.stdout for result in results])
+        self.assertEqual(4, len(self.executor.calls))
+
+    def test_run_each_async(self):
+        results = asyncio.run(self.executor.run_each_async([('host1', ['a']), ('host2', ['b']),
+                                                            ('host2', ['a'])]))
+
+        self.assertEqual(["host1 ['a']", "host2 ['b']", "host2 ['a']"],
+                         [result.stdout for result in results])
+        self.assertEqual(3, len(self.executor.calls))
+
+    @staticmethod
+    def gather_with_one_thread(coroutines):
+        """Gathers coroutines on a loop whose default executor has a single thread"""
+        async def run():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+            return await asyncio.gather(*coroutines)
+        return asyncio.run(run())
+
+    def test_run_async_concurrently(self):
+        """Test running commands do not hold a thread of the loop's default executor"""
+        executor = BarrierExecution(10)
+
+        results = self.gather_with_one_thread(
+            [executor.run_async('host{}'.format(i), 'command') for i in range(10)])
+
+        self.assertEqual([0] * 10, [result.returncode for result in results])
+        self.assertEqual('host9 command', results[9].stdout)
+
+    def test_wait_job_async_concurrently(self):
+        """Test waiting for ThreadJobs does not hold a thread of the loop's default executor"""
+        executor = BarrierExecution(2)
+
+        async def run_job(host):
+            job = await executor.start_job_async(host, 'command')
+            return await executor.wait_job_async(host, job)
+
+        async def run_short_call():
+            # the jobs still wait for the barrier while the short call runs
+            await asyncio.sleep(0.01)
+            loop = asyncio.get_running_loop()
+            await asyncio.wait_for(loop.run_in_executor(None, executor.run, 'host1', 'short'), 2)
+
+        results = self.gather_with_one_thread([run_job('host0'), run_short_call()])
+
+        self.assertEqual('host0 command', results[0].stdout)
+
+    def test_run_stream(self):
+        stream = self.executor.run_stream('host1', 'command')
+
+        self.assertEqual(['host1 command'], list(stream.lines()))
+        self.assertEqual(0, stream.wait().returncode)
+        self.assertEqual('', stream.stderr)
+
+    def test_local_run_stream(self):
+        stream = LocalExecution().run_stream(
+            'localhost', ['/bin/bash', '-c', 'seq 3; echo error >&2; exit 2'])
+
+        self.assertEqual(['1', '2', '3'], list(stream.lines()))
+        self.assertEqual('error\n', stream.stderr)
+        self.assertEqual(2, stream.returncode)
+
+    def test_local_run_async(self):
+        result = asyncio.run(LocalExecution().run_async('localhost', ['/bin/echo', 'test']))
+
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(b'test\n', result.stdout)
+
+
+class TestThreadJob(unittest.TestCase):
+    """Test cases for ThreadJob."""
+
+    def test_wait(self):
+        release = threading.Event()
+
+        def run(host, command, job):
+            release.wait()
+            return CommandReturn(0, '{} {}'.format(host, command), None)
+
+        job = ThreadJob(run, 'host', 'command')
+        self.assertIsNone(job.monitor().returncode)
+        release.set()
+
+        self.assertEqual('host command', job.wait().stdout)
+        self.assertEqual(0, job.monitor().returncode)
+
+    def test_kill(self):
+        stopped = threading.Event()
+
+        def run(host, command, job):
+            job.attach(stopped.set)
+            stopped.wait()
+            return CommandReturn(-1, None, None)
+
+        job = ThreadJob(run, 'host', 'command')
+        while job.stop is None:
+            job.done.wait(0.01)
+        job.kill()
+
+        self.assertEqual(-1, job.wait().returncode)
+
+    def test_killed_before_attach(self):
+        stop = MagicMock()
+        release = threading.Event()
+
+        def run(host, command, job):
+            release.wait()
+            job.attach(stop)
+            return CommandReturn(-1, None, None)
+
+        job = ThreadJob(run, 'host', 'command')
+        job.kill()
+        release.set()
+        job.wait()
+
+        stop.assert_called_once_with()
+
+    def test_failure(self):
+        def run(host, command, job):
+            raise OSError('failed')
+
+        self.assertEqual(-1, ThreadJob(run, 'host', 'command').wait().returncode)
+
+
+class TestCommandStream(unittest.TestCase):
+    """Test cases for CommandStream."""
+
+    def test_read_while_running(self):
+        stream = CommandStream(chunk_size=4)
+        lines = stream.lines()
+        stream.write('stdout', b'first\nsec')
+
+        self.assertEqual('first', next(lines))
+        self.assertIsNone(stream.returncode)
+        stream.write('stdout', b'ond\nlast')
+        stream.finish(0)
+
+        self.assertEqual(['second', 'last'], list(lines))
+        self.assertEqual([b'firs', b't\nse', b'cond', b'\nlas', b't'], list(stream.chunks()))
+        self.assertEqual('first\nsecond\nlast', stream.stdout)
+
+    def test_spooling(self):
+        """Test big outputs are moved to disk"""
+        stream = CommandStream(memory_limit=1024)
+        stream.write('stdout', b'x' * 1000)
+        self.assertFalse(stream._files['stdout']._rolled)
+        stream.write('stdout', b'x' * 1000)
+        stream.finish(0)
+
+        self.assertTrue(stream._files['stdout']._rolled)
+        self.assertEqual(b'x' * 2000, stream.read('stdout'))
+        stream.close()
+
+    def test_follow(self):
+        outputs = {'stdout': [b'a', b'b', b''], 'stderr': [b'error', b'']}
+        stream = CommandStream().follow({name: iter(output).__next__
+                                         for name, output in outputs.items()}, lambda: 3)
+
+        self.assertEqual(b'ab', stream.read('stdout'))
+        self.assertEqual('error', stream.stderr)
+        self.assertEqual(3, stream.returncode)
@@ -0,0 +1,41 @@
+"""Tests for SSHExecution class."""
+import os
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.RemoteExecution.SSHExecution import SSHExecution
+
+
+class TestSSHExecution(unittest.TestCase):
+    """Test cases for SSHExecution."""
+
+    def test_get_ssh_command(self):
+        executor = SSHExecution()
+
+        command = executor.get_ssh_command('host', ['/bin/ls', '/srv path'])
+
+        self.assertEqual(['/usr/bin/ssh', '-p', '22', 'root@host', "/bin/ls '/srv path'"], command)
+
+    def test_get_ssh_command_multiplexed(self):
+        executor = SSHExecution(multiplex=True, control_dir='/run/transferpy')
+
+        command = executor.get_ssh_command('host', ['/bin/true'])
+
+        self.assertIn('ControlMaster=auto', command)
+        self.assertIn('ControlPath=/run/transferpy/%C', command)
+        self.assertEqual('root@host', command[-2])
+
+    def test_close(self):
+        executor = SSHExecution(multiplex=True)
+        executor.localExecution = MagicMock()
+        executor.run('host1', ['/bin/true'])
+        executor.start_job('host2', ['/bin/true'])
+        control_dir = executor.control_dir
+        self.assertTrue(os.path.isdir(control_dir))
+
+        executor.close()
+
+        exit_commands = [c[0][1] for c in executor.localExecution.run.call_args_list
+                         if '-O' in c[0][1]]
+        self.assertEqual(['root@host1', 'root@host2'], [c[-1] for c in exit_commands])
+        self.assertFalse(os.path.exists(control_dir))
@@ -0,0 +1,77 @@
+"""Tests for Sharder class."""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Sharding import Sharder
+
+
+class TestSharder(unittest.TestCase):
+    """Test cases for Sharder."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'data', 'db', 'empty'))
+        self.sizes = {'data/a': 9000, 'data/db/b': 5000, 'data/db/c': 4000, 'data/d': 1000}
+        for name, size in self.sizes.items():
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(b'x' * size)
+        os.symlink('a', os.path.join(self.directory, 'data', 'link'))
+        self.executor = MagicMock()
+        self.executor.run.side_effect = self.run_locally
+        self.sharder = Sharder(self.executor)
+
+    def tearDown(self):
+        for i in range(4):
+            if os.path.exists(self.sharder.list_path(i)):
+                os.remove(self.sharder.list_path(i))
+        shutil.rmtree(self.directory)
+
+    def run_locally(self, host, command):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        process = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]], stdout=subprocess.PIPE)
+        return MagicMock(returncode=process.returncode, stdout=process.stdout.decode())
+
+    def read_list(self, shard):
+        with open(shard['list'], 'rb') as f:
+            return f.read().decode().split('\0')[:-1]
+
+    def test_run(self):
+        """Test the files are balanced by size, largest first"""
+        shards = self.sharder.run('source', os.path.join(self.directory, 'data'), 2)
+
+        self.assertEqual([(2, 10000), (2, 9000)],
+                         [(shard['files'], shard['size']) for shard in shards])
+        self.assertEqual(['data', 'data/link', 'data/db', 'data/db/empty', 'data/a', 'data/d'],
+                         self.read_list(shards[0]))
+        self.assertEqual(['data/db/b', 'data/db/c'], self.read_list(shards[1]))
+
+    def test_run_more_shards_than_files(self):
+        shards = self.sharder.run('source', os.path.join(self.directory, 'data', 'db'), 4)
+
+        self.assertEqual([1, 1], [shard['files'] for shard in shards])
+        self.assertEqual(['db', 'db/empty', 'db/b'], self.read_list(shards[0]))
+
+    def test_tar_shards(self):
+        """Test the shards, extracted in the same directory, rebuild the tree"""
+        shards = self.sharder.run('source', os.path.join(self.directory, 'data'), 3)
+        target = os.path.join(self.directory, 'target')
+        os.mkdir(target)
+        for shard in shards:
+            command = 'cd {} && {} | /bin/tar xf - -C {}'.format(
+                self.directory, self.sharder.tar_command(shard['list']), target)
+            self.assertEqual(0, subprocess.run(['/bin/bash', '-c', command]).returncode)
+
+        for name, size in self.sizes.items():
+            self.assertEqual(size, os.path.getsize(os.path.join(target, name)))
+        self.assertTrue(os.path.isdir(os.path.join(target, 'data', 'db', 'empty')))
+        self.assertEqual('a', os.readlink(os.path.join(target, 'data', 'link')))
+
+        self.assertEqual(['/bin/rm', '-f'] + [shard['list'] for shard in shards],
+                         self.sharder.cleanup_command(shards))
+
+    def test_run_failing(self):
+        self.assertIsNone(self.sharder.run('source', os.path.join(self.directory, 'missing'), 2))
@@ -0,0 +1,117 @@
+"""Tests for Syncer class."""
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from transferpy.Sync import Syncer
+
+
+class TestSyncer(unittest.TestCase):
+    """Test cases for Syncer."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.syncer = Syncer(MagicMock())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_shell(self, command):
+        """Run locally a command built for a remote host, without its outer quotes."""
+        process = subprocess.run(['/bin/bash', '-c', command[-1][1:-1]], stdout=subprocess.PIPE)
+        return MagicMock(returncode=process.returncode, stdout=process.stdout.decode())
+
+    def write(self, path, content, mtime=1000):
+        with open(path, 'wb') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def list_tree(self, path, checksum=False):
+        return self.syncer.parse_list(self.run_shell(self.syncer.list_command(path, checksum)))
+
+    def make_trees(self):
+        """Make a source tree, and a stale copy of it."""
+        source = os.path.join(self.directory, 'source', 'data')
+        target = os.path.join(self.directory, 'target', 'data')
+        for tree in [source, target]:
+            os.makedirs(os.path.join(tree, 'db'))
+        for name, content in [('a', b'a'), ('db/b', b'bb'), ('db/c', b'c')]:
+            self.write(os.path.join(source, name), content)
+        os.symlink('a', os.path.join(source, 'link'))
+        # a is up to date, b was left half written, c is missing, and the copy
+        # has an extra file, an extra tree and a file where the source has a link
+        shutil.copy2(os.path.join(source, 'a'), os.path.join(target, 'a'))
+        self.write(os.path.join(target, 'db', 'b'), b'b')
+        self.write(os.path.join(target, 'old'), b'old')
+        os.makedirs(os.path.join(target, 'tmp', 'nested'))
+        self.write(os.path.join(target, 'link'), b'file')
+        return source, target
+
+    def test_list(self):
+        source, _ = self.make_trees()
+
+        source_list = self.list_tree(source)
+        self.assertEqual({'data/a': [1, 1000], 'data/db/b': [2, 1000], 'data/db/c': [1, 1000]},
+                         source_list['files'])
+        self.assertEqual(['data', 'data/db'], source_list['dirs'])
+        self.assertEqual(['data/link'], source_list['others'])
+        self.assertEqual(hashlib.md5(b'bb').hexdigest(),
+                         self.list_tree(source, checksum=True)['files']['data/db/b'][2])
+        self.assertIsNone(self.list_tree(os.path.join(self.directory, 'missing')))
+
+    def test_changed_entries(self):
+        """Test only the files not on the copy with the same size and time are sent"""
+        source, target = self.make_trees()
+
+        self.assertEqual(['data', 'data/db', 'data/link', 'data/db/b', 'data/db/c'],
+                         Syncer.changed_entries(self.list_tree(source), self.list_tree(target)))
+
+        # files with the same content are not sent when comparing checksums
+        self.write(os.path.join(source, 'a'), b'a', mtime=2000)
+        self.assertIn('data/a', Syncer.changed_entries(self.list_tree(source),
+                                                       self.list_tree(target)))
+        self.assertNotIn('data/a', Syncer.changed_entries(self.list_tree(source, True),
+                                                          self.list_tree(target, True), True))
+
+    def test_extra_entries_and_remove(self):
+        """Test the entries not on the source, or of another kind, are removed"""
+        source, target = self.make_trees()
+
+        extra = Syncer.extra_entries(self.list_tree(source), self.list_tree(target))
+        self.assertEqual(['data/link', 'data/old', 'data/tmp'], extra)
+        for command in self.syncer.remove_commands(os.path.dirname(target), extra):
+            self.assertEqual(0, self.run_shell(command).returncode)
+        self.assertEqual(['a', 'db'], sorted(os.listdir(target)))
+        self.assertEqual([], self.syncer.remove_commands(target, []))
+
+    def test_write_list_commands(self):
+        """Test long lists are written in chunks, appended to the same file"""
+        path = os.path.join(self.directory, 'list')
+        entries = ['data/{}'.format(i) for i in range(5)]
+        # room for two entries per command
+        self.syncer.chunk_size = len(self.syncer.write_list_commands(path, [])[0][-1]) + 40
+
+        commands = self.syncer.write_list_commands(path, entries)
+        self.assertEqual(3, len(commands))
+        for command in commands:
+            self.assertEqual(0, self.run_shell(command).returncode)
+        with open(path, 'rb') as f:
+            self.assertEqual(entries, f.read().decode().split('\0')[:-1])
+
+    def test_commands_fit_in_an_argument(self):
+        """Test long lists of non-ASCII paths are split in commands under the argument size limit"""
+        path = os.path.join(self.directory, 'list')
+        entries = ['data/数据库/表_{:06d}_データ.ibd'.format(i) for i in range(20000)]
+
+        commands = self.syncer.write_list_commands(path, entries)
+        self.assertGreater(len(commands), 1)
+        for command in commands + self.syncer.remove_commands(self.directory, entries):
+            self.assertLess(len(command[-1].encode('utf-8')), 128 * 1024)
+        for command in commands:
+            self.assertEqual(0, self.run_shell(command).returncode)
+        with open(path, 'rb') as f:
+            self.assertEqual(entries, f.read().decode().split('\0')[:-1])
@@ -1,8 +1,11 @@
 """Tests for transfer.py class."""
+import json
 import sys
 import unittest
 from unittest.mock import patch, MagicMock
 
+from transferpy.Manifest import Manifest
+from transferpy.RemoteExecution.RemoteExecution import CommandStream
 from transferpy.transfer import option_parse
 from transferpy.Transferer import Transferer
 
@@ -22,6 +25,23 @@ class TestTransferer(unittest.TestCase):
                                      ['target'], ['path'],
                                      self.options)
 
+    @staticmethod
+    def stream_result(returncode, stdout):
+        """Returns a finished CommandStream with the given output"""
+        stream = CommandStream()
+        stream.write('stdout', stdout.encode('utf-8'))
+        stream.finish(returncode)
+        return stream
+
+    def test_session(self):
+        """Test all the temporary files of a transfer are named after its session"""
+        session = self.transferer.session
+        self.assertEqual(12, len(session))
+        for helper in [self.transferer.progress, self.transferer.sharder,
+                       self.transferer.bandwidth_limiter, self.transferer.inline_hasher,
+                       self.transferer.firewall('target')]:
+            self.assertEqual(session, helper.session)
+
     def test_run_command(self):
         self.transferer.run_command('host', 'command')
 
@@ -43,23 +63,22 @@ class TestTransferer(unittest.TestCase):
 
     def test_calculate_checksum_for_dir(self):
         self.transferer.source_is_dir = True
-        self.executor.run.return_value = MagicMock()
-        self.executor.run.return_value.returncode = 0
+        self.executor.run_stream.return_value = self.stream_result(0, 'path/a\t1\td1\n')
 
-        self.transferer.calculate_checksum('host', 'path')
+        checksum = self.transferer.calculate_checksum('host', 'path')
 
-        args = self.executor.run.call_args[0]
+        self.assertEqual(['path/a'], [entry.path for entry in checksum])
+        args = self.executor.run_stream.call_args[0]
         self.assertIn('find', args[1][-1])
         self.assertIn('md5sum', args[1][-1])
 
     def test_calculate_checksum_for_file(self):
         self.transferer.source_is_dir = False
-        self.executor.run.return_value = MagicMock()
-        self.executor.run.return_value.returncode = 0
+        self.executor.run_stream.return_value = self.stream_result(0, '')
 
         self.transferer.calculate_checksum('host', 'path')
 
-        args = self.executor.run.call_args[0]
+        args = self.executor.run_stream.call_args[0]
         self.assertNotIn('find', args[1][-1])
         self.assertIn('md5sum', args[1][-1])
 
@@ -84,6 +103,256 @@ class TestTransferer(unittest.TestCase):
 
         self.assertEqual(size, result)
 
+    def path_facts(self, exists=True, is_dir=False, size=None, available=None, is_empty=None):
+        return {'exists': exists, 'is_dir': is_dir, 'is_socket': False, 'is_empty': is_empty,
+                'size': size, 'available': available}
+
+    def all_binaries(self, present=True):
+        return {binary: present for binary in (self.transferer.source_binaries +
+                                               self.transferer.target_binaries +
+                                               self.transferer.optional_binaries)}
+
+    def test_sanity_checks(self):
+        self.options.update({'type': 'file', 'compress': True, 'encrypt': True,
+                             'checksum': False, 'chain': False})
+        source_facts = {'paths': {'path': self.path_facts(is_dir=True, size=100)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000),
+                                  'path/path': self.path_facts(exists=False)},
+                        'binaries': self.all_binaries()}
+        target_result = MagicMock()
+        target_result.returncode = 0
+        target_result.stdout = json.dumps(target_facts)
+        self.executor.run_each.return_value = [target_result]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            self.transferer.sanity_checks()
+
+        # one probe for the source, one batch for all targets
+        mocked_probe.assert_called_once()
+        self.assertEqual(['target'], [host for host, _ in self.executor.run_each.call_args[0][0]])
+        self.assertEqual(100, self.transferer.original_size)
+        self.assertTrue(self.transferer.source_is_dir)
+        self.assertEqual({'target': 'ipset'}, self.transferer.firewall_backends)
+
+        # targets without ipset fall back to iptables
+        target_facts['binaries']['/sbin/ipset'] = False
+        target_result.stdout = json.dumps(target_facts)
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            self.transferer.sanity_checks()
+        self.assertEqual({'target': 'iptables'}, self.transferer.firewall_backends)
+
+    def resume_facts(self, checkpoint_exists=True):
+        """Return the source facts, and the target result, of a partial copy of a file."""
+        source_facts = {'paths': {'path': self.path_facts(size=1000)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=500),
+                                  'path/path': self.path_facts(size=600),
+                                  'path/.path.transferpy-checkpoint':
+                                      self.path_facts(exists=checkpoint_exists)},
+                        'binaries': self.all_binaries()}
+        return source_facts, MagicMock(returncode=0, stdout=json.dumps(target_facts))
+
+    def test_sanity_checks_resume_file(self):
+        """Test a partial copy of a file resumes after its checkpoint if a sample matches"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'chain': False, 'resume': True})
+        source_facts, target_result = self.resume_facts()
+        checkpoint = MagicMock(returncode=0, stdout=json.dumps(
+            {'source_host': 'source', 'source_path': 'path', 'size': 1000, 'written': 600}))
+        digest = MagicMock(returncode=0, stdout='"abc"')
+        self.executor.run_each.side_effect = [[target_result], [checkpoint], [digest, digest]]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            self.transferer.sanity_checks()
+
+        self.assertEqual({('target', 'path'): {'offset': 600}}, self.transferer.resume_points)
+        hash_commands = self.executor.run_each.call_args[0][0]
+        self.assertEqual(['source', 'target'], [host for host, _ in hash_commands])
+        self.assertEqual('/bin/dd if=path bs=1048576 skip=600 count=400 '
+                         'iflag=skip_bytes,count_bytes status=none | /bin/nc -q 0 -w 300 target 4400',
+                         self.transferer.sender_command('target', 4400, {'offset': 600})[-1][1:-1])
+
+        # a sample that does not match restarts the copy
+        self.executor.run_each.side_effect = [[target_result], [checkpoint],
+                                              [digest, MagicMock(returncode=0, stdout='"def"')]]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertLogs(self.transferer.logger, 'WARNING'):
+                self.transferer.sanity_checks()
+        self.assertEqual({('target', 'path'): {'offset': 0}}, self.transferer.resume_points)
+
+    def test_sanity_checks_resume_without_checkpoint(self):
+        """Test an existing copy without checkpoint is never overwritten"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'chain': False, 'resume': True})
+        source_facts, target_result = self.resume_facts(checkpoint_exists=False)
+        self.executor.run_each.return_value = [target_result]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertRaises(ValueError):
+                self.transferer.sanity_checks()
+
+        self.options['resume'] = False
+        with self.assertRaises(ValueError):
+            Transferer('source', 'path', ['target'], ['path'],
+                       dict(self.options, type='xtrabackup', resume=True)).sanity_checks()
+
+    def test_receiver_command_resume(self):
+        """Test resumable copies of a file are written by the checkpoint writer"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'resume': True})
+        self.transferer.original_size = 1000
+
+        command = self.transferer.receiver_command('path', 4400, resume_point={'offset': 600})[-1]
+        self.assertIn('/bin/nc -l -w 300 -p 4400 | /usr/bin/python3 -c', command)
+        self.assertNotIn('>', command)
+
+    def test_prepare_directory_resume(self):
+        """Test a resumed directory copy sends a tar of the files not fully copied"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'resume': True})
+        self.transferer.source_is_dir = True
+        self.transferer.resumable_targets = {('target', 'path')}
+        checkpoint = MagicMock(returncode=0, stdout=json.dumps(
+            {'source_host': 'source', 'source_path': 'path', 'size': 3, 'written': 0}))
+        source_list = {'files': {'path/a': [1, 10], 'path/b': [2, 10]}, 'dirs': ['path'],
+                       'others': []}
+        target_list = {'files': {'path/a': [1, 10], 'path/b': [1, 20]}, 'dirs': ['path'],
+                       'others': []}
+        self.executor.run_each.side_effect = [
+            [checkpoint],
+            [MagicMock(returncode=0, stdout=json.dumps(source_list)),
+             MagicMock(returncode=0, stdout=json.dumps(target_list))],
+            [MagicMock(returncode=0)]]
+        self.executor.run.return_value = MagicMock(returncode=0)
+        with self.assertLogs(self.transferer.logger, 'INFO') as logs:
+            self.transferer.prepare_resume()
+
+        list_path = self.transferer.resume_points[('target', 'path')]['list']
+        self.assertIn('Sending to target 1 of 2 files', logs.output[0])
+        self.assertIn('--no-recursion --null -T {}'.format(list_path),
+                      self.transferer.sender_command('target', 4400,
+                                                     self.transferer.resume_points[('target',
+                                                                                    'path')])[-1])
+        # the checkpoint is written before the copy
+        self.assertIn('path/.path.transferpy-checkpoint',
+                      self.executor.run_each.call_args[0][0][0][1][-1])
+
+        self.executor.run_each.side_effect = None
+        self.transferer.finish_resume([('target', 'path')], [0])
+        self.assertEqual([('target', ['/bin/rm', '-f', 'path/.path.transferpy-checkpoint',
+                                      'path/.path.transferpy-checkpoint.tmp'])],
+                         self.executor.run_each.call_args[0][0])
+        self.transferer.remove_sync_lists()
+        self.executor.run.assert_called_with('source', ['/bin/rm', '-f', list_path])
+
+    def test_sanity_checks_sync(self):
+        """Test an existing copy of a directory is synced, and one of another kind refused"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'chain': True, 'sync': True})
+        source_facts = {'paths': {'path': self.path_facts(is_dir=True, size=1000)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=500),
+                                  'path/path': self.path_facts(is_dir=True, size=900)},
+                        'binaries': self.all_binaries()}
+        self.executor.run_each.return_value = [MagicMock(returncode=0,
+                                                         stdout=json.dumps(target_facts))]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe, \
+                patch.object(self.transferer, 'prepare_directory_sync') as mocked_sync:
+            mocked_probe.return_value = source_facts
+            with self.assertLogs(self.transferer.logger, 'WARNING'):
+                self.transferer.sanity_checks()
+
+        # only the changes need space, and chains cannot send different changes
+        mocked_sync.assert_called_once_with([('target', 'path')], False, False)
+        self.assertFalse(self.options['chain'])
+
+        target_facts['paths']['path/path'] = self.path_facts(size=900)
+        self.executor.run_each.return_value = [MagicMock(returncode=0,
+                                                         stdout=json.dumps(target_facts))]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertRaises(ValueError):
+                self.transferer.sanity_checks()
+
+        self.options['resume'] = True
+        with self.assertRaises(ValueError):
+            self.transferer.sanity_checks()
+
+    def test_prepare_directory_sync(self):
+        """Test a sync sends the changed files, and removes the extra ones if asked to"""
+        self.options.update({'type': 'file', 'sync': True, 'sync_delete': True})
+        source_list = {'files': {'path/a': [1, 10], 'path/b': [2, 10]}, 'dirs': ['path'],
+                       'others': []}
+        target_list = {'files': {'path/a': [1, 10], 'path/b': [2, 10], 'path/c': [3, 10]},
+                       'dirs': ['path'], 'others': []}
+        self.executor.run_each.return_value = [
+            MagicMock(returncode=0, stdout=json.dumps(source_list)),
+            MagicMock(returncode=0, stdout=json.dumps(target_list))]
+        self.executor.run.return_value = MagicMock(returncode=0)
+        with self.assertLogs(self.transferer.logger, 'INFO') as logs:
+            self.transferer.prepare_directory_sync([('target', 'path')], delete=True)
+
+        self.assertIn('Sending to target 0 of 2 files', logs.output[0])
+        self.assertIn('1 entries not on the source were removed from target', logs.output[1])
+        self.assertEqual('target', self.executor.run.call_args_list[0][0][0])
+        self.assertEqual('source', self.executor.run.call_args_list[1][0][0])
+        self.assertIn('list', self.transferer.resume_points[('target', 'path')])
+
+        # extra files are not checksum errors unless they are deleted
+        source_checksum = MagicMock()
+        source_checksum.compare.return_value = [('extra', 'path/c')]
+        self.assertFalse(self.transferer.compare_checksums(source_checksum, None, 'target'))
+        self.options['sync_delete'] = False
+        self.assertTrue(self.transferer.compare_checksums(source_checksum, None, 'target'))
+
+    def test_sanity_checks_checksum_algorithm(self):
+        """Test the fastest checksum algorithm available on all hosts is chosen"""
+        self.options.update({'type': 'file', 'compress': True, 'encrypt': True,
+                             'checksum': True, 'checksum_algorithm': 'auto', 'chain': False})
+        source_facts = {'paths': {'path': self.path_facts(is_dir=True, size=100)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000),
+                                  'path/path': self.path_facts(exists=False)},
+                        'binaries': self.all_binaries()}
+        target_facts['binaries']['/usr/bin/xxh128sum'] = False
+        target_result = MagicMock()
+        target_result.returncode = 0
+        target_result.stdout = json.dumps(target_facts)
+        self.executor.run_each.return_value = [target_result]
+        self.executor.run_stream.return_value = self.stream_result(0, '')
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            self.transferer.sanity_checks()
+
+        self.assertEqual('blake3', self.transferer.checksum_algorithm)
+        self.assertIn('b3sum', self.executor.run_stream.call_args[0][1][-1])
+
+    def test_sanity_checks_failing(self):
+        self.options.update({'type': 'file', 'compress': True, 'encrypt': True,
+                             'checksum': False, 'chain': False})
+        source_facts = {'paths': {'path': self.path_facts(size=100)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000),
+                                  'path/path': self.path_facts(exists=True)},
+                        'binaries': self.all_binaries()}
+        target_result = MagicMock()
+        target_result.returncode = 0
+        target_result.stdout = json.dumps(target_facts)
+        self.executor.run_each.return_value = [target_result]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertRaisesRegex(ValueError, 'already exists'):
+                self.transferer.sanity_checks()
+
+        source_facts['binaries']['/bin/nc'] = False
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertRaisesRegex(ValueError, 'missing on source'):
+                self.transferer.sanity_checks()
+
     def test_compress_command_compressing(self):
         self.options['compress'] = True
 
@@ -101,6 +370,80 @@ class TestTransferer(unittest.TestCase):
         command = self.transferer.compress_command
         self.assertIn('cat', command)
 
+    def test_compress_command_zstd(self):
+        self.options.update({'compress': True, 'compressor': 'zstd', 'compress_level': 3,
+                             'encrypt': False, 'checksum': False, 'chain': False})
+        self.transferer.source_is_dir = True
+
+        self.assertEqual('| /usr/bin/zstd -c -3 -T0 -q', self.transferer.compress_command)
+        self.assertEqual('| /usr/bin/zstd -c -d -q', self.transferer.decompress_command)
+        self.assertIn('/usr/bin/zstd', self.transferer.target_binaries)
+
+    def test_sanity_checks_auto_compression(self):
+        """Test the compression is chosen from a sample of the source"""
+        self.options.update({'type': 'file', 'compress': True, 'compressor': 'auto',
+                             'encrypt': False, 'checksum': False, 'chain': False})
+        source_facts = {'paths': {'path': self.path_facts(is_dir=True, size=100)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000),
+                                  'path/path': self.path_facts(exists=False)},
+                        'binaries': self.all_binaries()}
+        target_facts['binaries']['/usr/bin/lz4'] = False
+        target_result = MagicMock()
+        target_result.returncode = 0
+        target_result.stdout = json.dumps(target_facts)
+        self.executor.run_each.return_value = [target_result]
+        sample = {'sampled': 1000 * 1000, 'cores': 8,
+                  'results': {'zstd:1': {'size': 300 * 1000, 'seconds': 0.001}}}
+        with patch.object(self.transferer.probe, 'run') as mocked_probe, \
+                patch.object(self.transferer.compression_sampler, 'run') as mocked_sampler:
+            mocked_probe.return_value = source_facts
+            mocked_sampler.return_value = sample
+            self.transferer.sanity_checks()
+
+        mocked_sampler.assert_called_once_with('source', 'path', ['pigz', 'zstd'])
+        self.assertTrue(self.options['compress'])
+        self.assertEqual('| /usr/bin/zstd -c -1 -T0 -q', self.transferer.compress_command)
+
+        sample['results']['zstd:1']['size'] = 990 * 1000
+        with patch.object(self.transferer.probe, 'run') as mocked_probe, \
+                patch.object(self.transferer.compression_sampler, 'run') as mocked_sampler:
+            mocked_probe.return_value = source_facts
+            mocked_sampler.return_value = sample
+            with self.assertLogs(self.transferer.logger, 'INFO') as logs:
+                self.transferer.sanity_checks()
+
+        self.assertFalse(self.options['compress'])
+        self.assertIn('Compression disabled: the data does not compress', '\n'.join(logs.output))
+
+    def test_sanity_checks_decompress_detects_compressor(self):
+        """Test decompress mode uses the codec of the archive on the targets"""
+        self.options.update({'type': 'decompress', 'compress': True, 'encrypt': False,
+                             'checksum': False, 'chain': False})
+        source_facts = {'paths': {'path': self.path_facts(size=100)},
+                        'binaries': self.all_binaries()}
+        source_facts['paths']['path']['header'] = '28b52ffd00000000'
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000,
+                                                          is_empty=True),
+                                  'path/path': self.path_facts(exists=False)},
+                        'binaries': dict(self.all_binaries(), **{'/usr/bin/zstd': True})}
+        target_result = MagicMock()
+        target_result.returncode = 0
+        target_result.stdout = json.dumps(target_facts)
+        self.executor.run_each.return_value = [target_result]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            self.transferer.sanity_checks()
+
+        self.assertEqual(['path'], mocked_probe.call_args[1]['headers'])
+        self.assertEqual('| /usr/bin/zstd -c -d -q', self.transferer.decompress_command)
+
+        source_facts['paths']['path']['header'] = '0000000000000000'
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertRaisesRegex(ValueError, 'compression format'):
+                self.transferer.sanity_checks()
+
     def test_decompress_command_compressing(self):
         self.options['compress'] = True
 
@@ -142,26 +485,26 @@ class TestTransferer(unittest.TestCase):
         with patch.object(Transferer, 'sanity_checks') as mocked_sanity_check:
             mocked_sanity_check.side_effect = ValueError('Test sanity_checks')
             command = self.transferer.run()
-            self.assertTrue(type(command) == list)
+            self.assertIsInstance(command, list)
 
     def test_run_stoping_slave(self):
         """Test case for Transferer.run function which provides stop_slave option"""
-        with patch.object(Transferer, 'sanity_checks') as mocked_sanity_check,\
+        with patch.object(Transferer, 'sanity_checks') as mocked_sanity_check, \
                 patch('transferpy.Transferer.MariaDB.stop_replication') as mocked_stop_replication:
             self.options['stop_slave'] = True
             #  Return value should be anything other than 0 for the if block to execute
             mocked_stop_replication.return_value = 1
             mocked_sanity_check.called_once()
             command = self.transferer.run()
-            self.assertTrue(type(command) == list)
+            self.assertIsInstance(command, list)
 
     def test_run_successfully(self):
         """Test case for Transferer.run function starting transfer successfully"""
-        with patch.object(Transferer, 'sanity_checks') as mocked_sanity_check,\
-                patch('transferpy.Transferer.Firewall.open') as mocked_open_firewall,\
-                patch.object(Transferer, 'copy_to') as mocked_copy_to,\
-                patch('transferpy.Transferer.Firewall.close') as mocked_close_firewall,\
-                patch.object(Transferer, 'after_transfer_checks') as mocked_after_transfer_checks,\
+        with patch.object(Transferer, 'sanity_checks') as mocked_sanity_check, \
+                patch('transferpy.Transferer.Firewall.open') as mocked_open_firewall, \
+                patch.object(Transferer, 'copy_to') as mocked_copy_to, \
+                patch('transferpy.Transferer.Firewall.close') as mocked_close_firewall, \
+                patch.object(Transferer, 'after_transfer_checks') as mocked_after_transfer_checks, \
                 patch('transferpy.Transferer.MariaDB.start_replication') as mocked_start_replication:
             self.options['port'] = 4444
             mocked_copy_to.return_value = 0
@@ -171,18 +514,614 @@ class TestTransferer(unittest.TestCase):
             mocked_sanity_check.called_once()
             mocked_open_firewall.called_once()
             command = self.transferer.run()
-            self.assertTrue(type(command) == list)
+            self.assertIsInstance(command, list)
+
+    def test_run_parallel_targets(self):
+        """Test case for Transferer.run function copying to several targets at once"""
+        self.transferer.target_hosts = ['target1', 'target2', 'target3']
+        self.transferer.target_paths = ['path1', 'path2', 'path3']
+        self.options['parallel_targets'] = 0
+        with patch.object(Transferer, 'sanity_checks'), \
+                patch.object(Transferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(Transferer, 'close_firewalls'), \
+                patch.object(Transferer, 'copy_to') as mocked_copy_to, \
+                patch.object(Transferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [4400, 4401, 4402]
+            mocked_copy_to.side_effect = lambda host, path, port: int(host[-1])
+            mocked_verify_targets.side_effect = lambda results, targets, *ports: results
+            command = self.transferer.run()
+        self.assertEqual([1, 2, 3], command)
+        mocked_copy_to.assert_any_call('target3', 'path3', 4402)
+
+    def test_run_copy_raising(self):
+        """Test case for Transferer.run function closing the firewalls if a copy raises"""
+        with patch.object(Transferer, 'sanity_checks'), \
+                patch.object(Transferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(Transferer, 'close_firewalls') as mocked_close_firewalls, \
+                patch.object(Transferer, 'remove_sync_lists') as mocked_remove_sync_lists, \
+                patch.object(Transferer, 'copy_to') as mocked_copy_to:
+            mocked_open_firewalls.return_value = [4400]
+            mocked_copy_to.side_effect = Exception('Test copy_to')
+            with self.assertRaises(Exception):
+                self.transferer.run()
+
+        mocked_close_firewalls.assert_called_once_with([('target', 'source')], [4400])
+        mocked_remove_sync_lists.assert_called_once()
+        self.executor.close.assert_called_once()
+
+    def test_open_firewalls(self):
+        """Test open_firewalls leases all the ports of a host at once, and opens them"""
+        self.options['port'] = 0
+        open_result = MagicMock(returncode=0)
+        self.executor.run_each.side_effect = [
+            [MagicMock(returncode=0, stdout='[4401, 4402]'),
+             MagicMock(returncode=0, stdout='[4401]')],
+            [open_result] * 3]
+
+        ports = self.transferer.open_firewalls([('target1', 'source'), ('target1', 'source'),
+                                                ('target2', 'source')])
+
+        self.assertEqual([4401, 4402, 4401], ports)
+        lease_commands = self.executor.run_each.call_args_list[0][0][0]
+        self.assertEqual(['target1', 'target2'], [host for host, _ in lease_commands])
+        commands = self.executor.run_each.call_args[0][0]
+        self.assertEqual(['target1', 'target1', 'target2'], [host for host, _ in commands])
+        self.assertIn('4402', commands[1][1])
+
+        # the leases are released when the ports are closed
+        self.executor.run_each.side_effect = None
+        self.executor.run_each.return_value = [open_result] * 3
+        self.transferer.close_firewalls([('target1', 'source'), ('target1', 'source'),
+                                         ('target2', 'source')], ports)
+        self.assertEqual(['target1', 'target2'],
+                         [host for host, _ in self.executor.run_each.call_args[0][0]])
+
+    def test_open_firewalls_no_free_ports(self):
+        """Test open_firewalls raises if a host has not enough free ports"""
+        self.options['port'] = 0
+        self.executor.run_each.return_value = [MagicMock(returncode=1, stdout='')]
+
+        with self.assertRaises(ValueError):
+            self.transferer.open_firewalls([('target1', 'source')])
+
+    def test_open_firewalls_releases_partial_leases(self):
+        """Test open_firewalls releases the ports leased on other hosts if a lease fails"""
+        self.options['port'] = 0
+        self.executor.run_each.side_effect = [
+            [MagicMock(returncode=0, stdout='[4401]'), MagicMock(returncode=1, stdout='')],
+            [MagicMock(returncode=0)]]
+
+        with self.assertRaises(ValueError), \
+                patch('transferpy.Transferer.Firewall.release_command') as mocked_release_command:
+            self.transferer.open_firewalls([('target1', 'source'), ('target2', 'source')])
+
+        release_commands = self.executor.run_each.call_args[0][0]
+        self.assertEqual(['target1'], [host for host, _ in release_commands])
+        mocked_release_command.assert_called_once_with([4401])
+
+    def test_open_firewalls_port_sets(self):
+        """Test open_firewalls opens a set of ports per target with a single rule"""
+        self.options['port'] = 0
+        self.executor.run_each.side_effect = [
+            [MagicMock(returncode=0, stdout='[4400, 4402, 4403, 4404, 4405, 4406]')],
+            [MagicMock(returncode=0)] * 2]
+
+        ports = self.transferer.open_firewalls([('target1', 'source'), ('target1', 'source')], 3)
+
+        self.assertEqual([[4400, 4402, 4403], [4404, 4405, 4406]], ports)
+        commands = self.executor.run_each.call_args[0][0]
+        self.assertIn('4400,4402,4403', commands[0][1])
+        self.assertIn('multiport', commands[0][1])
+
+        self.executor.run_each.side_effect = None
+
+        self.options['port'] = 4444
+        self.executor.run_each.return_value = [MagicMock(returncode=0)]
+        self.assertEqual([[4444, 4445]], self.transferer.open_firewalls([('target1', 'source')], 2))
+
+        # the rules of the same host get consecutive port sets
+        self.executor.run_each.return_value = [MagicMock(returncode=0)] * 2
+        self.assertEqual([[4444, 4445], [4444, 4445], [4446, 4447]],
+                         self.transferer.open_firewalls([('target1', 'source'),
+                                                         ('target2', 'source'),
+                                                         ('target1', 'source')], 2))
+
+    def test_open_firewalls_ipset(self):
+        """Test the ports of the ipset hosts are opened and closed with a call per host"""
+        self.options['port'] = 4444
+        self.transferer.firewall_backends = {'target1': 'ipset', 'target2': 'iptables'}
+        self.executor.run_each.return_value = [MagicMock(returncode=0)] * 3
+        rules = [('target1', 'source'), ('target1', 'source'), ('target2', 'source'),
+                 ('target2', 'source')]
+
+        ports = self.transferer.open_firewalls(rules)
+        self.assertEqual([4444, 4445, 4444, 4445], ports)
+        commands = self.executor.run_each.call_args[0][0]
+        self.assertEqual(['target1', 'target2', 'target2'], [host for host, _ in commands])
+        self.assertIn('ipset', commands[0][1][-1])
+        self.assertEqual('/sbin/iptables', commands[1][1][0])
+
+        self.transferer.close_firewalls(rules, ports)
+        commands = self.executor.run_each.call_args[0][0]
+        self.assertEqual(['target1', 'target2', 'target2'], [host for host, _ in commands])
+
+    def test_open_firewalls_failing(self):
+        """Test open_firewalls raises if a rule could not be added"""
+        self.options['port'] = 4444
+        open_result = MagicMock()
+        open_result.returncode = 1
+        self.executor.run_each.return_value = [open_result]
+
+        with self.assertRaises(Exception):
+            self.transferer.open_firewalls([('target', 'source')])
+
+    def test_verify_targets(self):
+        """Test verify_targets checks all copied targets with batched calls"""
+        self.options.update({'type': 'file', 'checksum': True})
+        self.transferer.checksum = Manifest('path/a\t1\td1\n')
+        facts = {'paths': {'path1/path': {'exists': True, 'size': 0},
+                           'path2/path': {'exists': True, 'size': 0}}}
+        probe_result = MagicMock()
+        probe_result.returncode = 0
+        probe_result.stdout = json.dumps(facts)
+        self.executor.run_each.return_value = [probe_result, probe_result]
+        self.executor.run_stream.side_effect = lambda host, command: self.stream_result(
+            0, 'path/a\t1\td1\n')
+
+        result = self.transferer.verify_targets([0, 1, 0], [('target1', 'path1'),
+                                                            ('target2', 'path2'),
+                                                            ('target3', 'path2')])
+
+        self.assertEqual([0, 1, 0], result)
+        self.assertEqual(['target1', 'target3'],
+                         [host for host, _ in self.executor.run_each.call_args_list[0][0][0]])
+        # the checksums are streamed
+        self.assertEqual(['target1', 'target3'],
+                         [call[0][0] for call in self.executor.run_stream.call_args_list])
+        self.executor.run.assert_not_called()
+
+    def test_verify_targets_checksum_failing(self):
+        """Test verify_targets reports a failed checksum of a copy instead of raising"""
+        self.options.update({'type': 'file', 'checksum': True})
+        self.transferer.checksum = Manifest('path/a\t1\td1\n')
+        facts = {'paths': {'path1/path': {'exists': True, 'size': 0},
+                           'path2/path': {'exists': True, 'size': 0}}}
+        probe_result = MagicMock()
+        probe_result.returncode = 0
+        probe_result.stdout = json.dumps(facts)
+        self.executor.run_each.return_value = [probe_result, probe_result]
+        self.executor.run_stream.side_effect = [self.stream_result(1, ''),
+                                                self.stream_result(0, 'find: warning\n')]
+
+        with self.assertLogs(self.transferer.logger, 'ERROR') as logs:
+            result = self.transferer.verify_targets([0, 0], [('target1', 'path1'),
+                                                             ('target2', 'path2')])
+
+        self.assertEqual([3, 3], result)
+        self.assertIn('Checksum of the copy on target1 failed', logs.output[0])
+        self.assertIn('could not be compared: invalid manifest line: find: warning',
+                      logs.output[1])
+
+    def test_verify_targets_inline_checksum(self):
+        """Test verify_targets compares the digests of both ends of each copy"""
+        self.options.update({'type': 'file', 'checksum': False, 'inline_checksum': True})
+        facts = {'paths': {'path1/path': {'exists': True, 'size': 0},
+                           'path2/path': {'exists': True, 'size': 0}}}
+        probe_result = MagicMock()
+        probe_result.returncode = 0
+        probe_result.stdout = json.dumps(facts)
+        digest_results = []
+        for digest in ['path/a\t1\td1\n', 'path/a\t1\td1\n', 'path/a\t1\td2\n']:
+            digest_results.append(MagicMock())
+            digest_results[-1].returncode = 0
+            digest_results[-1].stdout = digest
+        self.executor.run_each.side_effect = [[probe_result, probe_result], digest_results]
+
+        result = self.transferer.verify_targets([0, 0], [('target1', 'path1'),
+                                                         ('target2', 'path2')],
+                                                [4400, 4401], [4400, 4400])
+
+        self.assertEqual([0, 3], result)
+        # the source digest is read once for both targets of the chain
+        self.assertEqual([('source', 'src'), ('target1', 'dst'), ('target2', 'dst')],
+                         [(host, command[-1].split('.')[-2])
+                          for host, command in self.executor.run_each.call_args[0][0]])
+        self.executor.run.assert_not_called()
+
+    def test_copy_to_inline_checksum(self):
+        """Test copy_to hashes the stream on both ends with inline checksums"""
+        self.options.update({'port': 4400, 'compress': True, 'encrypt': True,
+                             'inline_checksum': True})
+        self.transferer.source_is_dir = True
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 0
+        self.transferer.copy_to('target', 'path', 4444)
+
+        src_command = self.executor.run.call_args[0][1][-1]
+        dst_command = self.executor.start_job.call_args[0][1][-1]
+        src_fifo = self.transferer.inline_hasher.paths(4444, 'src')[0]
+        dst_fifo = self.transferer.inline_hasher.paths(4444, 'dst')[0]
+        self.assertIn('/bin/tar cf - path | /usr/bin/tee {} | /usr/bin/pigz'.format(src_fifo),
+                      src_command)
+        self.assertIn('/usr/bin/pigz -c -d | /usr/bin/tee {} | /bin/tar'.format(dst_fifo),
+                      dst_command)
+        self.assertTrue(src_command.endswith('&& wait"'))
+        self.assertTrue(dst_command.endswith('&& wait"'))
+
+    def test_after_transfer_checks_checksum_mismatch(self):
+        """Test after_transfer_checks reports the files that differ on the copy"""
+        self.options.update({'type': 'file', 'checksum': True})
+        self.transferer.checksum = Manifest('path/a\t1\td1\npath/b\t1\td2\npath/c\t1\td3\n')
+        target_facts = {'paths': {'path/path': {'exists': True, 'size': 0}}}
+        target_checksum = Manifest('path/a\t1\td1\npath/c\t2\td3\npath/d\t1\td4\n')
+
+        with self.assertLogs(self.transferer.logger, 'ERROR') as logs:
+            result = self.transferer.after_transfer_checks(0, 'target', 'path', target_facts,
+                                                           target_checksum)
+
+        self.assertEqual(3, result)
+        self.assertIn('Missing file on the copy to target: path/b', logs.output[0])
+        self.assertIn('Changed file on the copy to target: path/c', logs.output[1])
+        self.assertIn('Extra file on the copy to target: path/d', logs.output[2])
+        self.assertIn('1 changed, 1 missing and 1 extra files', logs.output[3])
+
+    def test_copy_to_uses_given_port(self):
+        """Test copy_to sends and listens on the port it is given"""
+        self.options['port'] = 4400
+        self.options['compress'] = True
+        self.options['encrypt'] = True
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 0
+        self.transferer.copy_to('target', 'path', 4444)
+
+        src_command = self.executor.run.call_args[0][1][-1]
+        dst_command = self.executor.start_job.call_args[0][1][-1]
+        self.assertIn('target 4444', src_command)
+        self.assertIn('-p 4444', dst_command)
+
+    def test_chain_copy_to(self):
+        """Test chain_copy_to relays the stream from target to target"""
+        self.options['compress'] = True
+        self.options['encrypt'] = True
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 0
+        self.executor.wait_job.return_value = MagicMock()
+        self.executor.wait_job.return_value.returncode = 0
+        targets = [('target1', 'path1', 4400, 4401), ('target2', 'path2', 4401, None)]
+        result = self.transferer.chain_copy_to(targets)
+
+        self.assertEqual([0, 0], result)
+        # the end of the chain is started first
+        first_job, second_job = self.executor.start_job.call_args_list
+        self.assertEqual('target2', first_job[0][0])
+        self.assertNotIn('tee', first_job[0][1][-1])
+        self.assertEqual('target1', second_job[0][0])
+        self.assertIn('tee >(/bin/nc -q 0 -w 300 target2 4401)', second_job[0][1][-1])
+        # the source only sends to the first target
+        source_calls = [c for c in self.executor.run.call_args_list if c[0][0] == 'source']
+        self.assertEqual(1, len(source_calls))
+        self.assertIn('target1 4400', source_calls[0][0][1][-1])
+
+    def test_run_chain(self):
+        """Test case for Transferer.run function in chain mode"""
+        self.transferer.target_hosts = ['target1', 'target2']
+        self.transferer.target_paths = ['path1', 'path2']
+        self.options['chain'] = True
+        with patch.object(Transferer, 'sanity_checks'), \
+                patch.object(Transferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(Transferer, 'close_firewalls'), \
+                patch.object(Transferer, 'chain_copy_to') as mocked_chain_copy_to, \
+                patch.object(Transferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [4400, 4401]
+            mocked_chain_copy_to.return_value = [0, 0]
+            mocked_verify_targets.return_value = [0, 0]
+            command = self.transferer.run()
+
+        self.assertEqual([0, 0], command)
+        # the second target accepts the stream from the first one
+        mocked_open_firewalls.assert_called_once_with([('target1', 'source'),
+                                                       ('target2', 'target1')])
+        mocked_chain_copy_to.assert_called_once_with([('target1', 'path1', 4400, 4401),
+                                                      ('target2', 'path2', 4401, None)])
+
+    def test_wait_for_listener_listening(self):
+        """Test wait_for_listener returns as soon as the port is listening"""
+        self.options['listen_timeout'] = 10
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 0
+        with patch('transferpy.Transferer.time.sleep') as mocked_sleep:
+            self.assertTrue(self.transferer.wait_for_listener('target', 4400, 'job'))
+
+        self.assertIn(':4400', self.executor.run.call_args[0][1][-1])
+        mocked_sleep.assert_not_called()
+
+    def test_wait_for_listener_backoff(self):
+        """Test wait_for_listener polls with an increasing interval until it listens"""
+        self.options['listen_timeout'] = 10
+        not_listening = MagicMock()
+        not_listening.returncode = 1
+        listening = MagicMock()
+        listening.returncode = 0
+        self.executor.run.side_effect = [not_listening, not_listening, listening]
+        self.executor.monitor_job.return_value = MagicMock()
+        self.executor.monitor_job.return_value.returncode = None
+        with patch('transferpy.Transferer.time.sleep') as mocked_sleep:
+            self.assertTrue(self.transferer.wait_for_listener('target', 4400, 'job'))
+
+        self.assertEqual([((0.1,),), ((0.2,),)], mocked_sleep.call_args_list)
+
+    def test_wait_for_listener_job_finished(self):
+        """Test wait_for_listener fails if the receiver finishes without listening"""
+        self.options['listen_timeout'] = 10
+        self.executor.run.return_value = MagicMock()
+        self.executor.run.return_value.returncode = 1
+        self.executor.monitor_job.return_value = MagicMock()
+        self.executor.monitor_job.return_value.returncode = 1
+        with patch('transferpy.Transferer.time.sleep'):
+            self.assertFalse(self.transferer.wait_for_listener('target', 4400, 'job'))
+
+    def test_copy_to_not_listening(self):
+        """Test copy_to does not start the sender if the receiver does not listen"""
+        self.options['compress'] = True
+        self.options['encrypt'] = True
+        with patch.object(Transferer, 'wait_for_listener') as mocked_wait_for_listener:
+            mocked_wait_for_listener.return_value = False
+            result = self.transferer.copy_to('target', 'path', 4400)
+
+        self.assertNotEqual(0, result)
+        self.executor.run.assert_not_called()
+        self.executor.kill_job.assert_called_once()
+
+    def test_copy_to_progress(self):
+        """Test copy_to counts the bytes of the copy and reports its progress"""
+        self.options.update({'compress': True, 'encrypt': True, 'progress': True,
+                             'progress_interval': 0})
+        self.transferer.source_is_dir = True
+        self.transferer.original_size = 100
+        self.transferer.job_check_interval = 0
+        self.executor.monitor_job.side_effect = [MagicMock(returncode=None),
+                                                 MagicMock(returncode=0)]
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        with patch.object(self.transferer.progress, 'report') as mocked_report, \
+                patch.object(Transferer, 'wait_for_listener', return_value=True):
+            result = self.transferer.copy_to('target', 'path', 4400)
+
+        self.assertEqual(0, result)
+        self.executor.run.assert_not_called()
+        src_command = self.executor.start_job.call_args_list[1][0][1][-1]
+        dst_command = self.executor.start_job.call_args_list[0][0][1][-1]
+        progress = self.transferer.progress
+        self.assertIn('/bin/tar cf - path | /usr/bin/pv -f -n -b -i 1 2> {} |'
+                      .format(progress.counter_path(4400, 'read')), src_command)
+        self.assertIn('| /usr/bin/pv -f -n -b -i 1 2> {} | /bin/nc'
+                      .format(progress.counter_path(4400, 'sent')), src_command)
+        self.assertIn('/usr/bin/pigz -c -d | /usr/bin/pv -f -n -b -i 1 2> {} | /bin/tar'
+                      .format(progress.counter_path(4400, 'written')), dst_command)
+        self.assertEqual([('source', 4400, [('target', 4400)], 100, False),
+                          ('source', 4400, [('target', 4400)], 100, True)],
+                         [c[0] for c in mocked_report.call_args_list])
+
+    def test_copy_to_progress_failing(self):
+        """Test the progress of the copies is not an error of the transfer"""
+        self.options.update({'compress': False, 'encrypt': False, 'progress': True})
+        self.executor.monitor_job.return_value = MagicMock(returncode=0)
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        self.executor.run_each.side_effect = Exception('unreachable')
+
+        with self.assertLogs(self.transferer.logger, 'WARNING'), \
+                patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(0, self.transferer.copy_to('target', 'path', 4400))
+
+    def test_agent_commands(self):
+        """Test the agent replaces nc, and moves plain files by itself"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'agent': True})
+        self.transferer.original_size = 1000
+        agent = self.transferer.agent
+
+        # plain files are sent and written by the agents
+        self.assertEqual(['/bin/bash', '-c', '"{}"'.format(agent.send_command('target', 4400,
+                                                                              'path'))],
+                         self.transferer.sender_command('target', 4400))
+        self.assertEqual(['/bin/bash', '-c', '"{}"'.format(agent.receive_command(4400,
+                                                                                 'path/path'))],
+                         self.transferer.receiver_command('path', 4400))
+        self.assertIn(agent.send_command('target', 4400, 'path', 200, 300),
+                      self.transferer.stream_sender_command('target', 4400, 200, 300)[-1])
+        self.assertIn(agent.receive_command(4400, 'path/path', 200),
+                      self.transferer.stream_receiver_command('path/path', 4400, 200)[-1])
+        self.assertNotIn('/bin/nc', self.transferer.source_binaries + self.transferer.target_binaries)
+
+        # compressed streams go through the agent in place of nc
+        self.options['compress'] = True
+        self.assertTrue(self.transferer.sender_command('target', 4400)[-1].endswith(
+            '| {}"'.format(agent.send_command('target', 4400))))
+        self.assertTrue(self.transferer.receiver_command('path', 4400)[-1].startswith(
+            '"{} |'.format(agent.receive_command(4400))))
+
+    def test_sender_command_bandwidth_limit(self):
+        """Test the bytes sent are limited, sharing the total limit between copies"""
+        self.options.update({'compress': True, 'encrypt': False, 'checksum': False,
+                             'bwlimit': 3000, 'target_bwlimits': {'target2': 500}})
+        with patch('transferpy.Transferer.RemoteExecution', return_value=self.executor):
+            self.transferer = Transferer('source', 'path', ['target1', 'target2'],
+                                         ['path', 'path'], self.options)
+        self.transferer.source_is_dir = True
+        self.transferer.concurrent_copies = 2
+        pid_path = self.transferer.bandwidth_limiter.pid_path(4400)
+
+        self.assertIn('/usr/bin/pigz -c | /usr/bin/pv -q -L 1500 -P {} | /bin/nc'.format(pid_path),
+                      self.transferer.sender_command('target1', 4400)[-1])
+        self.assertIn('-L 500 ', self.transferer.sender_command('target2', 4400)[-1])
+        self.assertIn('/usr/bin/pv', self.transferer.source_binaries)
+        # a chain is limited by its slowest link
+        self.options['chain'] = True
+        self.assertIn('-L 500 ', self.transferer.sender_command('target1', 4400)[-1])
+
+    def test_copy_to_adjusts_bandwidth_limit(self):
+        """Test the changes of the bandwidth limit file are applied to the running copy"""
+        self.options.update({'compress': False, 'encrypt': False, 'bwlimit_file': 'bwlimit'})
+        with patch('transferpy.Transferer.RemoteExecution', return_value=self.executor):
+            self.transferer = Transferer('source', 'path', ['target'], ['path'], self.options)
+        self.transferer.job_check_interval = 0
+        limiter = self.transferer.bandwidth_limiter
+
+        def reload():
+            if limiter.version == 0:
+                limiter.limit = 2048
+                limiter.version = 1
+        self.executor.monitor_job.side_effect = [MagicMock(returncode=None),
+                                                 MagicMock(returncode=None),
+                                                 MagicMock(returncode=0)]
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        self.executor.run.return_value = MagicMock(returncode=0)
+        with patch.object(limiter, 'reload', side_effect=reload), \
+                patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(0, self.transferer.copy_to('target', 'path', 4400))
+
+        self.assertIn('-L 0 ', self.executor.start_job.call_args_list[1][0][1][-1])
+        self.executor.run.assert_called_once_with('source', limiter.update_command(4400, 2048))
+
+    def test_run_streams_adjusts_bandwidth_limit(self):
+        """Test the changes of the bandwidth limit file are split among the running streams"""
+        self.options.update({'compress': False, 'encrypt': False, 'bwlimit_file': 'bwlimit',
+                             'streams': 2})
+        with patch('transferpy.Transferer.RemoteExecution', return_value=self.executor):
+            self.transferer = Transferer('source', 'path', ['target'], ['path'], self.options)
+        self.transferer.job_check_interval = 0
+        limiter = self.transferer.bandwidth_limiter
+
+        def reload():
+            if limiter.version == 0:
+                limiter.limit = 2048
+                limiter.version = 1
+        self.executor.start_job.side_effect = ['receiver1', 'receiver2', 'sender1', 'sender2']
+        self.executor.monitor_job.side_effect = [MagicMock(returncode=None),
+                                                 MagicMock(returncode=None),
+                                                 MagicMock(returncode=0),
+                                                 MagicMock(returncode=0)]
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        self.executor.run_each.return_value = [MagicMock(returncode=0)] * 2
+        with patch.object(limiter, 'reload', side_effect=reload), \
+                patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(0, self.transferer.run_streams('target', [(4400, 'send1', 'recv1'),
+                                                                       (4401, 'send2', 'recv2')]))
+
+        self.executor.run_each.assert_called_once_with(
+            [('source', limiter.update_command(4400, 1024)),
+             ('source', limiter.update_command(4401, 1024))])
+
+    def test_multistream_copy_to(self):
+        """Test a file is sent in byte ranges, each one on its own port"""
+        self.options.update({'type': 'file', 'compress': True, 'encrypt': True, 'streams': 2})
+        self.transferer.original_size = 3 * 1024 * 1024
+        self.transferer.job_check_interval = 0
+        self.executor.run.return_value = MagicMock(returncode=0)
+        self.executor.start_job.side_effect = ['receiver1', 'receiver2', 'sender1', 'sender2']
+        self.executor.monitor_job.return_value = MagicMock(returncode=0)
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        with patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(0, self.transferer.multistream_copy_to('target', 'path', [4400, 4401]))
+
+        self.assertIn('fallocate -l 3145728 path/path', self.executor.run.call_args[0][1][-1])
+        commands = [c[0][1][-1] for c in self.executor.start_job.call_args_list]
+        self.assertIn('/bin/nc -l -w 300 -p 4401 | /usr/bin/openssl enc -d', commands[1])
+        self.assertIn('/usr/bin/pigz -c -d | /bin/dd of=path/path bs=1048576 seek=2097152 '
+                      'oflag=seek_bytes conv=notrunc', commands[1])
+        self.assertIn('/bin/dd if=path bs=1048576 skip=2097152 count=1048576', commands[3])
+        self.assertIn('| /usr/bin/pigz -c | /usr/bin/openssl enc', commands[3])
+        self.assertIn('/bin/nc -q 0 -w 300 target 4401', commands[3])
+        self.assertEqual(['receiver1', 'receiver2'],
+                         [c[0][1] for c in self.executor.wait_job.call_args_list])
+
+    def test_multistream_copy_to_failing(self):
+        """Test a failed stream stops the whole copy"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False, 'streams': 2})
+        self.transferer.original_size = 3 * 1024 * 1024
+        self.transferer.job_check_interval = 0
+        self.executor.run.return_value = MagicMock(returncode=0)
+        self.executor.start_job.side_effect = ['receiver1', 'receiver2', 'sender1', 'sender2']
+        self.executor.monitor_job.side_effect = lambda host, job: MagicMock(
+            returncode=None if job == 'sender1' else 2)
+        with patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(2, self.transferer.multistream_copy_to('target', 'path', [4400, 4401]))
+
+        self.assertEqual(['sender1', 'receiver1', 'receiver2'],
+                         [c[0][1] for c in self.executor.kill_job.call_args_list])
+        self.executor.wait_job.assert_not_called()
+
+    def test_sharded_copy_to(self):
+        """Test a directory is sent in shards, each one by its own tar stream"""
+        self.options.update({'type': 'file', 'compress': True, 'encrypt': False, 'streams': 2})
+        self.transferer.source_is_dir = True
+        self.transferer.source_path = '/srv/data'
+        self.transferer.shards = [{'list': '/tmp/0.shard', 'files': 2, 'size': 10},
+                                  {'list': '/tmp/1.shard', 'files': 1, 'size': 9}]
+        self.transferer.job_check_interval = 0
+        self.executor.start_job.side_effect = ['receiver1', 'receiver2', 'sender1', 'sender2']
+        self.executor.monitor_job.return_value = MagicMock(returncode=0)
+        self.executor.wait_job.return_value = MagicMock(returncode=0)
+        with patch.object(Transferer, 'wait_for_listener', return_value=True):
+            self.assertEqual(0, self.transferer.sharded_copy_to('target', 'path', [4400, 4401]))
+
+        commands = [c[0][1][-1] for c in self.executor.start_job.call_args_list]
+        self.assertEqual('"cd path && /bin/nc -l -w 300 -p 4401 | /usr/bin/pigz -c -d | '
+                         '/bin/tar xf -"', commands[1])
+        self.assertEqual('"cd /srv && /bin/tar cf - --no-recursion --null -T /tmp/1.shard | '
+                         '/usr/bin/pigz -c | /bin/nc -q 0 -w 300 target 4401"', commands[3])
+
+    def test_run_sharded(self):
+        """Test run splits the directory and opens a port per shard"""
+        self.options.update({'type': 'file', 'streams': 4, 'port': 0})
+        self.transferer.source_is_dir = True
+        shards = [{'list': '/tmp/0.shard', 'files': 2, 'size': 10},
+                  {'list': '/tmp/1.shard', 'files': 1, 'size': 9}]
+        with patch.object(Transferer, 'sanity_checks'), \
+                patch.object(self.transferer.sharder, 'run', return_value=shards), \
+                patch.object(Transferer, 'open_firewalls') as mocked_open_firewalls, \
+                patch.object(Transferer, 'close_firewalls'), \
+                patch.object(Transferer, 'sharded_copy_to', return_value=0) as mocked_copy_to, \
+                patch.object(Transferer, 'verify_targets') as mocked_verify_targets:
+            mocked_open_firewalls.return_value = [[4400, 4401]]
+            mocked_verify_targets.side_effect = lambda results, targets, *ports: results
+            self.assertEqual([0], self.transferer.run())
+
+        mocked_open_firewalls.assert_called_once_with([('target', 'source')], 2)
+        mocked_copy_to.assert_called_once_with('target', 'path', [4400, 4401])
+        self.executor.run.assert_called_once_with('source', ['/bin/rm', '-f', '/tmp/0.shard',
+                                                             '/tmp/1.shard'])
+
+    def test_sanity_checks_progress_without_pv(self):
+        """Test progress is not reported if pv is missing on any host"""
+        self.options.update({'type': 'file', 'compress': False, 'encrypt': False,
+                             'checksum': False, 'chain': False, 'progress': True})
+        self.assertIn('/usr/bin/pv', self.transferer.optional_binaries)
+        source_facts = {'paths': {'path': self.path_facts(is_dir=True, size=100)},
+                        'binaries': self.all_binaries()}
+        target_facts = {'paths': {'path': self.path_facts(is_dir=True, available=1000),
+                                  'path/path': self.path_facts(exists=False)},
+                        'binaries': self.all_binaries()}
+        target_facts['binaries']['/usr/bin/pv'] = False
+        self.executor.run_each.return_value = [MagicMock(returncode=0,
+                                                         stdout=json.dumps(target_facts))]
+        with patch.object(self.transferer.probe, 'run') as mocked_probe:
+            mocked_probe.return_value = source_facts
+            with self.assertLogs(self.transferer.logger, 'WARNING'):
+                self.transferer.sanity_checks()
+
+        self.assertFalse(self.options['progress'])
+        self.assertEqual('', self.transferer.progress_command(4400, 'read'))
 
     def test_run_start_slave(self):
         """Test case for Transferer.run function for when it runs the
            start_slave function with the stop_slave option
         """
-        with patch('transferpy.Transferer.MariaDB.stop_replication') as mocked_stop_replication,\
-                patch.object(Transferer, 'sanity_checks') as mocked_sanity_check,\
-                patch('transferpy.Transferer.Firewall.open') as mocked_open_firewall,\
-                patch.object(Transferer, 'copy_to') as mocked_copy_to,\
-                patch('transferpy.Transferer.Firewall.close') as mocked_close_firewall,\
-                patch.object(Transferer, 'after_transfer_checks') as mocked_after_transfer_checks,\
+        with patch('transferpy.Transferer.MariaDB.stop_replication') as mocked_stop_replication, \
+                patch.object(Transferer, 'sanity_checks') as mocked_sanity_check, \
+                patch('transferpy.Transferer.Firewall.open') as mocked_open_firewall, \
+                patch.object(Transferer, 'copy_to') as mocked_copy_to, \
+                patch('transferpy.Transferer.Firewall.close') as mocked_close_firewall, \
+                patch.object(Transferer, 'after_transfer_checks') as mocked_after_transfer_checks, \
                 patch('transferpy.Transferer.MariaDB.start_replication') as mocked_start_replication:
             self.options['port'] = 4444
             self.options['stop_slave'] = True
@@ -198,7 +1137,7 @@ class TestTransferer(unittest.TestCase):
             mocked_sanity_check.called_once()
             mocked_open_firewall.called_once()
             command = self.transferer.run()
-            self.assertTrue(type(command) == list)
+            self.assertIsInstance(command, list)
 
 
 class TestArgumentParsing(unittest.TestCase):
@@ -271,6 +1210,170 @@ class TestArgumentParsing(unittest.TestCase):
         self.assertTrue(other_options['compress'])
         self.assertTrue(other_options['encrypt'])
 
+    def test_parallel_targets(self):
+        """Test parallel-targets param."""
+        base_args = ['transfer', 'source:path', 'target1:path', 'target2:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual(other_options['parallel_targets'], 1)
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--parallel-targets', '2'])
+        self.assertEqual(other_options['parallel_targets'], 2)
+
+    def test_checksum_algorithm(self):
+        """Test checksum-algorithm param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual(other_options['checksum_algorithm'], 'md5')
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--checksum-algorithm', 'xxh128'])
+        self.assertEqual(other_options['checksum_algorithm'], 'xxh128')
+
+        self.check_bad_args(base_args + ['--checksum-algorithm', 'crc32'])
+
+    def test_inline_checksum(self):
+        """Test inline-checksum param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertFalse(other_options['inline_checksum'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--inline-checksum'])
+        self.assertTrue(other_options['inline_checksum'])
+
+        self.check_bad_args(base_args + ['--inline-checksum', '--no-checksum'])
+
+    def test_bwlimit(self):
+        """Test bandwidth limit params."""
+        base_args = ['transfer', 'source:path', 'target1:path', 'target2:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertIsNone(other_options['bwlimit'])
+        self.assertEqual({}, other_options['target_bwlimits'])
+        self.assertIsNone(other_options['bwlimit_file'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--bwlimit', '100M', '--target-bwlimit', 'target1=1K',
+                                             '--target-bwlimit', 'target2=5',
+                                             '--bwlimit-file', '/etc/bwlimit'])
+        self.assertEqual(100 * 1024 * 1024, other_options['bwlimit'])
+        self.assertEqual({'target1': 1024, 'target2': 5}, other_options['target_bwlimits'])
+        self.assertEqual('/etc/bwlimit', other_options['bwlimit_file'])
+
+        self.check_bad_args(base_args + ['--bwlimit', 'fast'])
+        self.check_bad_args(base_args + ['--target-bwlimit', '100M'])
+
+    def test_streams(self):
+        """Test streams param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual(other_options['streams'], 1)
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--streams', '8'])
+        self.assertEqual(other_options['streams'], 8)
+
+    def test_resume(self):
+        """Test resume param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertFalse(other_options['resume'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--resume'])
+        self.assertTrue(other_options['resume'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--resume', '--type', 'decompress'])
+        self.assertFalse(other_options['resume'])
+
+    def test_firewall(self):
+        """Test firewall params."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual('auto', other_options['firewall'])
+        self.assertEqual(86400, other_options['firewall_timeout'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--firewall', 'iptables', '--firewall-timeout', '60'])
+        self.assertEqual('iptables', other_options['firewall'])
+        self.assertEqual(60, other_options['firewall_timeout'])
+
+        self.check_bad_args(base_args + ['--firewall', 'nftables'])
+
+    def test_agent(self):
+        """Test agent param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertFalse(other_options['agent'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--agent'])
+        self.assertTrue(other_options['agent'])
+
+    def test_port_range(self):
+        """Test port range param."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual((4400, 4500), other_options['port_range'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--port-range', '5000-5999'])
+        self.assertEqual((5000, 6000), other_options['port_range'])
+
+        self.check_bad_args(base_args + ['--port-range', '5999-5000'])
+        self.check_bad_args(base_args + ['--port-range', '5000'])
+
+    def test_sync(self):
+        """Test sync params."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertFalse(other_options['sync'])
+        self.assertFalse(other_options['sync_checksum'])
+        self.assertFalse(other_options['sync_delete'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--sync', '--sync-checksum', '--delete'])
+        self.assertTrue(other_options['sync'])
+        self.assertTrue(other_options['sync_checksum'])
+        self.assertTrue(other_options['sync_delete'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--sync', '--type', 'xtrabackup'])
+        self.assertFalse(other_options['sync'])
+
+    def test_progress(self):
+        """Test progress params."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertFalse(other_options['progress'])
+        self.assertEqual(other_options['progress_interval'], 10)
+        self.assertIsNone(other_options['progress_json'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--progress'])
+        self.assertTrue(other_options['progress'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--no-progress', '--progress-interval', '30',
+                                             '--progress-json', '-'])
+        self.assertFalse(other_options['progress'])
+        self.assertEqual(other_options['progress_interval'], 30)
+        self.assertEqual(other_options['progress_json'], '-')
+
+        self.check_bad_args(base_args + ['--progress', '--no-progress'])
+
     def test_compress(self):
         """Test compress params."""
         base_args = ['transfer', 'source:path', 'target:path']
@@ -287,6 +1390,34 @@ class TestArgumentParsing(unittest.TestCase):
         self.assertFalse(other_options['compress'])
         self.assertTrue(other_options['encrypt'])
 
+    def test_compressor(self):
+        """Test compressor params."""
+        base_args = ['transfer', 'source:path', 'target:path']
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args)
+        self.assertEqual('pigz', other_options['compressor'])
+        self.assertIsNone(other_options['compress_level'])
+        self.assertIsNone(other_options['compress_threads'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--compressor', 'zstd', '--compress-level', '3',
+                                             '--compress-threads', '8'])
+        self.assertTrue(other_options['compress'])
+        self.assertEqual('zstd', other_options['compressor'])
+        self.assertEqual(3, other_options['compress_level'])
+        self.assertEqual(8, other_options['compress_threads'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--compressor', 'none'])
+        self.assertFalse(other_options['compress'])
+
+        (source_host, source_path, target_hosts, target_paths, other_options)\
+            = self.option_parse(base_args + ['--compressor', 'auto'])
+        self.assertTrue(other_options['compress'])
+        self.assertEqual('auto', other_options['compressor'])
+
+        self.check_bad_args(base_args + ['--compressor', 'bzip2'])
+
     def test_encrypt(self):
         """Test encrypt params."""
         base_args = ['transfer', 'source:path', 'target:path']
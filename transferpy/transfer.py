@@ -1,8 +1,12 @@
 #!/usr/bin/python3
 
 import argparse
+import re
 import sys
 import logging
+from transferpy.BandwidthLimit import parse_rate
+from transferpy.Firewall import (BACKENDS as FIREWALL_BACKENDS, DEFAULT_PORT_RANGE,
+                                 DEFAULT_TIMEOUT as FIREWALL_TIMEOUT)
 from transferpy.Transferer import Transferer
 
 
@@ -40,6 +44,45 @@ def setup_logger(verbose):
         logger.setLevel(logging.INFO)
 
 
+def bandwidth_limit(value):
+    """
+    argparse type of the bandwidth limits.
+
+    :param value: rate in BandwidthLimit.parse_rate format
+    :return: bytes per second
+    """
+    try:
+        return parse_rate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def target_bandwidth_limit(value):
+    """
+    argparse type of the bandwidth limits of a target host.
+
+    :param value: string in the form of hostname=rate
+    :return: hostname, bytes per second
+    """
+    host, _, rate = value.rpartition('=')
+    if not host:
+        raise argparse.ArgumentTypeError('target bandwidth limits must be given as HOST=RATE')
+    return host, bandwidth_limit(rate)
+
+
+def port_range(value):
+    """
+    argparse type of the range of ports searched for the receivers.
+
+    :param value: string in the form of first-last, both included
+    :return: (first, last + 1) tuple
+    """
+    match = re.match(r'^(\d+)-(\d+)$', value)
+    if match is None or not 0 < int(match.group(1)) <= int(match.group(2)) < 65536:
+        raise argparse.ArgumentTypeError('port ranges must be given as FIRST-LAST')
+    return int(match.group(1)), int(match.group(2)) + 1
+
+
 def parse_arguments():
     """
     Parses the input parameters.
@@ -54,8 +97,31 @@ def parse_arguments():
                                      formatter_class=RawOption)
     parser.add_argument("--port", type=int, default=0,
                         help="Port used for netcat listening on the receiver machine. "
-                             " By default, transfer selects a free port available in the receiver"
-                             " machine from the range 4400 to 4500")
+                             " Further copies to the same machine use the following ports."
+                             " By default, transfer leases a free port available in the receiver"
+                             " machine from --port-range, so concurrent transfers to the same"
+                             " machine never get the same port")
+    parser.add_argument('--port-range', type=port_range, default=DEFAULT_PORT_RANGE,
+                        dest='port_range', metavar='FIRST-LAST',
+                        help="Ports leased when --port is not given, both included. "
+                             "Default: {}-{}".format(DEFAULT_PORT_RANGE[0], DEFAULT_PORT_RANGE[1] - 1))
+    parser.add_argument('--agent', action='store_true',
+                        help="Move the data with a transferpy agent run on both ends instead of "
+                             "nc. It frames the stream, with a CRC-32 of its data, so copies cut "
+                             "short or corrupted fail on both ends, "
+                             "uses large socket buffers, and sends and writes files that are "
+                             "neither compressed nor encrypted by itself, with sendfile and "
+                             "splice. By default, nc is used.")
+    parser.add_argument('--firewall', choices=['auto'] + FIREWALL_BACKENDS, default='auto',
+                        help="How the receivers' ports are opened: 'ipset' adds all the ports of "
+                             "a target host at once to a set matched by a single iptables rule, "
+                             "with entries that expire on their own; 'iptables' adds a rule per "
+                             "copy. By default, ipset is used on the target hosts that have it.")
+    parser.add_argument('--firewall-timeout', type=int, default=FIREWALL_TIMEOUT,
+                        dest='firewall_timeout',
+                        help="Seconds the ipset entries opening the ports, and the leases of the "
+                             "ports, last, in case a transfer cannot remove them. "
+                             "Default: {} seconds".format(FIREWALL_TIMEOUT))
     parser.add_argument("--type", choices=['file', 'xtrabackup', 'decompress'],
                         dest='transfer_type', default='file',
                         help="raw|file: regular file or directory recursive copy (Default)\n"
@@ -81,6 +147,23 @@ def parse_arguments():
     compress_group.add_argument('--no-compress', action='store_false', dest='compress',
                                 help="Do not use compression on streaming")
     parser.set_defaults(compress=True)
+    parser.add_argument('--compressor', choices=['pigz', 'zstd', 'lz4', 'auto', 'none'],
+                        default='pigz',
+                        help="raw|Compression codec of the stream, needed on all hosts (ignored on "
+                             "decompress mode, where the codec of the archive is detected):\n"
+                             "pigz: gzip format, parallel compression (Default)\n"
+                             "zstd: parallel compression, faster decompression\n"
+                             "lz4: fastest, lowest compression ratio\n"
+                             "auto: sample the source and choose the codec and level that move\n"
+                             "      it the fastest, or no compression if it does not pay off\n"
+                             "none: same as --no-compress")
+    parser.add_argument('--compress-level', type=int, dest='compress_level',
+                        help="Compression level (1-11 for pigz, 1-19 for zstd, 1-12 for lz4, ignored "
+                             "with --compressor auto). "
+                             "By default, the one of the compressor.")
+    parser.add_argument('--compress-threads', type=int, dest='compress_threads',
+                        help="Compression threads of pigz and zstd. By default, all cores "
+                             "are used.")
 
     encrypt_group = parser.add_mutually_exclusive_group()
     encrypt_group.add_argument('--encrypt', action='store_true', dest='encrypt',
@@ -97,7 +180,19 @@ def parse_arguments():
                                      "(This only works for file transfers) (Default)")
     checksum_group.add_argument('--no-checksum', action='store_false', dest='checksum',
                                 help="Disable checksums")
+    checksum_group.add_argument('--inline-checksum', action='store_true', dest='inline_checksum',
+                                help="Instead of reading the files before and after the transfer, "
+                                     "hash the stream while it is sent and received (per file "
+                                     "for directories) with md5, and compare the digests of "
+                                     "both ends at the end. (This only works for file transfers)")
     parser.set_defaults(checksum=True)
+    parser.add_argument('--checksum-algorithm', choices=['auto', 'xxh128', 'blake3', 'md5'],
+                        dest='checksum_algorithm', default='md5',
+                        help="raw|Hash algorithm used by --checksum, the same one on all hosts:\n"
+                             "auto: the fastest one whose executable is on all hosts\n"
+                             "xxh128: xxh128sum, non-cryptographic\n"
+                             "blake3: b3sum\n"
+                             "md5: md5sum (Default)")
 
     parser.add_argument('--stop-slave', action='store_true', dest='stop_slave',
                         help="Only relevant if on xtrabackup mode: attempt to stop slave on the mysql instance "
@@ -105,6 +200,80 @@ def parse_arguments():
                              "backup by preventing many changes queued on the xtrabackup_log. "
                              "By default, it doesn't try to stop replication.")
 
+    parser.add_argument('--parallel-targets', type=int, default=1, dest='parallel_targets',
+                        help="Maximum number of targets the source is copied to at the same time, "
+                             "each one using its own port and nc listener. 0 means all of them at "
+                             "once. By default, targets are copied one after another.")
+
+    parser.add_argument('--chain', action='store_true',
+                        help="Read the source only once and relay it from target to target: the "
+                             "source sends to the first target, which writes it and forwards the "
+                             "compressed and encrypted stream to the second one, and so on. "
+                             "--parallel-targets is ignored. By default, the source sends a copy "
+                             "to every target.")
+
+    parser.add_argument('--streams', type=int, default=1,
+                        help="Send the source over up to this many connections at the same "
+                             "time, each one on its own port, with its own compression and "
+                             "encryption: a file is split in byte ranges, written at their offset "
+                             "of the copy; a directory in shards of about the same size, each "
+                             "one sent by its own tar, largest files first. Up to 15. Ignored for "
+                             "other transfer types and --chain. By default, a single stream.")
+
+    parser.add_argument('--resume', action='store_true',
+                        help="Keep a checkpoint next to every copy, so a failed transfer can be "
+                             "run again with --resume to send only what is left: the bytes of a "
+                             "file after the last checkpoint, or the files of a directory not "
+                             "fully copied, once a cheap check finds the partial copy matches "
+                             "the source. Only for file transfers; --chain, --streams and "
+                             "--inline-checksum are ignored.")
+
+    parser.add_argument('--sync', action='store_true',
+                        help="If the target already has a copy of the source directory, send only "
+                             "the files that are not on it with the same size and modification "
+                             "time, through the usual compression and encryption pipeline. "
+                             "Existing copies of a file are sent again whole. Only for file "
+                             "transfers; --chain and --streams are ignored.")
+    parser.add_argument('--sync-checksum', action='store_true', dest='sync_checksum',
+                        help="On --sync, compare the files by their size and md5 instead of their "
+                             "modification time. Slower, as all files are read on both ends.")
+    parser.add_argument('--delete', action='store_true', dest='sync_delete',
+                        help="On --sync, remove from the copies the files and directories that "
+                             "are not on the source.")
+
+    parser.add_argument('--listen-timeout', type=int, default=60, dest='listen_timeout',
+                        help="Seconds to wait for the receiver to be listening on the target host "
+                             "before the transfer to it is considered failed. Default: 60 seconds")
+
+    parser.add_argument('--bwlimit', type=bandwidth_limit, metavar='RATE',
+                        help="Maximum bytes per second the source sends, in total, after "
+                             "compression and encryption, optionally followed by K, M or G "
+                             "(e.g. 100M). Concurrent copies share it evenly. "
+                             "By default, the bandwidth is not limited.")
+    parser.add_argument('--target-bwlimit', type=target_bandwidth_limit, action='append',
+                        dest='target_bwlimits', metavar='HOST=RATE', default=[],
+                        help="Maximum bytes per second sent to the given target host, in the "
+                             "same format as --bwlimit. Can be given once per target.")
+    parser.add_argument('--bwlimit-file', dest='bwlimit_file', metavar='PATH',
+                        help="Local file the bandwidth limits are read from, and read again "
+                             "whenever it changes while the copies run: a line with the "
+                             "total limit and/or lines with a target host and its limit. "
+                             "It overrides --bwlimit and --target-bwlimit once it exists.")
+
+    progress_group = parser.add_mutually_exclusive_group()
+    progress_group.add_argument('--progress', action='store_true', dest='progress',
+                                help="Log periodically the bytes read from the source, sent and "
+                                     "written on each target, their rates, the percent done and "
+                                     "the ETA of every copy, measured with pv on the hosts")
+    progress_group.add_argument('--no-progress', action='store_false', dest='progress',
+                                help="Do not report the progress of the copies (Default)")
+    parser.set_defaults(progress=False)
+    parser.add_argument('--progress-interval', type=int, default=10, dest='progress_interval',
+                        help="Seconds between progress reports. Default: 10 seconds")
+    parser.add_argument('--progress-json', dest='progress_json', metavar='PATH',
+                        help="Also append every progress report, as a JSON line, to the given "
+                             "file, or to the standard output if it is '-'.")
+
     parser.add_argument('--verbose', action='store_true',
                         help="Outputs relevant information about transfer + information about Cuminexecution."
                              " By default, the output contains only relevant information about the transfer.")
@@ -146,11 +315,35 @@ def option_parse():
         target_paths.append(target_path)
     other_options = {
         'port': options.port,
+        'agent': options.agent,
+        'firewall': options.firewall,
+        'firewall_timeout': options.firewall_timeout,
+        'port_range': options.port_range,
         'type': options.transfer_type,
-        'compress': True if options.transfer_type == 'decompress' else options.compress,
+        'compress': (True if options.transfer_type == 'decompress'
+                     else options.compress and options.compressor != 'none'),
+        'compressor': options.compressor,
+        'compress_level': options.compress_level,
+        'compress_threads': options.compress_threads,
         'encrypt': options.encrypt,
         'checksum': False if not options.transfer_type == 'file' else options.checksum,
+        'checksum_algorithm': options.checksum_algorithm,
+        'inline_checksum': False if not options.transfer_type == 'file' else options.inline_checksum,
         'stop_slave': False if not options.transfer_type == 'xtrabackup' else options.stop_slave,
+        'parallel_targets': options.parallel_targets,
+        'chain': options.chain,
+        'streams': options.streams,
+        'resume': False if not options.transfer_type == 'file' else options.resume,
+        'sync': False if not options.transfer_type == 'file' else options.sync,
+        'sync_checksum': options.sync_checksum,
+        'sync_delete': options.sync_delete,
+        'listen_timeout': options.listen_timeout,
+        'bwlimit': options.bwlimit,
+        'target_bwlimits': dict(options.target_bwlimits),
+        'bwlimit_file': options.bwlimit_file,
+        'progress': options.progress,
+        'progress_interval': options.progress_interval,
+        'progress_json': options.progress_json,
         'verbose': options.verbose
     }
     return source_host, source_path, target_hosts, target_paths, other_options